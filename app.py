@@ -1,24 +1,39 @@
 """
 Streamlit app - UI for JSJ Drawing Management LPP Sync.
 """
+import sys
+import weakref
 import streamlit as st
-import pandas as pd
 from pathlib import Path
 from datetime import datetime, date
 
 from db import (
-    get_connection, criar_tabelas, get_all_desenhos, get_revisoes_by_desenho_id, 
+    DB_PATH, get_connection, open_read_snapshot, criar_tabelas, get_all_desenhos, get_revisoes_by_desenho_id, 
     get_desenho_by_layout, get_dwg_list, delete_all_desenhos, delete_desenhos_by_dwg, 
     delete_desenhos_by_tipo, delete_desenhos_by_elemento, delete_desenho_by_layout, 
     get_db_stats, get_all_desenhos_with_revisoes, get_unique_tipos, get_unique_elementos, 
     get_all_layout_names, update_estado_interno, update_estado_e_comentario,
-    get_historico_comentarios, get_desenhos_by_estado, get_desenhos_em_atraso,
+    get_historico_comentarios, get_desenho_audit, get_desenho_as_of, AUDIT_COLUMNS,
+    get_desenhos_by_estado, get_desenhos_em_atraso,
     get_desenho_by_id, get_stats_by_estado, ESTADOS_VALIDOS,
-    get_unique_revision_dates, get_desenhos_at_date
+    get_unique_revision_dates, get_desenhos_at_date, get_historico_diff, HISTORICO_DIFF_STATUS,
+    insert_perf_log, get_perf_trend,
+    JOB_ACTIVE_STATUSES, get_jobs, save_desenho_edits, VersionConflict
 )
-from json_importer import import_all_json
-from csv_importer import import_all_csv, import_single_csv
-from lpp_builder import build_lpp_from_db
+from exporter import export_all_dwgs, export_autocad_csv
+from frames import load_desenhos_df, view_columns
+from sorting import NATURAL_SORT_COLUMNS, sort_dataframe, sorted_values
+from utils import atomic_write_path, lazy_import
+import jobs
+import perf
+import result_cache
+import telemetry
+
+# pandas is only loaded when a view actually builds a DataFrame
+pd = lazy_import("pandas")
+
+# Colunas mostradas por defeito na tabela (inclui estado)
+DEFAULT_VIEW_COLUMNS = ['estado_interno', 'des_num', 'layout_name', 'tipo_display', 'elemento', 'titulo', 'r', 'comentario', 'data_limite']
 
 # Estado interno colors and labels
 ESTADO_CONFIG = {
@@ -35,6 +50,9 @@ st.set_page_config(
     layout="wide"
 )
 
+# Start collecting timings for this rerun (see "⏱️ Performance" in the sidebar)
+perf.start_run()
+
 # Initialize database (create tables once)
 def init_db():
     """Initialize database - create tables if needed."""
@@ -43,6 +61,28 @@ def init_db():
     conn.close()
 
 init_db()
+perf.lap("app.init_db")
+
+
+def open_page_snapshot():
+    """
+    Read snapshot for this rerun (db.open_read_snapshot): every number, list and
+    table on the page comes from the same database state, even mid-import.
+
+    Closed at the end of the page. A run that ends before it (st.rerun(),
+    st.stop(), an exception, a closed tab) is caught by a finalizer on this
+    run's __main__ module: Streamlit replaces that module when the next run of
+    any session starts, so a snapshot left open (it would block WAL
+    checkpoints) lives until then at most.
+    """
+    snapshot = open_read_snapshot()
+    weakref.finalize(sys.modules['__main__'], snapshot.close)
+    return snapshot
+
+
+# Leituras da página (não as escritas nem o painel de tarefas) usam este snapshot
+snapshot = open_page_snapshot()
+perf.lap("app.snapshot")
 
 # Sidebar
 st.sidebar.title("🔧 Operações")
@@ -52,35 +92,22 @@ st.sidebar.markdown("---")
 # Import section
 st.sidebar.subheader("1. Atualizar DB")
 
+def notify_job_submitted(job_id: int, created: bool):
+    """Sidebar feedback after submit_job(); the panel below shows the progress."""
+    st.session_state.setdefault('watched_jobs', set()).add(job_id)
+    if created:
+        st.sidebar.info(f"⏳ Tarefa #{job_id} em fila")
+    else:
+        st.sidebar.info(f"⏳ Tarefa idêntica já em curso (#{job_id})")
+
+
 # Import JSON
 if st.sidebar.button("📥 Importar JSON", use_container_width=True):
-    with st.spinner("Importando JSON files..."):
-        try:
-            conn = get_connection()
-            stats = import_all_json("data/json_in", conn)
-            conn.close()
-            st.sidebar.success(
-                f"✅ Importação JSON concluída!\n\n"
-                f"Ficheiros: {stats['files_processed']}\n"
-                f"Desenhos: {stats['desenhos_imported']}"
-            )
-        except Exception as e:
-            st.sidebar.error(f"❌ Erro: {e}")
+    notify_job_submitted(*jobs.submit_job('import_json', {'json_dir': "data/json_in"}))
 
 # Import CSV
 if st.sidebar.button("📄 Importar CSV", use_container_width=True):
-    with st.spinner("Importando CSV files..."):
-        try:
-            conn = get_connection()
-            stats = import_all_csv("data/csv_in", conn)
-            conn.close()
-            st.sidebar.success(
-                f"✅ Importação CSV concluída!\n\n"
-                f"Ficheiros: {stats['files_processed']}\n"
-                f"Desenhos: {stats['desenhos_imported']}"
-            )
-        except Exception as e:
-            st.sidebar.error(f"❌ Erro: {e}")
+    notify_job_submitted(*jobs.submit_job('import_csv', {'csv_dir': "data/csv_in"}))
 
 # Upload CSV directly
 uploaded_csv = st.sidebar.file_uploader("📤 Selecionar CSV", type=['csv'], key="csv_uploader")
@@ -89,25 +116,15 @@ if uploaded_csv is not None:
     st.sidebar.caption(f"📄 Ficheiro: {uploaded_csv.name}")
     
     if st.sidebar.button("➕ Importar para DB", use_container_width=True, type="primary"):
-        # Save file
+        # Save file (atomically: a running import of the same file never reads it half-written)
         temp_path = Path("data/csv_in") / uploaded_csv.name
         temp_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(temp_path, 'wb') as f:
-            f.write(uploaded_csv.getbuffer())
+        with atomic_write_path(temp_path) as tmp_path:
+            with open(tmp_path, 'wb') as f:
+                f.write(uploaded_csv.getbuffer())
         
-        with st.spinner(f"Importando {uploaded_csv.name}..."):
-            try:
-                conn = get_connection()
-                stats = import_single_csv(str(temp_path), conn)
-                conn.close()
-                st.sidebar.success(
-                    f"✅ Importado!\n\n"
-                    f"Desenhos: {stats['desenhos_imported']}"
-                )
-                st.rerun()
-            except Exception as e:
-                st.sidebar.error(f"❌ Erro: {e}")
+        notify_job_submitted(*jobs.submit_job('import_csv_file', {'path': str(temp_path)}))
 
 st.sidebar.markdown("---")
 
@@ -119,8 +136,9 @@ uploaded_template = st.sidebar.file_uploader("📋 Template LPP (Excel)", type=[
 if uploaded_template is not None:
     template_path = Path("data") / "LPP_TEMPLATE.xlsx"
     template_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(template_path, 'wb') as f:
-        f.write(uploaded_template.getbuffer())
+    with atomic_write_path(template_path) as tmp_path:
+        with open(tmp_path, 'wb') as f:
+            f.write(uploaded_template.getbuffer())
     st.sidebar.success("✅ Template carregado!")
 
 # Check if template exists
@@ -131,17 +149,71 @@ if not template_exists:
     st.sidebar.warning("⚠️ Faça upload do template LPP primeiro")
 
 if st.sidebar.button("📊 Gerar/Atualizar LPP.xlsx", use_container_width=True, disabled=not template_exists):
-    output_path = "output/LPP.xlsx"
-    Path("output").mkdir(parents=True, exist_ok=True)
-    
-    with st.spinner("Gerando LPP.xlsx..."):
-        try:
-            conn = get_connection()
-            build_lpp_from_db(str(template_path), output_path, conn)
-            conn.close()
-            st.sidebar.success(f"✅ LPP gerado com sucesso!\n\nFicheiro: {output_path}")
-        except Exception as e:
-            st.sidebar.error(f"❌ Erro ao gerar LPP: {e}")
+    notify_job_submitted(*jobs.submit_job(
+        'build_lpp', {'template_path': str(template_path), 'output_path': "output/LPP.xlsx"}
+    ))
+
+
+def format_job_result(job) -> str:
+    """One-line summary of a finished job's result dict."""
+    result = job['result'] or {}
+    if job['kind'] == 'build_lpp':
+        return f"Ficheiro: {result.get('output_path')} ({result.get('desenhos', 0)} desenhos)"
+    text = f"Desenhos: {result.get('desenhos_imported', 0)} | Escritas DB: {result.get('db_writes', 0)}"
+    if result.get('errors'):
+        text += f" | Erros: {', '.join(result['errors'])}"
+    return text
+
+
+def render_jobs_panel():
+    """Recent jobs with progress and cancel buttons; polls while any is active."""
+    conn = get_connection()
+    try:
+        recent = jobs.list_jobs(conn, limit=5)
+    finally:
+        conn.close()
+
+    if not recent:
+        st.caption("Sem tarefas")
+    for job in recent:
+        label = f"#{job['id']} {jobs.JOB_LABELS.get(job['kind'], job['kind'])}"
+        if job['status'] in JOB_ACTIVE_STATUSES:
+            phase = job['phase'] or job['status']
+            st.progress(job['progress'] or 0.0, text=f"{label} - {phase} {job['message'] or ''}".strip())
+            if job['cancel_requested']:
+                st.caption("A cancelar...")
+            elif st.button("✖ Cancelar", key=f"cancel_job_{job['id']}"):
+                jobs.cancel_job(job['id'])
+                st.caption("A cancelar...")
+        elif job['status'] == 'done':
+            st.success(f"✅ {label}\n\n{format_job_result(job)}")
+        elif job['status'] == 'cancelled':
+            st.warning(f"✖ {label} cancelada")
+        else:
+            st.error(f"❌ {label}: {job['error']}")
+
+    # Uma tarefa acompanhada terminou: rerun da app inteira para mostrar os dados novos
+    watched = st.session_state.get('watched_jobs', set())
+    finished = {job['id'] for job in recent if job['id'] in watched and job['status'] not in JOB_ACTIVE_STATUSES}
+    if finished:
+        st.session_state['watched_jobs'] = watched - finished
+        st.rerun()
+
+
+def jobs_panel():
+    """Sidebar jobs panel, refreshed every second only while jobs are active."""
+    conn = get_connection()
+    try:
+        active = bool(get_jobs(conn, limit=1, active_only=True))
+    finally:
+        conn.close()
+    st.fragment(render_jobs_panel, run_every=1.0 if active else None)()
+
+
+st.sidebar.markdown("---")
+st.sidebar.subheader("⏳ Tarefas")
+with st.sidebar:
+    jobs_panel()
 
 st.sidebar.markdown("---")
 
@@ -149,9 +221,7 @@ st.sidebar.markdown("---")
 st.sidebar.subheader("3. Gestão da DB")
 
 # Get DB stats
-conn = get_connection()
-db_stats = get_db_stats(conn)
-conn.close()
+db_stats = get_db_stats(snapshot)
 
 st.sidebar.caption(f"📊 **{db_stats['total_desenhos']} desenhos** de **{db_stats['total_dwgs']} DWG(s)**")
 
@@ -176,18 +246,14 @@ if db_stats['total_desenhos'] > 0:
             st.session_state['confirm_delete'] = 'all'
     
     elif delete_type == "Por DWG":
-        conn = get_connection()
-        dwg_list = [d['dwg_name'] for d in get_dwg_list(conn)]
-        conn.close()
+        dwg_list = [d['dwg_name'] for d in get_dwg_list(snapshot)]
         if dwg_list:
             selected_dwg_del = st.sidebar.selectbox("Selecione DWG:", dwg_list, key="del_dwg")
             if st.sidebar.button(f"🗑️ Apagar {selected_dwg_del}", use_container_width=True):
                 st.session_state['confirm_delete'] = ('dwg', selected_dwg_del)
     
     elif delete_type == "Por Tipo":
-        conn = get_connection()
-        tipos = get_unique_tipos(conn)
-        conn.close()
+        tipos = get_unique_tipos(snapshot)
         if tipos:
             selected_tipo_del = st.sidebar.selectbox("Selecione Tipo:", tipos, key="del_tipo")
             if st.sidebar.button(f"🗑️ Apagar tipo '{selected_tipo_del}'", use_container_width=True):
@@ -196,9 +262,7 @@ if db_stats['total_desenhos'] > 0:
             st.sidebar.info("Nenhum tipo encontrado")
     
     elif delete_type == "Por Elemento":
-        conn = get_connection()
-        elementos = get_unique_elementos(conn)
-        conn.close()
+        elementos = get_unique_elementos(snapshot)
         if elementos:
             selected_elem_del = st.sidebar.selectbox("Selecione Elemento:", elementos, key="del_elem")
             if st.sidebar.button(f"🗑️ Apagar elemento '{selected_elem_del}'", use_container_width=True):
@@ -207,9 +271,7 @@ if db_stats['total_desenhos'] > 0:
             st.sidebar.info("Nenhum elemento encontrado")
     
     elif delete_type == "Desenho Individual":
-        conn = get_connection()
-        layouts = get_all_layout_names(conn)
-        conn.close()
+        layouts = get_all_layout_names(snapshot)
         if layouts:
             selected_layout_del = st.sidebar.selectbox("Selecione Layout:", layouts, key="del_layout")
             if st.sidebar.button(f"🗑️ Apagar '{selected_layout_del}'", use_container_width=True):
@@ -268,6 +330,8 @@ st.sidebar.info(
     "Os dados são **agregados** - novos layouts adicionados, existentes atualizados."
 )
 
+perf.lap("app.sidebar")
+
 # Main area
 st.title("📐 JSJ - Gestão de Desenhos LPP")
 
@@ -286,29 +350,95 @@ with col_vista2:
 
 st.markdown("---")
 
-# Load data (fresh connection each time)
-def load_data():
-    """Load desenhos from database."""
-    conn = get_connection()
-    desenhos = get_all_desenhos(conn)
-    conn.close()
-    if desenhos:
-        df = pd.DataFrame(desenhos)
-        # Ensure estado_interno has default value
-        if 'estado_interno' not in df.columns:
-            df['estado_interno'] = 'projeto'
-        df['estado_interno'] = df['estado_interno'].fillna('projeto')
-        # Ensure other internal fields exist
-        if 'comentario' not in df.columns:
-            df['comentario'] = ''
-        if 'data_limite' not in df.columns:
-            df['data_limite'] = ''
-        if 'responsavel' not in df.columns:
-            df['responsavel'] = ''
-        return df
-    return pd.DataFrame()
-
-df = load_data()
+def render_conflicts(conflicts):
+    """Warn about edits not saved because another user changed (or deleted) the desenho first."""
+    st.warning(
+        f"⚠️ {len(conflicts)} desenho(s) alterado(s) por outro utilizador desde que os abriu - "
+        "as suas alterações não foram gravadas. Reveja os valores atuais; guardar novamente sobrepõe-nos."
+    )
+    rows = []
+    for conflict in conflicts:
+        current = conflict.current or {}
+        rows.append({
+            'Layout': current.get('layout_name') or f"#{conflict.desenho_id} (apagado)",
+            '🔖 Estado atual': current.get('estado_interno') or '',
+            '💬 Comentário atual': current.get('comentario') or '',
+            '📅 Data Limite': current.get('data_limite') or '',
+            '👤 Responsável': current.get('responsavel') or '',
+            'Alterado em': current.get('updated_at') or '',
+        })
+    st.dataframe(pd.DataFrame(rows), hide_index=True, use_container_width=True)
+
+
+HISTORICO_DIFF_LABELS = {
+    'added': '🆕 Adicionado',
+    'changed': '🔄 Revisão alterada',
+    'unchanged': '➖ Sem alterações',
+}
+
+
+def render_historico_diff(datas_unicas):
+    """Compare the desenhos at two revision dates (added / revision changed / unchanged)."""
+    col_from, col_to = st.columns(2)
+    with col_from:
+        data_de = st.selectbox(
+            "📅 De:", datas_unicas, index=min(1, len(datas_unicas) - 1), key="historico_diff_de"
+        )
+    with col_to:
+        data_ate = st.selectbox("📅 Até:", datas_unicas, index=0, key="historico_diff_ate")
+    
+    with perf.section("app.historico_diff") as perf_section:
+        diff = get_historico_diff(snapshot, data_de, data_ate)
+        perf_section['rows'] = len(diff)
+    if not diff:
+        st.warning(f"⚠️ Nenhum desenho encontrado entre {data_de} e {data_ate}")
+        return
+    
+    df_diff = pd.DataFrame(diff)
+    contagens = df_diff['status'].value_counts().to_dict()
+    st.markdown("---")
+    for col, status in zip(st.columns(len(HISTORICO_DIFF_STATUS)), HISTORICO_DIFF_STATUS):
+        with col:
+            st.metric(HISTORICO_DIFF_LABELS[status], contagens.get(status, 0))
+    
+    estados = st.multiselect(
+        "Mostrar:", HISTORICO_DIFF_STATUS, default=['added', 'changed'],
+        format_func=HISTORICO_DIFF_LABELS.get, key="historico_diff_estados"
+    )
+    df_diff = df_diff[df_diff['status'].isin(estados)]
+    
+    display_df = pd.DataFrame({
+        'Nº Desenho': df_diff['des_num'],
+        'Layout': df_diff['layout_name'],
+        'Tipo': df_diff['tipo_display'],
+        'Elemento': df_diff['elemento'],
+        'Título': df_diff['titulo'],
+        'Alteração': df_diff['status'].map(HISTORICO_DIFF_LABELS),
+        'Revisão': df_diff['r_from'] + ' → ' + df_diff['r_to'],
+        'Data Revisão': df_diff['r_data_from'] + ' → ' + df_diff['r_data_to'],
+        'Descrição Revisão': df_diff['r_desc_to'],
+        'DWG': df_diff['dwg_name'],
+    })
+    st.dataframe(display_df, use_container_width=True, hide_index=True, height=400)
+    
+    csv_diff = display_df.to_csv(sep=';', index=False).encode('utf-8-sig')
+    st.download_button(
+        label=f"📥 Download CSV (de {data_de} a {data_ate})",
+        data=csv_diff,
+        file_name=f"desenhos_historico_{data_de.replace('-', '_')}_a_{data_ate.replace('-', '_')}.csv",
+        mime="text/csv"
+    )
+
+
+# Load data (from this rerun's snapshot)
+def load_data(columns):
+    """Load the given desenhos columns from database (compact dtypes, see frames.py)."""
+    return load_desenhos_df(snapshot, columns, measure_memory=st.session_state.get('perf_panel', False))
+
+with perf.section("app.load_data") as perf_section:
+    df = load_data(view_columns(st.session_state.get('selected_columns', DEFAULT_VIEW_COLUMNS)))
+    perf_section['rows'] = len(df)
+perf.lap("app.header")
 
 # Initialize vista mode
 if 'vista_mode' not in st.session_state:
@@ -319,16 +449,21 @@ if 'vista_mode' not in st.session_state:
 # ========================================
 if st.session_state.vista_mode == 'historico':
     st.subheader("📜 Histórico de Revisões por Data")
-    st.markdown("Selecione uma data para ver o estado dos desenhos nessa data.")
+    modo_historico = st.radio(
+        "Modo:", ["📅 Estado numa data", "🔀 Comparar duas datas"],
+        horizontal=True, key="historico_modo"
+    )
     
     # Get unique dates
-    conn = get_connection()
-    datas_unicas = get_unique_revision_dates(conn)
-    conn.close()
+    datas_unicas = get_unique_revision_dates(snapshot)
     
     if not datas_unicas:
         st.warning("⚠️ Nenhuma data de revisão encontrada na base de dados.")
+    elif modo_historico == "🔀 Comparar duas datas":
+        render_historico_diff(datas_unicas)
     else:
+        st.markdown("Selecione uma data para ver o estado dos desenhos nessa data.")
+        
         # Date selector
         col_date_select, col_date_info = st.columns([2, 3])
         
@@ -347,9 +482,7 @@ if st.session_state.vista_mode == 'historico':
             st.markdown(f"### 📊 Estado dos desenhos em **{data_selecionada}**")
             
             # Get desenhos at that date
-            conn = get_connection()
-            desenhos_na_data = get_desenhos_at_date(conn, data_selecionada)
-            conn.close()
+            desenhos_na_data = get_desenhos_at_date(snapshot, data_selecionada)
             
             if not desenhos_na_data:
                 st.warning(f"⚠️ Nenhum desenho encontrado para a data {data_selecionada}")
@@ -403,6 +536,8 @@ if st.session_state.vista_mode == 'historico':
                     file_name=f"desenhos_historico_{data_selecionada.replace('-', '_')}.csv",
                     mime="text/csv"
                 )
+    
+    perf.lap("app.historico")
 
 # ========================================
 # VISTA: LISTA ATUAL
@@ -411,9 +546,7 @@ elif df.empty:
     st.warning("⚠️ Nenhum desenho na base de dados. Importe JSON ou CSV primeiro.")
 else:
     # Get estado stats for display
-    conn = get_connection()
-    estado_stats = get_stats_by_estado(conn)
-    conn.close()
+    estado_stats = get_stats_by_estado(snapshot)
     
     # Status bar with estado info
     col_stat1, col_stat2, col_stat3, col_stat4, col_stat5 = st.columns(5)
@@ -488,39 +621,41 @@ else:
     with col4:
         search_text = st.text_input("🔎 Procurar (DES_NUM ou LAYOUT)", "")
     
-    # Apply filters
-    filtered_df = df.copy()
+    # Apply filters - one combined mask, a single row selection at the end
+    mask = pd.Series(True, index=df.index)
     
     # Estado filter (applied first)
     if st.session_state.estado_filter == 'em_atraso':
         # Filter for overdue items (needs_revision with past deadline)
         today = datetime.now().strftime('%Y-%m-%d')
-        filtered_df = filtered_df[
-            (filtered_df['estado_interno'] == 'needs_revision') & 
-            (filtered_df['data_limite'].notna()) & 
-            (filtered_df['data_limite'] != '') &
-            (filtered_df['data_limite'] < today)
-        ]
+        mask &= (
+            (df['estado_interno'] == 'needs_revision') & 
+            (df['data_limite'].notna()) & 
+            (df['data_limite'] != '') &
+            (df['data_limite'] < today)
+        )
     elif st.session_state.estado_filter != 'Todos':
-        filtered_df = filtered_df[filtered_df['estado_interno'] == st.session_state.estado_filter]
+        mask &= df['estado_interno'] == st.session_state.estado_filter
     
     if tipo_filter != "Todos":
-        filtered_df = filtered_df[filtered_df['tipo_display'] == tipo_filter]
+        mask &= df['tipo_display'] == tipo_filter
     
     if elemento_filter != "Todos":
-        filtered_df = filtered_df[filtered_df['elemento_key'] == elemento_filter]
+        mask &= df['elemento_key'] == elemento_filter
     
     if r_filter != "Todos":
-        filtered_df = filtered_df[filtered_df['r'] == r_filter]
+        mask &= df['r'] == r_filter
     
     if search_text:
-        mask = (
-            filtered_df['des_num'].str.contains(search_text, case=False, na=False) |
-            filtered_df['layout_name'].str.contains(search_text, case=False, na=False)
+        mask &= (
+            df['des_num'].str.contains(search_text, case=False, na=False) |
+            df['layout_name'].str.contains(search_text, case=False, na=False)
         )
-        filtered_df = filtered_df[mask]
+    
+    filtered_df = df[mask] if not mask.all() else df
     
     st.markdown(f"**Resultados:** {len(filtered_df)} desenhos")
+    perf.lap("app.filtros", rows=len(filtered_df))
     
     # Toggle between view and edit mode
     col_mode1, col_mode2, col_mode3 = st.columns([1, 1, 3])
@@ -556,12 +691,12 @@ else:
     }
     
     # Default columns to show (now includes estado)
-    default_cols = ['estado_interno', 'des_num', 'layout_name', 'tipo_display', 'elemento', 'titulo', 'r', 'comentario', 'data_limite']
+    default_cols = DEFAULT_VIEW_COLUMNS
     
     # Column selector
     if show_column_selector:
         st.markdown("**Selecione as colunas a mostrar:**")
-        available_cols = [col for col in all_columns.keys() if col in filtered_df.columns]
+        available_cols = list(all_columns.keys())
         
         # Use session state to persist column selection
         if 'selected_columns' not in st.session_state:
@@ -577,6 +712,10 @@ else:
         
         st.session_state.selected_columns = selected_cols if selected_cols else default_cols
         view_cols = st.session_state.selected_columns
+        
+        # Only the selected columns were loaded - reload when a new one is ticked
+        if any(col not in df.columns for col in view_cols):
+            st.rerun()
     else:
         # Use default or session state columns
         if 'selected_columns' in st.session_state:
@@ -646,7 +785,7 @@ else:
     
     with col_vals1:
         if sort1_col in filtered_df.columns:
-            unique_vals_1 = sorted(filtered_df[sort1_col].dropna().unique().tolist())
+            unique_vals_1 = sorted_values(filtered_df[sort1_col], sort1_col in NATURAL_SORT_COLUMNS)
             if unique_vals_1:
                 if set(st.session_state.sort_values_order_1) != set(unique_vals_1):
                     st.session_state.sort_values_order_1 = unique_vals_1
@@ -685,7 +824,7 @@ else:
     
     with col_vals2:
         if sort2_col and sort2_col in filtered_df.columns:
-            unique_vals_2 = sorted(filtered_df[sort2_col].dropna().unique().tolist())
+            unique_vals_2 = sorted_values(filtered_df[sort2_col], sort2_col in NATURAL_SORT_COLUMNS)
             if unique_vals_2:
                 if set(st.session_state.sort_values_order_2) != set(unique_vals_2):
                     st.session_state.sort_values_order_2 = unique_vals_2
@@ -709,39 +848,16 @@ else:
     if sort2_col:
         sort_by.append(sort2_col)
     
-    # Aplicar ordenação ao DataFrame
-    def apply_custom_sort(df, sort_cols, order1, order2):
-        """Aplica ordenação personalizada ao DataFrame"""
-        if not sort_cols:
-            return df
-        
-        result_df = df.copy()
-        
-        # Aplicar ordenação em ordem inversa (último critério primeiro)
-        for i, col in enumerate(reversed(sort_cols)):
-            if col in result_df.columns:
-                if i == len(sort_cols) - 1 and order1:  # 1º critério
-                    order_map = {v: idx for idx, v in enumerate(order1)}
-                    result_df['_sort_key'] = result_df[col].map(lambda x: order_map.get(x, 999))
-                    result_df = result_df.sort_values('_sort_key', kind='stable')
-                    result_df = result_df.drop('_sort_key', axis=1)
-                elif i == len(sort_cols) - 2 and order2:  # 2º critério
-                    order_map = {v: idx for idx, v in enumerate(order2)}
-                    result_df['_sort_key'] = result_df[col].map(lambda x: order_map.get(x, 999))
-                    result_df = result_df.sort_values('_sort_key', kind='stable')
-                    result_df = result_df.drop('_sort_key', axis=1)
-                else:
-                    result_df = result_df.sort_values(col, kind='stable')
-        
-        return result_df
-    
-    # Aplicar ordenação ao filtered_df
-    sorted_df = apply_custom_sort(
-        filtered_df, 
-        sort_by, 
-        st.session_state.sort_values_order_1, 
-        st.session_state.sort_values_order_2
-    )
+    # Ordem personalizada de valores por critério
+    sort_orders = {}
+    if sort1_col and st.session_state.sort_values_order_1:
+        sort_orders[sort1_col] = st.session_state.sort_values_order_1
+    if sort2_col and st.session_state.sort_values_order_2:
+        sort_orders[sort2_col] = st.session_state.sort_values_order_2
+    
+    # Aplicar ordenação ao filtered_df (mesmo motor da exportação)
+    sorted_df = sort_dataframe(filtered_df, sort_by, sort_orders)
+    perf.lap("app.ordenacao", rows=len(sorted_df))
     
     # ========================================
     # TABELA (visualização ou edição)
@@ -793,18 +909,16 @@ else:
         if selection and selection.selection and selection.selection.rows:
             selected_idx = selection.selection.rows[0]
             selected_row = sorted_df.iloc[selected_idx]
-            desenho_id = selected_row.get('id')
+            desenho_id = int(selected_row.get('id'))
             
             if desenho_id:
                 st.markdown("---")
                 st.subheader(f"📋 Detalhes: {selected_row.get('layout_name', '')}")
                 
                 # Get full desenho data with history
-                conn = get_connection()
-                desenho = get_desenho_by_id(conn, desenho_id)
-                revisoes = get_revisoes_by_desenho_id(conn, desenho_id)
-                historico = get_historico_comentarios(conn, desenho_id)
-                conn.close()
+                desenho = get_desenho_by_id(snapshot, desenho_id)
+                revisoes = get_revisoes_by_desenho_id(snapshot, desenho_id)
+                historico = get_historico_comentarios(snapshot, desenho_id)
                 
                 if desenho:
                     # Three columns: Info, Estado/Comentário, Histórico
@@ -888,6 +1002,15 @@ else:
                             key=f"responsavel_{desenho_id}"
                         )
                         
+                        # Versão em que o formulário se baseia: renovada enquanto não houver alterações por gravar
+                        card_versions = st.session_state.setdefault('card_versions', {})
+                        pending = (
+                            novo_estado != estado_atual or novo_comentario != comentario_atual
+                            or nova_data_limite != default_date or novo_responsavel != responsavel_atual
+                        )
+                        if not pending or desenho_id not in card_versions:
+                            card_versions[desenho_id] = desenho['version']
+                        
                         # Save button
                         if st.button("💾 Guardar Estado e Comentário", type="primary", 
                                      use_container_width=True, key=f"save_estado_{desenho_id}"):
@@ -896,21 +1019,30 @@ else:
                             # Format date
                             data_limite_str = nova_data_limite.strftime('%Y-%m-%d') if nova_data_limite else None
                             
-                            success = update_estado_e_comentario(
-                                conn,
-                                desenho_id,
-                                estado=novo_estado,
-                                comentario=novo_comentario,
-                                data_limite=data_limite_str,
-                                responsavel=novo_responsavel,
-                                autor="Streamlit User"
-                            )
-                            conn.close()
+                            try:
+                                success = update_estado_e_comentario(
+                                    conn,
+                                    desenho_id,
+                                    estado=novo_estado,
+                                    comentario=novo_comentario,
+                                    data_limite=data_limite_str,
+                                    responsavel=novo_responsavel,
+                                    autor="Streamlit User",
+                                    expected_version=card_versions[desenho_id]
+                                )
+                            except VersionConflict as conflict:
+                                success = None
+                                render_conflicts([conflict])
+                                # Um novo "Guardar" passa a sobrepor a versão atual
+                                if conflict.current:
+                                    card_versions[desenho_id] = conflict.current['version']
+                            finally:
+                                conn.close()
                             
                             if success:
                                 st.success("✅ Estado e comentário guardados!")
                                 st.rerun()
-                            else:
+                            elif success is False:
                                 st.error("❌ Erro ao guardar")
                         
                         # Show if overdue
@@ -938,7 +1070,41 @@ else:
                                 if h.get('autor'):
                                     st.caption(f"Por: {h.get('autor')}")
                                 st.markdown("---")
-                                
+
+                    # Audit trail: every field (imports, renames, raw_attributes), with time travel
+                    auditoria = get_desenho_audit(snapshot, desenho_id)
+                    if auditoria:
+                        with st.expander(f"🕓 Auditoria - todas as alterações ({len(auditoria)})"):
+                            operacoes = {'insert': '🆕 Criado', 'update': '✏️ Alterado', 'delete': '🗑️ Apagado'}
+                            st.dataframe(pd.DataFrame([
+                                {
+                                    'Quando (UTC)': a['changed_at'][:19],
+                                    'Operação': operacoes.get(a['operation'], a['operation']),
+                                    'Campo': a['column_name'] or '',
+                                    'Antes': '' if a['old_value'] is None else str(a['old_value']),
+                                    'Depois': '' if a['new_value'] is None else str(a['new_value']),
+                                }
+                                for a in auditoria
+                            ]), hide_index=True, use_container_width=True)
+
+                            as_of = st.text_input(
+                                "Ver o desenho como estava em (UTC, AAAA-MM-DD [HH:MM]):",
+                                key=f"audit_as_of_{desenho_id}"
+                            )
+                            if as_of:
+                                try:
+                                    desenho_as_of = get_desenho_as_of(snapshot, desenho_id, as_of)
+                                except ValueError as e:
+                                    st.error(f"❌ {e}")
+                                else:
+                                    if desenho_as_of is None:
+                                        st.info(f"O desenho não existia em {as_of}.")
+                                    else:
+                                        st.dataframe(pd.DataFrame({
+                                            'Campo': AUDIT_COLUMNS,
+                                            'Valor': ['' if desenho_as_of[c] is None else str(desenho_as_of[c]) for c in AUDIT_COLUMNS],
+                                        }), hide_index=True, use_container_width=True)
+
     else:
         # Edit mode with data_editor
         st.info("📝 **Modo Edição Ativo** - Edite os campos diretamente na tabela. O campo Estado é editável (interno, não vai para CSV).")
@@ -950,16 +1116,21 @@ else:
         if 'layout_name' not in edit_view_cols:
             edit_view_cols.insert(0, 'layout_name')
         
-        # Ensure id is available for estado updates
-        if 'id' not in edit_view_cols:
-            edit_view_cols.append('id')
+        # Ensure id and version are available for updates
+        for key_col in ('id', 'version'):
+            if key_col not in edit_view_cols:
+                edit_view_cols.append(key_col)
         
         # Prepare editable dataframe with same columns as view
         edit_df = sorted_df[[c for c in edit_view_cols if c in sorted_df.columns]].copy()
         
+        # Categoricals would become fixed-option dropdowns in data_editor - edit as plain text
+        edit_df = edit_df.astype({c: object for c in edit_df.columns if isinstance(edit_df[c].dtype, pd.CategoricalDtype)})
+        
         # Column config for data_editor - estado_interno as dropdown
         column_config = {
             'id': None,  # Hide id column
+            'version': None,
             'estado_interno': st.column_config.SelectboxColumn(
                 "🔖 Estado",
                 options=['projeto', 'needs_revision', 'built'],
@@ -975,6 +1146,16 @@ else:
         # Rename columns for display (except special ones)
         display_cols_map = {col: all_columns.get(col, col) for col in edit_df.columns if col != 'id'}
         
+        # Versões em que as edições pendentes se baseiam (compare-and-swap ao gravar):
+        # renovadas quando o editor não tem alterações por gravar
+        edit_versions = st.session_state.get('edit_versions')
+        current_versions = {int(i): int(v) for i, v in zip(edit_df['id'], edit_df['version'])}
+        if edit_versions is None or not (st.session_state.get('data_editor') or {}).get('edited_rows'):
+            edit_versions = st.session_state['edit_versions'] = current_versions
+        else:
+            for desenho_id, version in current_versions.items():
+                edit_versions.setdefault(desenho_id, version)
+        
         # Use data_editor for editing
         edited_df = st.data_editor(
             edit_df,
@@ -991,23 +1172,26 @@ else:
         
         with col_save1:
             if st.button("💾 Guardar na DB", use_container_width=True, type="primary"):
+                conn = get_connection()
                 try:
-                    conn = get_connection()
                     cursor = conn.cursor()
                     
-                    updated_count = 0
+                    edits = []
                     layout_updated_count = 0
                     estado_updated_count = 0
                     
-                    for idx, row in edited_df.iterrows():
-                        desenho_id = row.get('id') if pd.notna(row.get('id')) else None
+                    # Só as linhas alteradas no editor
+                    changed_rows = (edited_df.astype(object).fillna('') != edit_df.astype(object).fillna('')).any(axis=1)
+                    
+                    for idx, row in edited_df[changed_rows].iterrows():
+                        desenho_id = int(row['id']) if pd.notna(row.get('id')) else None
                         old_layout_name = str(row['layout_name']) if pd.notna(row['layout_name']) else ''
                         
-                        if not old_layout_name:
+                        if not old_layout_name or desenho_id is None:
                             continue
                         
                         # Get original values from DB
-                        cursor.execute("SELECT des_num, r, estado_interno FROM desenhos WHERE layout_name = ?", (old_layout_name,))
+                        cursor.execute("SELECT des_num, r, estado_interno FROM desenhos WHERE id = ?", (desenho_id,))
                         result = cursor.fetchone()
                         if not result:
                             continue
@@ -1055,9 +1239,8 @@ else:
                         if old_estado != new_estado:
                             estado_updated_count += 1
                         
-                        # Build dynamic UPDATE based on available columns
-                        update_fields = ['layout_name = ?', 'updated_at = ?']
-                        update_values = [new_layout_name, datetime.now().isoformat()]
+                        # Fields to write, based on available columns
+                        fields = {'layout_name': new_layout_name}
                         
                         # Add CAD fields if present in edit columns
                         field_mapping = {
@@ -1067,50 +1250,66 @@ else:
                             'elemento_key': 'elemento_key', 'elemento_titulo': 'elemento_titulo', 'r': 'r'
                         }
                         
+                        cad_changed = new_layout_name != old_layout_name
                         for col, db_field in field_mapping.items():
                             if col in edited_df.columns:
                                 val = row.get(col, '')
                                 if pd.notna(val):
-                                    update_fields.append(f'{db_field} = ?')
-                                    update_values.append(str(val))
+                                    fields[db_field] = str(val)
+                                    cad_changed = cad_changed or str(val) != str(edit_df.at[idx, col])
                         
                         # Always update internal state fields
-                        update_fields.append('estado_interno = ?')
-                        update_values.append(new_estado)
+                        fields['estado_interno'] = new_estado
                         
                         if 'comentario' in edited_df.columns:
-                            update_fields.append('comentario = ?')
-                            update_values.append(new_comentario if new_comentario else '')
+                            fields['comentario'] = new_comentario if new_comentario else ''
                         
                         if 'data_limite' in edited_df.columns:
-                            update_fields.append('data_limite = ?')
-                            update_values.append(new_data_limite if new_data_limite else '')
+                            fields['data_limite'] = new_data_limite if new_data_limite else ''
                         
                         if 'responsavel' in edited_df.columns:
-                            update_fields.append('responsavel = ?')
-                            update_values.append(new_responsavel if new_responsavel else '')
+                            fields['responsavel'] = new_responsavel if new_responsavel else ''
                         
-                        update_values.append(old_layout_name)
-                        
-                        cursor.execute(f"""
-                            UPDATE desenhos SET {', '.join(update_fields)}
-                            WHERE layout_name = ?
-                        """, update_values)
-                        updated_count += 1
+                        edits.append({
+                            'id': desenho_id,
+                            # Versão em que a edição se baseou: grava só se ninguém alterou entretanto
+                            'version': edit_versions.get(desenho_id, int(row['version'])),
+                            'fields': fields,
+                            # Campos exportados para o AutoCAD mudaram -> entra na próxima exportação delta
+                            'mark_changed': cad_changed,
+                        })
                     
-                    conn.commit()
-                    conn.close()
+                    saved = save_desenho_edits(conn, edits)
+                    edit_versions.update(saved['versions'])
                     
-                    msg = f"✅ {updated_count} registos atualizados!"
+                    msg = f"{saved['updated']} registos atualizados!"
                     if layout_updated_count > 0:
                         msg += f" ({layout_updated_count} layouts renomeados)"
                     if estado_updated_count > 0:
                         msg += f" ({estado_updated_count} estados alterados)"
-                    st.success(msg)
-                    st.rerun()
+                    
+                    st.session_state['edit_conflicts'] = saved['conflicts'] or None
+                    if saved['conflicts']:
+                        # Um novo "Guardar" passa a sobrepor a versão atual (decisão do utilizador)
+                        for conflict in saved['conflicts']:
+                            if conflict.current:
+                                edit_versions[conflict.desenho_id] = conflict.current['version']
+                        st.info(f"ℹ️ {msg}")
+                    else:
+                        st.success(f"✅ {msg}")
+                        st.rerun()
                     
                 except Exception as e:
                     st.error(f"❌ Erro ao guardar: {e}")
+                finally:
+                    conn.close()
+            
+            # Linhas não gravadas por terem sido alteradas por outro utilizador
+            if st.session_state.get('edit_conflicts'):
+                render_conflicts(st.session_state['edit_conflicts'])
+                if st.button("OK", key="dismiss_edit_conflicts"):
+                    st.session_state['edit_conflicts'] = None
+                    st.rerun()
         
         with col_save2:
             # Export only CAD fields, not internal state
@@ -1124,6 +1323,8 @@ else:
                 use_container_width=True
             )
     
+    perf.lap("app.tabela")
+    
     # ========================================
     # EXPORTAR CSV (sempre visível)
     # ========================================
@@ -1132,102 +1333,82 @@ else:
     
     # Seleção de DWG
     dwg_list = sorted_df['dwg_name'].dropna().unique().tolist() if 'dwg_name' in sorted_df.columns else []
-    dwg_options = ["Todos os DWGs"] + sorted(dwg_list)
+    EXPORT_PER_DWG = "📦 Todos os DWGs (um ficheiro por DWG)"
+    EXPORT_COLUMN_OPTIONS = {
+        'autocad': "AutoCAD - ALTERACOES (29 campos)",
+        'principal': "Campos Principais (LISP)",
+        'completo': "Todos os Campos (LISP)",
+        'config': "Personalizado (csv_config.json)",
+    }
+    dwg_options = ["Todos os DWGs", EXPORT_PER_DWG] + sorted(dwg_list)
     
     col_exp_dwg, col_exp_btn = st.columns([2, 1])
     
     with col_exp_dwg:
         selected_dwg = st.selectbox("🗂️ Qual DWG exportar?", dwg_options, key="export_dwg")
+        export_changed_only = st.checkbox(
+            "🔁 Só alterações desde a última exportação",
+            key="export_changed_only",
+            help="Exporta apenas desenhos/revisões alterados desde a última exportação deste DWG (CSV vazio se não houver alterações)"
+        )
+        export_zip = selected_dwg == EXPORT_PER_DWG and st.checkbox("🗜️ Juntar num zip para download", value=True, key="export_zip")
+        export_columns = st.selectbox(
+            "🧩 Colunas",
+            list(EXPORT_COLUMN_OPTIONS),
+            format_func=lambda x: EXPORT_COLUMN_OPTIONS[x],
+            key="export_columns",
+            help="O formato AutoCAD (29 campos) é o que a LISP importa; só esse avança a marca da exportação delta"
+        )
     
     with col_exp_btn:
         if st.button("📤 Exportar CSV", use_container_width=True, type="primary"):
-            # Obter desenhos com todas as revisões do banco de dados
+            # Exportar todos os 29 campos na ordem exata da LSP, com a ordenação da tabela
             conn = get_connection()
-            dwg_filter = selected_dwg if selected_dwg != "Todos os DWGs" else None
-            desenhos_full = get_all_desenhos_with_revisoes(conn, dwg_filter)
-            conn.close()
-            
-            if not desenhos_full:
-                st.warning("⚠️ Nenhum desenho encontrado para exportar")
+            if selected_dwg == EXPORT_PER_DWG:
+                # Uma leitura da DB, um ficheiro por DWG (progresso por DWG na barra)
+                with telemetry.session(telemetry.StreamlitSink(st.progress(0.0))):
+                    export_stats = export_all_dwgs(
+                        conn, "output", sort_by, sort_orders, export_changed_only, export_zip, columns=export_columns
+                    )
+                conn.close()
+                st.session_state.export_zip_path = export_stats['zip_path']
+                st.success(
+                    f"✅ {export_stats['dwgs_exported']} CSV exportados para output/ "
+                    f"({export_stats['desenhos_exported']} desenhos)"
+                    + (" | só alterações" if export_changed_only else "")
+                )
             else:
-                # Converter para DataFrame com todos os 29 campos na ordem exata da LSP
-                export_data = []
-                for d in desenhos_full:
-                    export_data.append({
-                        'TAG DO LAYOUT': d.get('layout_name', ''),
-                        'CLIENTE': d.get('cliente', ''),
-                        'OBRA': d.get('obra', ''),
-                        'LOCALIZACAO': d.get('localizacao', ''),
-                        'ESPECIALIDADE': d.get('especialidade', ''),
-                        'FASE': d.get('fase', ''),
-                        'DATA 1ª EMISSÃO': d.get('data', ''),
-                        'PROJETOU': d.get('projetou', ''),
-                        'NUMERO DE DESENHO': d.get('des_num', ''),
-                        'TIPO': d.get('tipo_display', ''),
-                        'ELEMENTO': d.get('elemento_key', ''),
-                        'TITULO': d.get('titulo', ''),
-                        'REVISÃO A': d.get('rev_a', ''),
-                        'DATA REVISAO A': d.get('data_a', ''),
-                        'DESCRIÇÃO REVISÃO A': d.get('desc_a', ''),
-                        'REVISÃO B': d.get('rev_b', ''),
-                        'DATA REVISAO B': d.get('data_b', ''),
-                        'DESCRIÇÃO REVISÃO B': d.get('desc_b', ''),
-                        'REVISÃO C': d.get('rev_c', ''),
-                        'DATA REVISAO C': d.get('data_c', ''),
-                        'DESCRIÇÃO REVISÃO C': d.get('desc_c', ''),
-                        'REVISÃO D': d.get('rev_d', ''),
-                        'DATA REVISAO D': d.get('data_d', ''),
-                        'DESCRIÇÃO REVISÃO D': d.get('desc_d', ''),
-                        'REVISÃO E': d.get('rev_e', ''),
-                        'DATA REVISAO E': d.get('data_e', ''),
-                        'DESCRIÇÃO REVISÃO E': d.get('desc_e', ''),
-                        'NOME DWG': d.get('dwg_name', ''),
-                        'ID_CAD': d.get('id_cad', ''),
-                        '_tipo_display': d.get('tipo_display', ''),
-                        '_elemento_key': d.get('elemento_key', ''),
-                        '_des_num': d.get('des_num', ''),
-                    })
-                
-                export_df = pd.DataFrame(export_data)
-                
-                # Aplicar ordenação personalizada
-                if sort_by:
-                    sort_map = {
-                        'tipo_display': '_tipo_display',
-                        'elemento_key': '_elemento_key',
-                        'des_num': '_des_num',
-                        'layout_name': 'TAG DO LAYOUT',
-                        'r': 'REVISÃO A'
-                    }
-                    
-                    for i, col in enumerate(reversed(sort_by)):
-                        export_col = sort_map.get(col, col)
-                        if export_col in export_df.columns:
-                            if i == len(sort_by) - 1 and st.session_state.sort_values_order_1:
-                                order_map = {v: idx for idx, v in enumerate(st.session_state.sort_values_order_1)}
-                                export_df['_sort_key'] = export_df[export_col].map(lambda x: order_map.get(x, 999))
-                                export_df = export_df.sort_values('_sort_key', kind='stable')
-                                export_df = export_df.drop('_sort_key', axis=1)
-                            elif i == len(sort_by) - 2 and st.session_state.sort_values_order_2:
-                                order_map = {v: idx for idx, v in enumerate(st.session_state.sort_values_order_2)}
-                                export_df['_sort_key'] = export_df[export_col].map(lambda x: order_map.get(x, 999))
-                                export_df = export_df.sort_values('_sort_key', kind='stable')
-                                export_df = export_df.drop('_sort_key', axis=1)
-                            else:
-                                export_df = export_df.sort_values(export_col, kind='stable')
-                
-                # Remover colunas internas
-                export_df = export_df.drop(['_tipo_display', '_elemento_key', '_des_num'], axis=1, errors='ignore')
-                
-                # Save to output folder
-                output_filename = f"ALTERACOES_PARA_AUTOCAD_{selected_dwg.replace(' ', '_')}.csv" if selected_dwg != "Todos os DWGs" else "ALTERACOES_PARA_AUTOCAD.csv"
-                output_path = Path(f"output/{output_filename}")
-                output_path.parent.mkdir(parents=True, exist_ok=True)
-                export_df.to_csv(output_path, sep=';', index=False, encoding='utf-8-sig')
+                dwg_filter = selected_dwg if selected_dwg != "Todos os DWGs" else None
+                export_stats = export_autocad_csv(
+                    conn, dwg_filter, "output", sort_by, sort_orders, export_changed_only, export_columns
+                )
+                conn.close()
                 
-                dwg_info = f" (DWG: {selected_dwg})" if selected_dwg != "Todos os DWGs" else ""
-                sort_info = f" | Ordenado por: {', '.join([sort_columns_available.get(c, c) for c in sort_by])}" if sort_by else ""
-                st.success(f"✅ CSV exportado: {output_path} ({len(export_df)} desenhos){dwg_info}{sort_info}")
+                if not export_stats['desenhos_exported'] and export_changed_only:
+                    st.info(f"ℹ️ Sem alterações desde a última exportação - CSV vazio: {export_stats['output_path']}")
+                elif not export_stats['desenhos_exported']:
+                    st.warning("⚠️ Nenhum desenho encontrado para exportar")
+                else:
+                    output_path = export_stats['output_path']
+                    dwg_info = f" (DWG: {selected_dwg})" if selected_dwg != "Todos os DWGs" else ""
+                    sort_info = f" | Ordenado por: {', '.join([sort_columns_available.get(c, c) for c in sort_by])}" if sort_by else ""
+                    if export_changed_only:
+                        dwg_info += " | só alterações"
+                    st.success(f"✅ CSV exportado: {output_path} ({export_stats['desenhos_exported']} desenhos){dwg_info}{sort_info}")
+        
+        # Download do zip da última exportação por DWG
+        zip_path = st.session_state.get('export_zip_path')
+        if selected_dwg == EXPORT_PER_DWG and zip_path and Path(zip_path).exists():
+            with open(zip_path, 'rb') as f:
+                st.download_button(
+                    "⬇️ Download zip",
+                    data=f.read(),
+                    file_name=Path(zip_path).name,
+                    mime="application/zip",
+                    use_container_width=True
+                )
+    
+    perf.lap("app.exportar")
     
     # Statistics
     st.markdown("---")
@@ -1249,6 +1430,8 @@ else:
     with stat_col4:
         latest_rev = filtered_df['r'].mode()[0] if not filtered_df['r'].empty else "-"
         st.metric("Revisão Mais Comum", latest_rev)
+    
+    perf.lap("app.estatisticas")
 
 # Footer
 st.markdown("---")
@@ -1258,3 +1441,53 @@ st.markdown(
     "</div>",
     unsafe_allow_html=True
 )
+
+# ========================================
+# PERFORMANCE (tempos deste rerun + tendência)
+# ========================================
+perf.lap("app.footer")
+snapshot.close()
+
+perf_records = perf.get_records()
+perf_run_ms = perf.get_run_ms()
+
+st.sidebar.markdown("---")
+if st.sidebar.toggle("⏱️ Performance", value=False, key="perf_panel"):
+    # Só com o painel ligado: as páginas normais não escrevem na DB partilhada
+    conn = get_connection()
+    insert_perf_log(conn, datetime.now().isoformat(), perf_records)
+    
+    st.sidebar.caption(f"Rerun: **{perf_run_ms:.0f} ms**")
+    
+    perf_df = pd.DataFrame([
+        {'Função/Secção': name, 'ms': round(r['total_ms'], 1), 'Chamadas': r['calls'], 'Linhas': r['rows']}
+        for name, r in perf_records.items()
+    ]).sort_values('ms', ascending=False)
+    st.sidebar.dataframe(perf_df, use_container_width=True, hide_index=True)
+    
+    for metric_name, metric_value in perf.get_metrics().items():
+        st.sidebar.caption(f"{metric_name}: {metric_value}")
+    
+    with st.sidebar.expander("🗄️ Cache de resultados (todas as sessões)"):
+        cache_report = result_cache.cache_stats(DB_PATH)
+        if cache_report:
+            cache_df = pd.DataFrame([
+                {
+                    'Função': r['function'], 'Hits': r['hits'], 'Misses': r['misses'],
+                    'Hit %': round(100 * r['hit_rate'], 1) if r['hit_rate'] is not None else None,
+                    'Entradas': r['entries'], 'MB': round(r['bytes'] / 1024 / 1024, 1),
+                }
+                for r in cache_report
+            ])
+            st.dataframe(cache_df, use_container_width=True, hide_index=True)
+        else:
+            st.caption("Cache vazio")
+    
+    with st.sidebar.expander("📈 Tendência (últimos 50 reruns com o painel ligado)"):
+        perf_trend = get_perf_trend(conn)
+        if perf_trend:
+            trend_df = pd.DataFrame(perf_trend)
+            trend_df.columns = ['Função/Secção', 'Reruns', 'Média ms', 'Máx ms', 'Média chamadas']
+            st.dataframe(trend_df.round(1), use_container_width=True, hide_index=True)
+    
+    conn.close()
@@ -0,0 +1,42 @@
+"""
+Benchmarks for JSJ Gestão de Desenhos.
+
+Run from the repository root, e.g. `python -m benchmarks.startup`.
+Results are written as JSON to benchmarks/results/ for comparison over time.
+"""
+import json
+import platform
+import sys
+from datetime import datetime
+from pathlib import Path
+
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+def write_results(name: str, results: dict) -> Path:
+    """
+    Save benchmark results as JSON (benchmarks/results/<name>_<timestamp>.json).
+
+    Args:
+        name: Benchmark name
+        results: JSON-serializable results
+
+    Returns:
+        Path of the written file
+    """
+    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    output_path = RESULTS_DIR / f"{name}_{timestamp}.json"
+
+    payload = {
+        'benchmark': name,
+        'timestamp': datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'results': results,
+    }
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
+    return output_path
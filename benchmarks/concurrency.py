@@ -0,0 +1,173 @@
+"""
+Concurrent writers - editors saving estado/comentário while an import runs.
+
+On a database with the synthetic project imported from JSON, runs for a
+fixed duration, each in its own process:
+    M importers  alternate import_all_csv (pandas) and import_all_json of the
+                 same project: every pass rewrites every desenho in large
+                 bulk transactions
+    N editors    update_estado_e_comentario on random desenhos, as fast as possible
+and reports per role the writes done, "database is locked" failures and
+version conflicts, plus the editors' write throughput.
+
+--baseline runs the same load with the settings before busy handling
+(rollback journal, sqlite3's default 5 s busy timeout, no retries).
+
+Usage:
+    python -m benchmarks.concurrency [--drawings 20000] [--importers 2] [--editors 4] [--duration 20] [--baseline]
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import random
+import sqlite3
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import db
+import telemetry
+from benchmarks import write_results
+from benchmarks.generator import generate_project
+from benchmarks.suite import fresh_connection
+
+
+def configure(db_path: str, baseline: bool):
+    """Point db.py at db_path; with baseline, undo the busy handling."""
+    db.DB_PATH = db_path
+    if baseline:
+        db.DB_BUSY_TIMEOUT_S = 5.0
+        db.WRITE_RETRY_ATTEMPTS = 1
+
+
+def run_importer(db_path: str, project: Dict[str, Any], deadline: float, baseline: bool) -> Dict[str, Any]:
+    configure(db_path, baseline)
+    from csv_importer import import_all_csv
+    from json_importer import import_single_json
+
+    conn = db.get_connection()
+    start = time.perf_counter()
+    stats = {'role': 'importer', 'writes': 0, 'locked': 0, 'conflicts': 0}
+    passes = 0
+    while time.time() < deadline:
+        try:
+            with contextlib.redirect_stdout(io.StringIO()), telemetry.session():
+                if passes % 2 == 0:
+                    stats['writes'] += import_all_csv(project['csv_dir'], conn, 'pandas')['db_writes']
+                else:
+                    # import_all_json records per-file errors instead of raising
+                    for json_file in sorted(Path(project['json_dir']).glob("*.json")):
+                        stats['writes'] += import_single_json(str(json_file), conn)['db_writes']
+        except sqlite3.OperationalError as e:
+            if not db.is_busy_error(e):
+                raise
+            conn.rollback()
+            stats['locked'] += 1
+        passes += 1
+    stats['elapsed_s'] = time.perf_counter() - start
+    conn.close()
+    return stats
+
+
+def run_editor(db_path: str, n_desenhos: int, seed: int, deadline: float, baseline: bool) -> Dict[str, Any]:
+    configure(db_path, baseline)
+    rng = random.Random(seed)
+    conn = db.get_connection()
+    stats = {'role': 'editor', 'writes': 0, 'locked': 0, 'conflicts': 0}
+    start = time.perf_counter()
+    i = 0
+    while time.time() < deadline:
+        i += 1
+        try:
+            db.update_estado_e_comentario(
+                conn, rng.randint(1, n_desenhos), estado=rng.choice(db.ESTADOS_VALIDOS),
+                comentario=f"editor {seed} #{i}", autor=f"bench-{seed}"
+            )
+            stats['writes'] += 1
+        except db.VersionConflict:
+            stats['conflicts'] += 1
+        except sqlite3.OperationalError as e:
+            if not db.is_busy_error(e):
+                raise
+            conn.rollback()
+            stats['locked'] += 1
+    stats['elapsed_s'] = time.perf_counter() - start
+    conn.close()
+    return stats
+
+
+def run(n_drawings: int, n_importers: int, n_editors: int, duration: float, baseline: bool) -> Dict[str, Any]:
+    """
+    Import the project from JSON, then run importers and editors concurrently for `duration` seconds.
+
+    Returns:
+        Dict with parameters, per-process stats and editor throughput
+    """
+    from json_importer import import_all_json
+
+    with tempfile.TemporaryDirectory() as tmp:
+        project = generate_project(tmp, n_drawings, n_dwgs=10, n_revisions=3, with_template=False)
+        db_path = str(Path(tmp) / "desenhos.db")
+        conn = fresh_connection(Path(db_path))
+        if baseline:
+            conn.execute("PRAGMA journal_mode = DELETE")
+        with contextlib.redirect_stdout(io.StringIO()):
+            import_all_json(project['json_dir'], conn)
+        conn.close()
+
+        ctx = multiprocessing.get_context('spawn')
+        with ctx.Pool(n_importers + n_editors) as pool:
+            # Processos arrancam (imports de pandas etc.) antes de a carga começar a contar
+            deadline = time.time() + 5.0 + duration
+            importers = [
+                pool.apply_async(run_importer, (db_path, project, deadline, baseline)) for _ in range(n_importers)
+            ]
+            editors = [
+                pool.apply_async(run_editor, (db_path, n_drawings, seed, deadline, baseline))
+                for seed in range(n_editors)
+            ]
+            processes = [result.get() for result in importers + editors]
+
+    editor_stats = processes[n_importers:]
+    editor_writes = sum(s['writes'] for s in editor_stats)
+    return {
+        'params': {
+            'drawings': n_drawings, 'importers': n_importers, 'editors': n_editors,
+            'duration_s': duration, 'baseline': baseline,
+        },
+        'processes': processes,
+        'editor_writes': editor_writes,
+        'editor_locked': sum(s['locked'] for s in editor_stats),
+        'editor_writes_per_s': round(editor_writes / max(s['elapsed_s'] for s in editor_stats), 1),
+    }
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark de escritas concorrentes (editores + importação).")
+    parser.add_argument('--drawings', type=int, default=20000)
+    parser.add_argument('--importers', type=int, default=2)
+    parser.add_argument('--editors', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=20.0, help="Segundos de carga")
+    parser.add_argument('--baseline', action='store_true', help="Sem WAL, timeout 5 s, sem novas tentativas")
+    args = parser.parse_args(argv)
+
+    results = run(args.drawings, args.importers, args.editors, args.duration, args.baseline)
+
+    for stats in results['processes']:
+        print(
+            f"{stats['role']:<9} escritas {stats['writes']:>6}  locked {stats['locked']:>4}  "
+            f"conflitos {stats['conflicts']:>3}  {stats['elapsed_s']:7.2f} s"
+        )
+    print(
+        f"Editores: {results['editor_writes']} escritas, {results['editor_locked']} 'database is locked', "
+        f"{results['editor_writes_per_s']} escritas/s"
+    )
+
+    output_path = write_results("concurrency", results)
+    print(f"\nResultados: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+CSV parse engine throughput - python (row by row) vs pandas (columns + bulk writes).
+
+Writes one synthetic ListaCompleta CSV and, for each engine, on a fresh database:
+    import      first import (every row inserted)
+    reimport    same file again (nothing changed, nothing written)
+Then checks that both engines left identical desenhos/revisoes rows.
+
+Usage:
+    python -m benchmarks.csv_engine [--rows 50000] [--dwgs 20] [--revisions 3]
+"""
+import argparse
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, List
+
+import db
+from benchmarks import write_results
+from benchmarks.generator import generate_desenhos, write_lista_completa_csv
+from benchmarks.suite import fresh_connection, timed
+
+
+# Colunas comparadas entre motores (timestamps e change_seq dependem do momento da escrita)
+COMPARED_FIELDS = ['layout_name', *db.DESENHO_DATA_FIELDS]
+
+
+def snapshot(conn) -> Dict[str, List[Any]]:
+    """desenhos and revisoes rows keyed by (layout_name, dwg_name), for comparing engines."""
+    desenhos = conn.execute(
+        f"SELECT {', '.join(COMPARED_FIELDS)} FROM desenhos ORDER BY layout_name, dwg_name"
+    ).fetchall()
+    revisoes = conn.execute("""
+        SELECT d.layout_name, d.dwg_name, r.rev_code, r.rev_date, r.rev_desc
+        FROM revisoes r JOIN desenhos d ON d.id = r.desenho_id
+        ORDER BY d.layout_name, d.dwg_name, r.rev_code
+    """).fetchall()
+    return {'desenhos': [tuple(row) for row in desenhos], 'revisoes': [tuple(row) for row in revisoes]}
+
+
+def run(n_rows: int, n_dwgs: int, n_revisions: int) -> Dict[str, Any]:
+    """
+    Import the same synthetic file with every engine.
+
+    Returns:
+        Dict with parameters, per-engine timings and the equality check
+    """
+    from csv_importer import CSV_ENGINES, import_single_csv
+
+    timings = {}
+    snapshots = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        csv_path = tmp_path / "SYNTH_ListaCompleta.csv"
+        write_lista_completa_csv(generate_desenhos(n_rows, n_dwgs, n_revisions), csv_path)
+
+        for engine in CSV_ENGINES:
+            conn = fresh_connection(tmp_path / f"{engine}.db")
+            first = timed(lambda: import_single_csv(str(csv_path), conn, engine))
+            again = timed(lambda: import_single_csv(str(csv_path), conn, engine))
+            timings[engine] = {
+                'import_ms': first['best_ms'],
+                'rows_per_s': round(n_rows / (first['best_ms'] / 1000.0)),
+                'db_writes': first['result']['db_writes'],
+                'reimport_ms': again['best_ms'],
+                'reimport_writes': again['result']['db_writes'],
+            }
+            snapshots[engine] = snapshot(conn)
+            conn.close()
+
+    reference = snapshots[CSV_ENGINES[0]]
+    return {
+        'params': {'rows': n_rows, 'dwgs': n_dwgs, 'revisions': n_revisions},
+        'timings': timings,
+        'identical': all(s == reference for s in snapshots.values()),
+    }
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark dos motores de importação CSV (python vs pandas).")
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--dwgs', type=int, default=20)
+    parser.add_argument('--revisions', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = run(args.rows, args.dwgs, args.revisions)
+
+    base_ms = results['timings']['python']['import_ms']
+    for engine, timing in results['timings'].items():
+        print(
+            f"{engine:<8} import {timing['import_ms']:9.1f} ms ({timing['rows_per_s']:>7} linhas/s, "
+            f"{base_ms / timing['import_ms']:4.1f}x)   reimport {timing['reimport_ms']:8.1f} ms "
+            f"({timing['reimport_writes']} escritas)"
+        )
+    print(f"Resultado idêntico entre motores: {'sim' if results['identical'] else 'NÃO'}")
+
+    output_path = write_results("csv_engine", results)
+    print(f"\nResultados: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Synthetic project generator - LISP-format exports at realistic scale.
+
+Generates, for N drawings spread over M DWGs with K revisions each:
+    csv_in/<DWG>_ListaCompleta.csv   34-column "ListaCompleta" layout (as written by the LISP)
+    json_in/<DWG>.json               JSON export (dwg_name + desenhos[])
+    LPP_TEMPLATE.xlsx                LPP template with one ELEMENTO anchor per TIPO/ELEMENTO
+
+Usage:
+    python -m benchmarks.generator OUTPUT_DIR [--drawings 2000] [--dwgs 10] [--revisions 3]
+"""
+import argparse
+import csv
+import json
+import random
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Any
+
+
+# Header da exportação "ListaCompleta" do LISP (34 colunas)
+LISTA_COMPLETA_HEADERS = [
+    'PROJ_NUM', 'PROJ_NOME', 'CLIENTE', 'OBRA', 'LOCALIZACAO', 'ESPECIALIDADE', 'PROJETOU',
+    'FASE', 'FASE_PFIX', 'EMISSAO', 'DATA', 'PFIX', 'LAYOUT', 'DES_NUM', 'TIPO', 'ELEMENTO', 'TITULO',
+    'REV_A', 'DATA_A', 'DESC_A', 'REV_B', 'DATA_B', 'DESC_B', 'REV_C', 'DATA_C', 'DESC_C',
+    'REV_D', 'DATA_D', 'DESC_D', 'REV_E', 'DATA_E', 'DESC_E', 'DWG_SOURCE', 'ID_CAD',
+]
+
+TIPOS = ['BETÃO ARMADO', 'ESTRUTURA METÁLICA', 'DIMENSIONAMENTO', 'PRÉ-ESFORÇO', 'FUNDAÇÕES']
+ELEMENTOS = ['FUNDAÇÕES', 'PILARES', 'VIGAS', 'LAJES', 'NÚCLEOS', 'ESCADAS', 'MUROS', 'GEOMETRIA']
+TITULOS = ['PISO {n}', 'PISO -{n}', 'COBERTURA', 'CORTE {n}', 'PORMENORES {n}', 'BLOCO {n}']
+DESCRICOES = ['GERAL', 'EMISSÃO INICIAL', 'REVISÃO ARMADURAS', 'COMENTÁRIOS CLIENTE', 'ALTERAÇÃO GEOMETRIA']
+REV_LETTERS = ['A', 'B', 'C', 'D', 'E']
+MESES = ['JANEIRO', 'FEVEREIRO', 'MARÇO', 'ABRIL', 'MAIO', 'JUNHO', 'JULHO',
+         'AGOSTO', 'SETEMBRO', 'OUTUBRO', 'NOVEMBRO', 'DEZEMBRO']
+
+
+def generate_desenhos(n_drawings: int, n_dwgs: int, n_revisions: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Generate synthetic drawings as flat dictionaries (ListaCompleta field names).
+
+    Args:
+        n_drawings: Total number of drawings
+        n_dwgs: Number of DWG files the drawings are spread over
+        n_revisions: Revisions per drawing (0-5, A-E)
+        seed: Random seed (same inputs -> same project)
+
+    Returns:
+        List of drawing dicts keyed by LISTA_COMPLETA_HEADERS
+    """
+    rng = random.Random(seed)
+    start = date(2024, 1, 8)
+    desenhos = []
+
+    for i in range(n_drawings):
+        dwg_idx = i % n_dwgs
+        dwg_name = f"PROJ {dwg_idx + 1:03d}"
+        des_num = f"{i // n_dwgs + 1:03d}"
+        tipo = rng.choice(TIPOS)
+        elemento = rng.choice(ELEMENTOS)
+        first_emission = start + timedelta(days=rng.randrange(0, 120))
+
+        row = {h: '' for h in LISTA_COMPLETA_HEADERS}
+        row.update({
+            'PROJ_NUM': '669',
+            'PROJ_NOME': 'ALTIS',
+            'CLIENTE': 'ROCKBUILDING',
+            'OBRA': 'REABILITAÇÃO',
+            'LOCALIZACAO': 'LISBOA',
+            'ESPECIALIDADE': 'ESTRUTURAS',
+            'PROJETOU': 'DAVID GAMA',
+            'FASE': 'PROJETO DE EXECUÇÃO',
+            'FASE_PFIX': 'PE',
+            'EMISSAO': 'E00',
+            'DATA': f"{MESES[first_emission.month - 1]} {first_emission.year}",
+            'DES_NUM': des_num,
+            'TIPO': tipo,
+            'ELEMENTO': elemento,
+            'TITULO': rng.choice(TITULOS).format(n=rng.randrange(1, 20)),
+            'DWG_SOURCE': dwg_name,
+            'ID_CAD': f"{0x1000 + i * 8:X}",
+        })
+
+        rev_date = first_emission
+        for letter in REV_LETTERS[:n_revisions]:
+            rev_date += timedelta(days=rng.randrange(1, 45))
+            row[f'REV_{letter}'] = letter
+            row[f'DATA_{letter}'] = rev_date.strftime('%d-%m-%Y')
+            row[f'DESC_{letter}'] = rng.choice(DESCRICOES)
+
+        suffix = f"-{REV_LETTERS[n_revisions - 1]}" if n_revisions else ''
+        row['LAYOUT'] = f"669-EST-{dwg_idx + 1:03d}{des_num}-E00-PE{suffix}"
+        desenhos.append(row)
+
+    return desenhos
+
+
+def write_lista_completa_csv(desenhos: List[Dict[str, Any]], output_path: Path):
+    """Write drawings in the LISP ListaCompleta CSV layout (';', trailing ';' on data rows)."""
+    with open(output_path, 'w', encoding='utf-8', newline='') as f:
+        f.write(';'.join(LISTA_COMPLETA_HEADERS) + '\n')
+        writer = csv.writer(f, delimiter=';', lineterminator=';\n')
+        for d in desenhos:
+            writer.writerow([d[h] for h in LISTA_COMPLETA_HEADERS])
+
+
+def write_json_export(dwg_name: str, desenhos: List[Dict[str, Any]], output_path: Path):
+    """Write drawings in the LISP JSON export layout."""
+    json_obj = {'dwg_name': dwg_name, 'desenhos': []}
+
+    for d in desenhos:
+        attributes = {h: d[h] for h in LISTA_COMPLETA_HEADERS if not h.startswith(('REV_', 'DATA_', 'DESC_'))}
+        revisoes = [
+            {'rev': d[f'REV_{l}'], 'data': d[f'DATA_{l}'], 'desc': d[f'DESC_{l}']}
+            for l in REV_LETTERS if d[f'REV_{l}']
+        ]
+        attributes['R'] = revisoes[-1]['rev'] if revisoes else ''
+        json_obj['desenhos'].append({
+            'layout_name': d['LAYOUT'],
+            'attributes': attributes,
+            'revisoes': revisoes,
+        })
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(json_obj, f, ensure_ascii=False)
+
+
+def write_lpp_template(desenhos: List[Dict[str, Any]], output_path: Path):
+    """Write an LPP template with TIPO rows and one ELEMENTO anchor per TIPO/ELEMENTO pair."""
+    from openpyxl import Workbook
+    from utils import normalize_tipo_display_to_key, normalize_elemento_to_key
+
+    wb = Workbook()
+    sheet = wb.active
+    sheet.title = "LPP"
+    sheet.append(["Nº.", "DESIGNAÇÃO", "FICHEIRO", "Rev", "DATA", "ROW_KIND", "TIPO_KEY", "ELEMENTO_KEY"])
+
+    pairs = sorted({(d['TIPO'], d['ELEMENTO']) for d in desenhos})
+    current_tipo = None
+    for tipo, elemento in pairs:
+        tipo_key = normalize_tipo_display_to_key(tipo)
+        if tipo != current_tipo:
+            sheet.append([tipo, None, None, None, None, "TIPO", tipo_key, None])
+            current_tipo = tipo
+        sheet.append([elemento, None, None, None, None, "ELEMENTO", tipo_key, normalize_elemento_to_key(elemento)])
+
+    wb.save(output_path)
+
+
+def generate_project(
+    output_dir: str,
+    n_drawings: int = 2000,
+    n_dwgs: int = 10,
+    n_revisions: int = 3,
+    seed: int = 42,
+    with_template: bool = True
+) -> Dict[str, Any]:
+    """
+    Generate a synthetic project (CSV + JSON exports and LPP template).
+
+    Args:
+        output_dir: Destination folder (csv_in/, json_in/ and LPP_TEMPLATE.xlsx are created in it)
+        n_drawings: Total number of drawings
+        n_dwgs: Number of DWG files
+        n_revisions: Revisions per drawing (0-5)
+        seed: Random seed
+        with_template: Also write LPP_TEMPLATE.xlsx (needs openpyxl)
+
+    Returns:
+        Dictionary with generated paths
+    """
+    if not 0 <= n_revisions <= len(REV_LETTERS):
+        raise ValueError(f"n_revisions must be between 0 and {len(REV_LETTERS)}")
+
+    output_path = Path(output_dir)
+    csv_dir = output_path / "csv_in"
+    json_dir = output_path / "json_in"
+    csv_dir.mkdir(parents=True, exist_ok=True)
+    json_dir.mkdir(parents=True, exist_ok=True)
+
+    desenhos = generate_desenhos(n_drawings, n_dwgs, n_revisions, seed)
+
+    by_dwg: Dict[str, List[Dict[str, Any]]] = {}
+    for d in desenhos:
+        by_dwg.setdefault(d['DWG_SOURCE'], []).append(d)
+
+    for dwg_name, dwg_desenhos in by_dwg.items():
+        file_stem = dwg_name.replace(' ', '_')
+        write_lista_completa_csv(dwg_desenhos, csv_dir / f"{file_stem}_ListaCompleta.csv")
+        write_json_export(dwg_name, dwg_desenhos, json_dir / f"{file_stem}.json")
+
+    template_path = output_path / "LPP_TEMPLATE.xlsx"
+    if with_template:
+        write_lpp_template(desenhos, template_path)
+
+    return {
+        'csv_dir': str(csv_dir),
+        'json_dir': str(json_dir),
+        'template_path': str(template_path) if with_template else None,
+        'desenhos': len(desenhos),
+        'dwgs': len(by_dwg),
+    }
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Gera um projeto sintético (CSV/JSON LISP + template LPP).")
+    parser.add_argument('output_dir')
+    parser.add_argument('--drawings', type=int, default=2000)
+    parser.add_argument('--dwgs', type=int, default=10)
+    parser.add_argument('--revisions', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args(argv)
+
+    info = generate_project(args.output_dir, args.drawings, args.dwgs, args.revisions, args.seed)
+    print(f"{info['desenhos']} desenhos em {info['dwgs']} DWG(s) -> {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+Cold-start benchmark - import cost of each entry point measured with `python -X importtime`.
+
+Each entry point is imported in a fresh interpreter; the cumulative import
+time of its top-level imports is summed and the heavy dependencies that got
+loaded (pandas, openpyxl, unidecode, ...) are listed.
+
+Usage:
+    python -m benchmarks.startup [--repeat 5]
+"""
+import argparse
+import ast
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Any
+
+from benchmarks import write_results
+
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+HEAVY_MODULES = ['pandas', 'numpy', 'openpyxl', 'unidecode', 'streamlit']
+
+# Entry point -> code run in a fresh interpreter
+ENTRY_POINTS = {
+    'cli': "import cli",
+    'watcher': "import watcher",
+    'csv_importer': "import csv_importer",
+    'json_importer': "import json_importer",
+    'lpp_builder': "import lpp_builder",
+    'exporter': "import exporter",
+}
+
+
+def app_import_code() -> str:
+    """
+    Build the module-level imports of app.py (minus streamlit, which is not
+    ours to optimize) so the app's own cold-start cost is tracked.
+    """
+    tree = ast.parse((REPO_ROOT / "app.py").read_text(encoding='utf-8'))
+    lines = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            module = node.module if isinstance(node, ast.ImportFrom) else node.names[0].name
+            if module and module.split('.')[0] == 'streamlit':
+                continue
+            lines.append(ast.unparse(node))
+    return "\n".join(lines)
+
+
+def parse_importtime(stderr: str) -> Dict[str, Any]:
+    """
+    Parse `-X importtime` output.
+
+    Returns:
+        Dict with total_us (sum of top-level cumulative times) and modules loaded
+    """
+    total_us = 0
+    modules = set()
+
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        modules.add(name.strip())
+        # Top-level imports are not indented (nested ones get two extra spaces per level)
+        if not name[1:].startswith(" "):
+            total_us += int(cumulative_us)
+
+    return {'total_us': total_us, 'modules': modules}
+
+
+def measure(code: str, repeat: int) -> Dict[str, Any]:
+    """
+    Import `code` in `repeat` fresh interpreters and keep the fastest run.
+    """
+    runs = []
+    modules = set()
+
+    for _ in range(repeat):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=REPO_ROOT, capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+        parsed = parse_importtime(proc.stderr)
+        runs.append(parsed['total_us'])
+        modules = parsed['modules']
+
+    return {
+        'import_ms': min(runs) / 1000.0,
+        'runs_ms': [r / 1000.0 for r in runs],
+        'heavy_modules': [m for m in HEAVY_MODULES if m in modules],
+    }
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Mede o custo de arranque (imports) de cada entry point.")
+    parser.add_argument('--repeat', type=int, default=5, help="Número de interpretadores por entry point")
+    args = parser.parse_args(argv)
+
+    entry_points = dict(ENTRY_POINTS)
+    entry_points['app'] = app_import_code()
+
+    results = {}
+    for name, code in entry_points.items():
+        results[name] = measure(code, args.repeat)
+        heavy = ", ".join(results[name]['heavy_modules']) or "-"
+        print(f"{name:<15} {results[name]['import_ms']:8.1f} ms   heavy: {heavy}")
+
+    output_path = write_results("startup", results)
+    print(f"\nResultados: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
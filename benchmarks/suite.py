@@ -0,0 +1,129 @@
+"""
+End-to-end benchmark suite on a synthetic project.
+
+Times, on a fresh database in a temporary folder:
+    csv_import          import_all_csv on the generated ListaCompleta files
+    csv_reimport        same files again (nothing changed)
+    json_import         import_all_json into a second fresh database
+    all_with_revisoes   get_all_desenhos_with_revisoes
+    desenhos_at_date    get_desenhos_at_date (median revision date)
+    autocad_export      export_autocad_csv (all DWGs)
+    build_lpp           build_lpp_from_db
+
+Usage:
+    python -m benchmarks.suite [--drawings 2000] [--dwgs 10] [--revisions 3] [--repeat 3]
+"""
+import argparse
+import contextlib
+import io
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Any
+
+import db
+from benchmarks import write_results
+from benchmarks.generator import generate_project
+
+
+def timed(func: Callable, repeat: int = 1) -> Dict[str, Any]:
+    """
+    Run func `repeat` times (stdout silenced) and return timings in ms.
+    """
+    runs = []
+    result = None
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            result = func()
+            runs.append((time.perf_counter() - start) * 1000.0)
+
+    return {'best_ms': min(runs), 'runs_ms': runs, 'result': result}
+
+
+def fresh_connection(db_path: Path):
+    """Point db.py at db_path and return a connection with tables created."""
+    db.DB_PATH = str(db_path)
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    return conn
+
+
+def run_suite(n_drawings: int, n_dwgs: int, n_revisions: int, repeat: int = 3) -> Dict[str, Any]:
+    """
+    Generate a project and time every end-to-end operation.
+
+    Returns:
+        Dict with parameters and per-operation timings
+    """
+    from csv_importer import import_all_csv
+    from json_importer import import_all_json
+    from exporter import export_autocad_csv
+    from lpp_builder import build_lpp_from_db
+
+    timings = {}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        project = generate_project(str(tmp_path / "project"), n_drawings, n_dwgs, n_revisions)
+
+        # Imports mutate the DB, so each runs once on a fresh database
+        conn = fresh_connection(tmp_path / "csv.db")
+        run = timed(lambda: import_all_csv(project['csv_dir'], conn))
+        timings['csv_import'] = {'best_ms': run['best_ms'], 'db_writes': run['result']['db_writes']}
+
+        run = timed(lambda: import_all_csv(project['csv_dir'], conn), repeat)
+        timings['csv_reimport'] = {'best_ms': run['best_ms'], 'db_writes': run['result']['db_writes']}
+
+        json_conn = fresh_connection(tmp_path / "json.db")
+        run = timed(lambda: import_all_json(project['json_dir'], json_conn))
+        timings['json_import'] = {'best_ms': run['best_ms'], 'db_writes': run['result']['db_writes']}
+        json_conn.close()
+
+        # Read paths on the CSV database
+        db.DB_PATH = str(tmp_path / "csv.db")
+
+        run = timed(lambda: db.get_all_desenhos_with_revisoes(conn), repeat)
+        timings['all_with_revisoes'] = {'best_ms': run['best_ms'], 'rows': len(run['result'])}
+
+        dates = db.get_unique_revision_dates(conn)
+        target_date = dates[len(dates) // 2] if dates else '01-01-2025'
+        run = timed(lambda: db.get_desenhos_at_date(conn, target_date), repeat)
+        timings['desenhos_at_date'] = {'best_ms': run['best_ms'], 'rows': len(run['result']), 'date': target_date}
+
+        run = timed(lambda: export_autocad_csv(conn, None, str(tmp_path / "output")), repeat)
+        timings['autocad_export'] = {'best_ms': run['best_ms'], 'rows': run['result']['desenhos_exported']}
+
+        if project['template_path']:
+            output_path = str(tmp_path / "output" / "LPP.xlsx")
+            run = timed(lambda: build_lpp_from_db(project['template_path'], output_path, conn), repeat)
+            timings['build_lpp'] = {'best_ms': run['best_ms']}
+
+        conn.close()
+
+    return {
+        'params': {'drawings': n_drawings, 'dwgs': n_dwgs, 'revisions': n_revisions, 'repeat': repeat},
+        'timings': timings,
+    }
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end (import, consultas, export, LPP).")
+    parser.add_argument('--drawings', type=int, default=2000)
+    parser.add_argument('--dwgs', type=int, default=10)
+    parser.add_argument('--revisions', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    results = run_suite(args.drawings, args.dwgs, args.revisions, args.repeat)
+
+    for name, timing in results['timings'].items():
+        extra = ", ".join(f"{k}={v}" for k, v in timing.items() if k != 'best_ms')
+        print(f"{name:<20} {timing['best_ms']:10.1f} ms   {extra}")
+
+    output_path = write_results("suite", results)
+    print(f"\nResultados: {output_path}")
+
+
+if __name__ == "__main__":
+    main()
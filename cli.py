@@ -0,0 +1,480 @@
+"""
+Headless command-line interface - import, LPP build, AutoCAD CSV export and stats without Streamlit.
+
+Heavy modules (importers, openpyxl via lpp_builder) are imported inside each
+subcommand so that e.g. `stats` never pays for them.
+
+Usage:
+    python -m cli import [--csv-dir data/csv_in] [--json-dir data/json_in] [--file PATH ...]
+                         [--csv-engine python|pandas]
+    python -m cli build-lpp [--template data/LPP_TEMPLATE.xlsx] [--output output/LPP.xlsx]
+    python -m cli export [--dwg NOME | --all-dwgs [--zip]] [--output-dir output] [--changed-only]
+                         [--columns autocad|principal|completo|config]
+    python -m cli stats [--json]
+    python -m cli watch [--interval 2] [--settle 3] [--once]
+    python -m cli id-cad-log [--limit 50]
+    python -m cli jobs [--limit 20] [--cancel ID]
+    python -m cli slow-queries [--top 20] [--clear]
+    python -m cli cache [--clear [--reset-stats]]
+    python -m cli audit (ID | LAYOUT) [--as-of 'AAAA-MM-DD [HH:MM]']
+    python -m cli prune-audit [--days 365]
+    python -m cli changes [--since TOKEN [--limit N] [--rows]] [--json]
+    python -m cli prune-changes [--days 90 | --before TOKEN]
+
+Global options: --db selects the database file (default: data/desenhos.db);
+--trace-sql MS logs statements slower than MS to the slow-query log;
+--verbose prints one line per desenho / LPP anchor (default: one summary per
+phase); --telemetry-log PATH appends every progress event as JSON lines.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import List
+
+import db
+import telemetry
+
+
+def cmd_import(args) -> int:
+    """Import CSV/JSON folders or individual files."""
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    log_start = db.get_id_cad_log_last_id(conn)
+
+    totals = {'files_processed': 0, 'desenhos_imported': 0, 'db_writes': 0}
+
+    def add(stats):
+        for key in totals:
+            totals[key] += stats.get(key, 0)
+
+    try:
+        if args.file:
+            from json_importer import JSON_SUFFIXES
+            for file_path in args.file:
+                if Path(file_path).suffix.lower() in JSON_SUFFIXES:
+                    from json_importer import import_single_json
+                    add(import_single_json(file_path, conn))
+                else:
+                    from csv_importer import import_single_csv
+                    add(import_single_csv(file_path, conn, args.csv_engine))
+        else:
+            if args.only in (None, 'csv'):
+                from csv_importer import import_all_csv
+                add(import_all_csv(args.csv_dir, conn, args.csv_engine))
+            if args.only in (None, 'json'):
+                from json_importer import import_all_json
+                add(import_all_json(args.json_dir, conn))
+        db.prewarm_historico_snapshots(conn)
+        id_cad_log = db.get_id_cad_log(conn, since_id=log_start)
+    finally:
+        conn.close()
+
+    print(
+        f"Ficheiros: {totals['files_processed']} | "
+        f"Desenhos: {totals['desenhos_imported']} | "
+        f"Escritas DB: {totals['db_writes']}"
+    )
+    print_id_cad_log(id_cad_log)
+    return 0
+
+
+def print_id_cad_log(entries) -> None:
+    """Print id_cad_log entries (renamed / merged / retired layouts)."""
+    if not entries:
+        return
+    counts = {}
+    for entry in entries:
+        counts[entry['action']] = counts.get(entry['action'], 0) + 1
+    print("ID_CAD: " + ", ".join(f"{action}={count}" for action, count in counts.items()))
+    for entry in entries:
+        target = f" -> {entry['new_layout_name']}" if entry['new_layout_name'] else ""
+        print(f"  {entry['action']:<8} {entry['dwg_name']} | {entry['layout_name']}{target} (ID_CAD {entry['id_cad']})")
+
+
+def cmd_id_cad_log(args) -> int:
+    """Print the latest layouts renamed, merged or retired by ID_CAD on import."""
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    try:
+        entries = db.get_id_cad_log(conn, limit=args.limit)
+    finally:
+        conn.close()
+
+    if not entries:
+        print("Sem alterações de identidade ID_CAD")
+    print_id_cad_log(entries)
+    return 0
+
+
+def cmd_build_lpp(args) -> int:
+    """Generate LPP.xlsx from database using template."""
+    if not Path(args.template).exists():
+        print(f"Erro: template não encontrado em {args.template}", file=sys.stderr)
+        return 1
+
+    from lpp_builder import build_lpp_from_db
+
+    conn = db.get_connection()
+    try:
+        build_lpp_from_db(args.template, args.output, conn)
+    finally:
+        conn.close()
+    return 0
+
+
+def cmd_export(args) -> int:
+    """Export ALTERACOES_PARA_AUTOCAD CSV for one DWG, all DWGs in one file, or one file per DWG."""
+    from exporter import export_all_dwgs, export_autocad_csv
+
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    try:
+        if args.all_dwgs:
+            stats = export_all_dwgs(
+                conn, args.output_dir, changed_only=args.changed_only, make_zip=args.zip, columns=args.columns
+            )
+        else:
+            stats = export_autocad_csv(
+                conn, args.dwg, args.output_dir, changed_only=args.changed_only, columns=args.columns
+            )
+    finally:
+        conn.close()
+
+    if args.all_dwgs:
+        print(f"{stats['dwgs_exported']} CSV exportados para {args.output_dir} ({stats['desenhos_exported']} desenhos)")
+        if stats['zip_path']:
+            print(f"Zip: {stats['zip_path']}")
+    else:
+        print(f"CSV exportado: {stats['output_path']} ({stats['desenhos_exported']} desenhos)")
+    return 0
+
+
+def cmd_stats(args) -> int:
+    """Print database statistics."""
+    conn = db.get_connection()
+    try:
+        stats = db.get_db_stats(conn)
+        stats['estados'] = db.get_stats_by_estado(conn)
+    finally:
+        conn.close()
+
+    if args.json:
+        print(json.dumps(stats, ensure_ascii=False, indent=2))
+        return 0
+
+    print(f"{stats['total_desenhos']} desenhos de {stats['total_dwgs']} DWG(s)")
+    for dwg in stats['dwg_list']:
+        print(f"  {dwg['dwg_name']}: {dwg['count']}")
+    print("Estados: " + ", ".join(f"{k}={v}" for k, v in stats['estados'].items()))
+    return 0
+
+
+def cmd_audit(args) -> int:
+    """Print every recorded change of a desenho, or the desenho as it was at --as-of (UTC)."""
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    try:
+        if args.desenho.isdigit():
+            desenho_id = int(args.desenho)
+        else:
+            desenho = db.get_desenho_by_layout(conn, args.desenho)
+            if desenho is None:
+                print(f"Erro: layout {args.desenho} não encontrado (desenhos apagados: usar o ID)", file=sys.stderr)
+                return 1
+            desenho_id = desenho['id']
+
+        if args.as_of:
+            try:
+                desenho = db.get_desenho_as_of(conn, desenho_id, args.as_of)
+            except ValueError as e:
+                print(f"Erro: {e}", file=sys.stderr)
+                return 1
+            if desenho is None:
+                print(f"Desenho {desenho_id} não existia em {args.as_of}")
+                return 0
+            for column in db.AUDIT_COLUMNS:
+                print(f"  {column:<16} {desenho[column] if desenho[column] is not None else ''}")
+            return 0
+
+        entries = db.get_desenho_audit(conn, desenho_id)
+    finally:
+        conn.close()
+
+    if not entries:
+        print(f"Sem alterações registadas do desenho {desenho_id}")
+    for entry in entries:
+        if entry['column_name'] is None:
+            print(f"{entry['changed_at']}  {entry['operation']}")
+        else:
+            print(f"{entry['changed_at']}  {entry['column_name']}: {entry['old_value']!r} -> {entry['new_value']!r}")
+    return 0
+
+
+def cmd_prune_audit(args) -> int:
+    """Delete audit rows older than --days (the desenhos can no longer be rebuilt before that)."""
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    try:
+        deleted = db.prune_desenhos_audit(conn, args.days)
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    print(f"{deleted} registo(s) de auditoria com mais de {args.days} dias apagado(s)")
+    return 0
+
+
+def cmd_changes(args) -> int:
+    """Print the changes after --since TOKEN and the token to use next (without --since: the current token)."""
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    try:
+        if args.since is None:
+            feed = {'changes': [], 'token': db.get_change_token(conn), 'more': False}
+        else:
+            feed = db.get_changes_since(conn, args.since, limit=args.limit, with_rows=args.rows)
+    except db.ChangeFeedReset as e:
+        print(f"Erro: {e} - reler tudo e recomeçar com o token atual", file=sys.stderr)
+        return 2
+    except ValueError as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    if args.json:
+        print(json.dumps(feed, ensure_ascii=False, indent=2, default=str))
+        return 0
+
+    for change in feed['changes']:
+        print(
+            f"{change['seq']:>8}  {change['changed_at']}  {change['operation']:<6} "
+            f"{change['table_name']} #{change['row_id']} (desenho {change['desenho_id']})"
+        )
+    if feed['more']:
+        print("(há mais alterações: repetir com o token abaixo)")
+    print(f"Token: {feed['token']}")
+    return 0
+
+
+def cmd_prune_changes(args) -> int:
+    """Delete change-feed rows older than --days or up to --before TOKEN (the oldest token still in use)."""
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    try:
+        if args.before:
+            deleted = db.prune_change_feed(conn, before_token=args.before)
+        else:
+            deleted = db.prune_change_feed(conn, older_than_days=args.days)
+    except (ValueError, db.ChangeFeedReset) as e:
+        print(f"Erro: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    print(f"{deleted} alteração(ões) apagada(s) do feed")
+    return 0
+
+
+def cmd_watch(args) -> int:
+    """Run the folder watcher."""
+    import watcher
+
+    argv = ['--interval', str(args.interval), '--settle', str(args.settle)]
+    if args.once:
+        argv.append('--once')
+    watcher.main(argv)
+    return 0
+
+
+def cmd_jobs(args) -> int:
+    """List background jobs (LPP builds / imports started from the app) or cancel one."""
+    import jobs
+
+    conn = db.get_connection()
+    db.criar_tabelas(conn)
+    try:
+        if args.cancel is not None:
+            if not db.request_job_cancel(conn, args.cancel):
+                print(f"Tarefa #{args.cancel} não está em fila nem em curso", file=sys.stderr)
+                return 1
+            print(f"Cancelamento pedido para a tarefa #{args.cancel}")
+            return 0
+        recent = jobs.list_jobs(conn, limit=args.limit)
+    finally:
+        conn.close()
+
+    if not recent:
+        print("Sem tarefas")
+    for job in recent:
+        status = job['status']
+        if status in db.JOB_ACTIVE_STATUSES:
+            status += f" {job['phase'] or ''} {round((job['progress'] or 0) * 100)}%"
+        detail = job['error'] or job['message'] or ''
+        print(
+            f"#{job['id']:<5} {jobs.JOB_LABELS.get(job['kind'], job['kind']):<22} "
+            f"{status:<24} {job['created_at']}  {detail}".rstrip()
+        )
+    return 0
+
+
+def cmd_slow_queries(args) -> int:
+    """Summarize the slow-query log (worst total time first)."""
+    from sql_trace import summarize_slow_queries
+
+    report = summarize_slow_queries(args.log, args.top)
+
+    if not report:
+        print(f"Sem queries lentas em {args.log}")
+    for group in report:
+        flags = []
+        if group['full_scan']:
+            flags.append(f"FULL SCAN: {', '.join(group['full_scan'])}")
+        if group['temp_btree']:
+            flags.append("TEMP B-TREE")
+        print(
+            f"{group['total_ms']:9.1f} ms total | {group['count']:5d}x | "
+            f"avg {group['avg_ms']:7.2f} | max {group['max_ms']:7.2f} | {' | '.join(flags) or 'ok'}"
+        )
+        print(f"    {group['sql'][:200]}")
+        for detail in group['plan']:
+            print(f"      - {detail}")
+
+    if args.clear and Path(args.log).exists():
+        Path(args.log).unlink()
+    return 0
+
+
+def cmd_cache(args) -> int:
+    """Hit rates of the shared result cache (all app processes), or clear it."""
+    import result_cache
+
+    if args.clear:
+        deleted = result_cache.clear_cache(args.db, reset_stats=args.reset_stats)
+        print(f"{deleted} resultado(s) apagado(s) de {result_cache.cache_path_for(args.db)}")
+        return 0
+
+    report = result_cache.cache_stats(args.db)
+    if not report:
+        print(f"Cache vazio ({result_cache.cache_path_for(args.db)})")
+    for r in report:
+        hit_rate = f"{100 * r['hit_rate']:5.1f}%" if r['hit_rate'] is not None else "    -"
+        print(
+            f"{r['function']:<34} hits {r['hits']:>7}  misses {r['misses']:>6}  {hit_rate}  "
+            f"{r['entries']:>4} entradas {r['bytes'] / 1024 / 1024:7.1f} MB  evicted {r['evictions']}"
+        )
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m cli", description="JSJ Gestão de Desenhos - operações sem UI.")
+    parser.add_argument('--db', default=db.DB_PATH, help="Caminho da base de dados SQLite")
+    parser.add_argument('--trace-sql', type=float, metavar='MS', help="Registar queries mais lentas que MS")
+    parser.add_argument('--verbose', action='store_true', help="Uma linha por desenho / âncora do LPP")
+    parser.add_argument('--telemetry-log', metavar='PATH', help="Gravar os eventos de progresso em JSON-lines")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    p_import = subparsers.add_parser('import', help="Importar CSV/JSON para a DB")
+    p_import.add_argument('--csv-dir', default="data/csv_in")
+    p_import.add_argument('--json-dir', default="data/json_in")
+    p_import.add_argument('--only', choices=['csv', 'json'], help="Importar só um tipo de ficheiro")
+    p_import.add_argument('--file', action='append', help="Ficheiro individual (pode repetir)")
+    p_import.add_argument(
+        '--csv-engine', default='python', choices=['python', 'pandas'],
+        help="Motor de parse CSV (pandas = colunas + escrita em bloco)"
+    )
+    p_import.set_defaults(func=cmd_import)
+
+    p_lpp = subparsers.add_parser('build-lpp', help="Gerar/atualizar LPP.xlsx")
+    p_lpp.add_argument('--template', default="data/LPP_TEMPLATE.xlsx")
+    p_lpp.add_argument('--output', default="output/LPP.xlsx")
+    p_lpp.set_defaults(func=cmd_build_lpp)
+
+    p_export = subparsers.add_parser('export', help="Exportar CSV ALTERACOES_PARA_AUTOCAD")
+    export_scope = p_export.add_mutually_exclusive_group()
+    export_scope.add_argument('--dwg', help="Nome do DWG (omitir para todos num só ficheiro)")
+    export_scope.add_argument('--all-dwgs', action='store_true', help="Um ficheiro por DWG")
+    p_export.add_argument('--zip', action='store_true', help="Com --all-dwgs: juntar os ficheiros num zip")
+    p_export.add_argument(
+        '--columns', default='autocad', choices=['autocad', 'principal', 'completo', 'config'],
+        help="Conjunto de colunas (config = csv_config.json)"
+    )
+    p_export.add_argument('--output-dir', default="output")
+    p_export.add_argument('--changed-only', action='store_true', help="Só desenhos alterados desde a última exportação do DWG")
+    p_export.set_defaults(func=cmd_export)
+
+    p_stats = subparsers.add_parser('stats', help="Estatísticas da DB")
+    p_stats.add_argument('--json', action='store_true', help="Output em JSON")
+    p_stats.set_defaults(func=cmd_stats)
+
+    p_watch = subparsers.add_parser('watch', help="Vigiar pastas e importar automaticamente")
+    p_watch.add_argument('--interval', type=float, default=2.0)
+    p_watch.add_argument('--settle', type=float, default=3.0)
+    p_watch.add_argument('--once', action='store_true')
+    p_watch.set_defaults(func=cmd_watch)
+
+    p_id_cad = subparsers.add_parser('id-cad-log', help="Desenhos renomeados/fundidos/retirados por ID_CAD")
+    p_id_cad.add_argument('--limit', type=int, default=50)
+    p_id_cad.set_defaults(func=cmd_id_cad_log)
+
+    p_jobs = subparsers.add_parser('jobs', help="Tarefas em segundo plano (LPP / importações)")
+    p_jobs.add_argument('--limit', type=int, default=20)
+    p_jobs.add_argument('--cancel', type=int, metavar='ID', help="Pedir o cancelamento da tarefa ID")
+    p_jobs.set_defaults(func=cmd_jobs)
+
+    p_slow = subparsers.add_parser('slow-queries', help="Relatório do log de queries lentas")
+    p_slow.add_argument('--log', default="data/slow_queries.jsonl")
+    p_slow.add_argument('--top', type=int, default=20)
+    p_slow.add_argument('--clear', action='store_true', help="Apagar o log depois do relatório")
+    p_slow.set_defaults(func=cmd_slow_queries)
+
+    p_cache = subparsers.add_parser('cache', help="Cache de resultados partilhado: hit rates")
+    p_cache.add_argument('--clear', action='store_true', help="Apagar os resultados guardados")
+    p_cache.add_argument('--reset-stats', action='store_true', help="Com --clear: zerar também os contadores")
+    p_cache.set_defaults(func=cmd_cache)
+
+    p_audit = subparsers.add_parser('audit', help="Auditoria de um desenho (todas as alterações / estado numa data)")
+    p_audit.add_argument('desenho', help="ID ou layout_name do desenho")
+    p_audit.add_argument('--as-of', metavar='QUANDO', help="Mostrar o desenho como estava nesse instante (UTC)")
+    p_audit.set_defaults(func=cmd_audit)
+
+    p_prune_audit = subparsers.add_parser('prune-audit', help="Apagar a auditoria antiga")
+    p_prune_audit.add_argument(
+        '--days', type=int, default=db.AUDIT_RETENTION_DAYS,
+        help=f"Manter os últimos N dias (default: {db.AUDIT_RETENTION_DAYS})"
+    )
+    p_prune_audit.set_defaults(func=cmd_prune_audit)
+
+    p_changes = subparsers.add_parser('changes', help="Feed de alterações desde um token (sincronização incremental)")
+    p_changes.add_argument('--since', metavar='TOKEN', help="Token devolvido pela chamada anterior")
+    p_changes.add_argument('--limit', type=int, help="Máximo de alterações")
+    p_changes.add_argument('--rows', action='store_true', help="Incluir cada linha alterada como está agora")
+    p_changes.add_argument('--json', action='store_true', help="Output em JSON")
+    p_changes.set_defaults(func=cmd_changes)
+
+    p_prune_changes = subparsers.add_parser('prune-changes', help="Apagar alterações antigas do feed")
+    prune_limit = p_prune_changes.add_mutually_exclusive_group()
+    prune_limit.add_argument(
+        '--days', type=int, default=db.CHANGE_FEED_RETENTION_DAYS,
+        help=f"Manter os últimos N dias (default: {db.CHANGE_FEED_RETENTION_DAYS})"
+    )
+    prune_limit.add_argument('--before', metavar='TOKEN', help="Apagar até este token (o mais antigo ainda em uso)")
+    p_prune_changes.set_defaults(func=cmd_prune_changes)
+
+    return parser
+
+
+def main(argv: List[str] = None) -> int:
+    args = build_parser().parse_args(argv)
+    db.DB_PATH = args.db
+    if args.trace_sql is not None:
+        db.SQL_TRACE_THRESHOLD_MS = args.trace_sql
+    telemetry.configure(verbose=args.verbose, log_path=args.telemetry_log)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
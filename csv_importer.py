@@ -1,14 +1,38 @@
 """
 CSV importer - reads CSV files from data/csv_in/ and imports to database.
 Supports the 29-field "Todos os Campos" export from AutoLISP.
+
+Two parse engines:
+    python  csv.DictReader, one parse + upsert per row
+    pandas  read_csv(dtype=str), headers mapped once, stripping / key
+            normalization / max revision as column operations, then one
+            bulk upsert of the desenhos and one bulk sync of the revisoes
+Both write the same rows.
 """
 import csv
 import os
+import warnings
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Tuple
+
+from db import (
+    DESENHO_DATA_FIELDS, WRITES_COUNTER, bulk_sync_revisoes, bulk_upsert_desenhos, reconcile_id_cad, replace_revisoes,
+    upsert_desenho
+)
+from perf import timed
+import telemetry
+from utils import lazy_import, normalize_tipo_display_to_key, normalize_elemento_to_key
+
+pd = lazy_import("pandas")
+
 
-from db import upsert_desenho, replace_revisoes
-from utils import normalize_tipo_display_to_key, normalize_elemento_to_key
+# Motores de parse disponíveis (ver docstring do módulo)
+CSV_ENGINES = ['python', 'pandas']
+
+# Codificações tentadas por ordem
+CSV_ENCODINGS = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252']
+
+REV_LETTERS = ['a', 'b', 'c', 'd', 'e']
 
 
 # Mapeamento de headers CSV para campos internos
@@ -68,6 +92,7 @@ CSV_HEADER_MAP = {
     'DESCRIÇÃO REVISÃO E': 'desc_e',
     'DESCRICAO REVISAO E': 'desc_e',
     'DESC_E': 'desc_e',
+    'LAYOUT': 'layout_name',
     'NOME DWG': 'dwg_name',
     'DWG_SOURCE': 'dwg_name',
     'ID_CAD': 'id_cad',
@@ -93,6 +118,9 @@ def parse_csv_row(row: Dict[str, str], headers_map: Dict[str, str]) -> Dict[str,
     """
     parsed = {}
     for original_header, value in row.items():
+        if original_header is None:
+            # Extra trailing fields (LISP rows end with ';') have no header
+            continue
         normalized = headers_map.get(original_header, original_header.lower())
         parsed[normalized] = value.strip() if value else ''
     return parsed
@@ -109,7 +137,7 @@ def extract_revisoes_from_row(parsed: Dict[str, str]) -> List[Dict[str, str]]:
         List of revision dictionaries
     """
     revisoes = []
-    for letter in ['a', 'b', 'c', 'd', 'e']:
+    for letter in REV_LETTERS:
         rev_code = parsed.get(f'rev_{letter}', '').strip()
         rev_date = parsed.get(f'data_{letter}', '').strip()
         rev_desc = parsed.get(f'desc_{letter}', '').strip()
@@ -156,44 +184,62 @@ def load_csv_file(csv_path: str, delimiter: str = ';') -> List[Dict[str, str]]:
     rows = []
     
     # Try different encodings
-    encodings = ['utf-8', 'utf-8-sig', 'latin-1', 'cp1252']
-    
-    for encoding in encodings:
+    for encoding in CSV_ENCODINGS:
         try:
             with open(csv_path, 'r', encoding=encoding, newline='') as f:
                 reader = csv.DictReader(f, delimiter=delimiter)
                 rows = list(reader)
-                print(f"Loaded {csv_path} with encoding {encoding}")
+                telemetry.detail(f"Loaded {csv_path} with encoding {encoding}")
                 break
         except UnicodeDecodeError:
             continue
         except Exception as e:
-            print(f"Error loading {csv_path}: {e}")
+            telemetry.warning(f"Error loading {csv_path}: {e}")
             return []
     
     return rows
 
 
-def import_csv_to_db(csv_path: str, conn) -> int:
+@timed(rows=True)
+def import_csv_to_db(csv_path: str, conn, engine: str = 'python') -> int:
     """
     Import one CSV file into database.
     
     Args:
         csv_path: Path to CSV file
         conn: Database connection
+        engine: Parse engine ('python' or 'pandas', see CSV_ENGINES)
         
     Returns:
         Number of desenhos imported
     """
+    if engine == 'pandas':
+        return import_csv_frame_to_db(csv_path, conn)
+    if engine != 'python':
+        raise ValueError(f"Motor de CSV desconhecido: {engine}")
+
     rows = load_csv_file(csv_path)
     
     if not rows:
-        print(f"No data in {csv_path}")
+        telemetry.warning(f"No data in {csv_path}")
         return 0
     
     # Build headers map from first row's keys
     first_row = rows[0]
-    headers_map = {h: normalize_header(h) for h in first_row.keys()}
+    headers_map = {h: normalize_header(h) for h in first_row.keys() if h is not None}
+    
+    # Identidade por ID_CAD resolvida para o ficheiro inteiro antes dos upserts
+    # (uma troca de nomes entre dois layouts só se vê com as duas linhas)
+    original_header = {normalized: original for original, normalized in headers_map.items()}
+    
+    def field(row, name, default=''):
+        header = original_header.get(name)
+        return (row.get(header) or '').strip() if header else default
+    
+    reconcile_id_cad(conn, [
+        (field(row, 'layout_name'), field(row, 'dwg_name', 'UNKNOWN'), field(row, 'id_cad'))
+        for row in rows if field(row, 'layout_name')
+    ])
     
     count = 0
     
@@ -203,7 +249,7 @@ def import_csv_to_db(csv_path: str, conn) -> int:
         # Get layout name - required field
         layout_name = parsed.get('layout_name', '')
         if not layout_name:
-            print(f"Warning: Row without layout_name, skipping")
+            telemetry.count('sem_layout')
             continue
         
         # Extract data
@@ -246,71 +292,259 @@ def import_csv_to_db(csv_path: str, conn) -> int:
             'r_data': r_data,
             'r_desc': r_desc,
             'data': parsed.get('data', ''),
+            'id_cad': parsed.get('id_cad', ''),
             'raw_attributes': str(parsed)  # Store original parsed data
         }
         
         # Upsert desenho
-        desenho_id = upsert_desenho(conn, desenho_data)
+        desenho_id = upsert_desenho(conn, desenho_data, reconcile=False)
         
         # Replace revisoes
         replace_revisoes(conn, desenho_id, revisoes)
         
         count += 1
-        print(f"  Imported: {layout_name} (ID: {desenho_id})")
+        telemetry.detail(f"  Imported: {layout_name} (ID: {desenho_id})")
     
+    telemetry.count('desenhos', count)
     return count
 
 
-def import_all_csv(csv_dir: str, conn) -> Dict[str, int]:
+def load_csv_frame(csv_path: str, delimiter: str = ';'):
+    """
+    Load a CSV file as a DataFrame of strings (pandas engine).
+    
+    Args:
+        csv_path: Path to CSV file
+        delimiter: CSV delimiter (default ';')
+        
+    Returns:
+        DataFrame with the original headers, missing values as ''
+        (empty DataFrame if the file cannot be read)
+    """
+    for encoding in CSV_ENCODINGS:
+        try:
+            # index_col=False: LISP data rows end with ';' (one more field than
+            # the header); the empty extra field is dropped, like DictReader does
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', pd.errors.ParserWarning)
+                df = pd.read_csv(
+                    csv_path, sep=delimiter, dtype=str, keep_default_na=False,
+                    index_col=False, encoding=encoding
+                )
+            telemetry.detail(f"Loaded {csv_path} with encoding {encoding}")
+            break
+        except UnicodeDecodeError:
+            continue
+        except pd.errors.EmptyDataError:
+            return pd.DataFrame()
+        except Exception as e:
+            telemetry.warning(f"Error loading {csv_path}: {e}")
+            return pd.DataFrame()
+    else:
+        return pd.DataFrame()
+
+    df = df.drop(columns=[c for c in df.columns if str(c).startswith('Unnamed:')])
+    return df.fillna('')
+
+
+def parse_csv_frame(df) -> Tuple[Any, Any]:
+    """
+    Normalize a raw CSV frame into desenhos rows and revisoes (column operations).
+    
+    Args:
+        df: DataFrame from load_csv_frame
+        
+    Returns:
+        (desenhos, revisoes): desenhos has columns layout_name + DESENHO_DATA_FIELDS
+        (rows without layout_name dropped); revisoes has columns pos (row
+        position in desenhos), rev_code, rev_date, rev_desc in A-E order
+    """
+    # Headers mapeados uma vez; repetidos ficam com o último valor, como no dict do motor python
+    df = df.set_axis([normalize_header(str(h)) for h in df.columns], axis=1)
+    df = df.loc[:, ~df.columns.duplicated(keep='last')]
+    df = df.apply(lambda col: col.str.strip())
+
+    if 'layout_name' not in df.columns:
+        df = df.iloc[0:0].assign(layout_name='')
+    skipped = int((df['layout_name'] == '').sum())
+    if skipped:
+        telemetry.count('sem_layout', skipped)
+    df = df[df['layout_name'] != ''].reset_index(drop=True)
+
+    empty = pd.Series('', index=df.index, dtype=object)
+
+    def column(name: str, default=empty):
+        return df[name] if name in df.columns else default
+
+    # raw_attributes = str(dict) da linha, igual ao motor python (concatenar
+    # colunas de strings arrow é mais lento do que um str() por linha)
+    headers = list(df.columns)
+    raw_attributes = pd.Series(
+        [str(dict(zip(headers, values))) for values in zip(*(df[h].tolist() for h in headers))],
+        index=df.index, dtype=object
+    )
+
+    tipo_display = column('tipo_display')
+    elemento = column('elemento')
+    titulo = column('titulo')
+    elemento_titulo = elemento.where(elemento != '', titulo).mask(
+        (elemento != '') & (titulo != ''), elemento + ' - ' + titulo
+    )
+
+    # Revisão máxima = última letra com código válido
+    r, r_data, r_desc = empty, empty, empty
+    revisoes = []
+    for order, letter in enumerate(REV_LETTERS):
+        rev_code = column(f'rev_{letter}')
+        rev_date = column(f'data_{letter}')
+        rev_desc = column(f'desc_{letter}')
+        valid = (rev_code != '') & (rev_code != '-')
+        r, r_data, r_desc = r.mask(valid, rev_code), r_data.mask(valid, rev_date), r_desc.mask(valid, rev_desc)
+        revisoes.append(pd.DataFrame({
+            'pos': df.index[valid], 'order': order,
+            'rev_code': rev_code[valid], 'rev_date': rev_date[valid], 'rev_desc': rev_desc[valid],
+        }))
+
+    def normalized(values, normalize):
+        # Normalizadores só correm uma vez por valor distinto
+        return values.map({v: normalize(v) for v in values.unique()})
+
+    desenhos = pd.DataFrame({
+        'layout_name': df['layout_name'],
+        'dwg_name': column('dwg_name', pd.Series('UNKNOWN', index=df.index, dtype=object)),
+        'cliente': column('cliente'),
+        'obra': column('obra'),
+        'localizacao': column('localizacao'),
+        'especialidade': column('especialidade'),
+        'fase': column('fase'),
+        'projetou': column('projetou'),
+        'escalas': empty,  # Not in CSV
+        'tipo_display': tipo_display,
+        'tipo_key': normalized(tipo_display, normalize_tipo_display_to_key),
+        'elemento': elemento,
+        'titulo': titulo,
+        'elemento_titulo': elemento_titulo,
+        'elemento_key': normalized(elemento, normalize_elemento_to_key),
+        'des_num': column('des_num'),
+        'r': r,
+        'r_data': r_data,
+        'r_desc': r_desc,
+        'data': column('data'),
+        'id_cad': column('id_cad'),
+        'raw_attributes': raw_attributes,
+    }, columns=['layout_name', *DESENHO_DATA_FIELDS]).astype(object)
+
+    revisoes = pd.concat(revisoes, ignore_index=True).sort_values(['pos', 'order'], kind='stable')
+    return desenhos, revisoes[['pos', 'rev_code', 'rev_date', 'rev_desc']]
+
+
+@timed(rows=True)
+def import_csv_frame_to_db(csv_path: str, conn) -> int:
+    """
+    Import one CSV file with the pandas engine (bulk writes, one transaction
+    for the desenhos and one for the revisoes).
+    
+    Args:
+        csv_path: Path to CSV file
+        conn: Database connection
+        
+    Returns:
+        Number of desenhos imported
+    """
+    df = load_csv_frame(csv_path)
+    if df.empty:
+        telemetry.warning(f"No data in {csv_path}")
+        return 0
+
+    desenhos, revisoes = parse_csv_frame(df)
+    if desenhos.empty:
+        return 0
+
+    ids = bulk_upsert_desenhos(conn, list(desenhos.itertuples(index=False, name=None)))
+    row_ids = [ids[key] for key in zip(desenhos['layout_name'], desenhos['dwg_name'])]
+
+    # Layout repetido no ficheiro: ficam as revisões da última linha, como no motor python
+    last_pos = {desenho_id: pos for pos, desenho_id in enumerate(row_ids)}
+    revisoes_by_desenho = {desenho_id: [] for desenho_id in last_pos}
+    for pos, rev_code, rev_date, rev_desc in revisoes.itertuples(index=False, name=None):
+        desenho_id = row_ids[pos]
+        if last_pos[desenho_id] == pos:
+            revisoes_by_desenho[desenho_id].append((rev_code, rev_date, rev_desc))
+    bulk_sync_revisoes(conn, revisoes_by_desenho)
+
+    telemetry.count('desenhos', len(desenhos))
+    return len(desenhos)
+
+
+@timed
+def import_all_csv(
+    csv_dir: str,
+    conn,
+    engine: str = 'python'
+) -> Dict[str, int]:
     """
-    Import all CSV files from directory into database.
+    Import all CSV files from directory into database (telemetry phase
+    'importar', one progress step per file).
     
     Args:
         csv_dir: Path to directory with CSV files
         conn: Database connection
+        engine: Parse engine ('python' or 'pandas')
         
     Returns:
-        Dictionary with stats: files_processed, desenhos_imported
+        Dictionary with stats: files_processed, desenhos_imported,
+        db_writes (rows inserted/updated/deleted by the import's own
+        statements, not by triggers)
     """
     csv_path = Path(csv_dir)
     
     if not csv_path.exists():
-        print(f"Warning: Directory {csv_dir} does not exist")
+        telemetry.warning(f"Directory {csv_dir} does not exist")
         csv_path.mkdir(parents=True, exist_ok=True)
-        return {'files_processed': 0, 'desenhos_imported': 0}
+        return {'files_processed': 0, 'desenhos_imported': 0, 'db_writes': 0}
     
     total_desenhos = 0
     files_processed = 0
     
-    for csv_file in csv_path.glob("*.csv"):
-        print(f"\nProcessing: {csv_file.name}")
-        count = import_csv_to_db(str(csv_file), conn)
-        total_desenhos += count
-        files_processed += 1
+    csv_files = sorted(csv_path.glob("*.csv"))
+    with telemetry.phase('importar', total=len(csv_files), message=csv_dir) as phase_state:
+        for i, csv_file in enumerate(csv_files):
+            telemetry.progress(i, csv_file.name)
+            count = import_csv_to_db(str(csv_file), conn, engine)
+            total_desenhos += count
+            files_processed += 1
+            telemetry.count('ficheiros')
+        telemetry.progress(len(csv_files))
     
     return {
         'files_processed': files_processed,
-        'desenhos_imported': total_desenhos
+        'desenhos_imported': total_desenhos,
+        'db_writes': phase_state['counters'].get(WRITES_COUNTER, 0)
     }
 
 
-def import_single_csv(csv_path: str, conn) -> Dict[str, int]:
+@timed
+def import_single_csv(csv_path: str, conn, engine: str = 'python') -> Dict[str, int]:
     """
     Import a single CSV file into database.
     
     Args:
         csv_path: Path to CSV file
         conn: Database connection
+        engine: Parse engine ('python' or 'pandas')
         
     Returns:
         Dictionary with stats
     """
     if not Path(csv_path).exists():
-        return {'files_processed': 0, 'desenhos_imported': 0, 'error': 'File not found'}
+        return {'files_processed': 0, 'desenhos_imported': 0, 'db_writes': 0, 'error': 'File not found'}
     
-    count = import_csv_to_db(csv_path, conn)
+    with telemetry.phase('importar', total=1, message=Path(csv_path).name) as phase_state:
+        count = import_csv_to_db(csv_path, conn, engine)
+        telemetry.count('ficheiros')
     
     return {
         'files_processed': 1,
-        'desenhos_imported': count
+        'desenhos_imported': count,
+        'db_writes': phase_state['counters'].get(WRITES_COUNTER, 0)
     }
@@ -1,28 +1,216 @@
 """
 Database connection and CRUD operations for SQLite desenhos.db
 """
+import functools
+import os
+import random
 import sqlite3
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional, List, Dict, Any, Sequence, Tuple
 import json
+import zlib
+
+from perf import timed
+from result_cache import cached
+import telemetry
 
 
 DB_PATH = "data/desenhos.db"
 
+# Campos do desenho vindos do CAD (CSV/JSON), escritos por upsert_desenho
+DESENHO_DATA_FIELDS = [
+    'dwg_name', 'cliente', 'obra', 'localizacao', 'especialidade', 'fase', 'projetou',
+    'escalas', 'tipo_display', 'tipo_key', 'elemento', 'titulo', 'elemento_titulo',
+    'elemento_key', 'des_num', 'r', 'r_data', 'r_desc', 'data', 'id_cad', 'raw_attributes',
+]
+
+# Campos internos (não vêm do CAD); numa fusão ficam os do desenho mantido se preenchidos
+DESENHO_INTERNAL_FIELDS = ['estado_interno', 'comentario', 'data_limite', 'responsavel']
+
+# Campos do desenho registados em desenhos_audit (get_desenho_as_of / get_desenho_audit)
+AUDIT_COLUMNS = ['layout_name', *DESENHO_DATA_FIELDS, *DESENHO_INTERNAL_FIELDS]
+
+# Ordem base das listagens de desenhos; id desempata linhas iguais para que a
+# grelha e o export ordenem empates da mesma forma
+DESENHOS_BASE_ORDER = ['tipo_key', 'elemento_key', 'des_num', 'id']
+
+# Contador telemétrico das linhas escritas pelas instruções dos importadores
+# (sem as dos triggers; é o db_writes das estatísticas de importação)
+WRITES_COUNTER = 'escritas'
+
+# Instante de cada alteração em desenhos_audit e change_feed (UTC, com milissegundos)
+CHANGE_TIMESTAMP_SQL = "strftime('%Y-%m-%d %H:%M:%f', 'now')"
+
+# Tabelas do feed de alterações (get_changes_since) -> coluna com o id do desenho
+CHANGE_FEED_TABLES = {'desenhos': 'id', 'revisoes': 'desenho_id', 'historico_comentarios': 'desenho_id'}
+
+# Next value of desenhos.change_seq (uses idx_desenhos_change_seq). Export
+# watermarks are included so the sequence never goes back after deletions.
+NEXT_CHANGE_SEQ_SQL = """(SELECT MAX(
+    COALESCE((SELECT MAX(change_seq) FROM desenhos), 0),
+    COALESCE((SELECT MAX(change_seq) FROM export_watermarks), 0)
+) + 1)"""
 
-def get_connection():
-    """Get SQLite database connection."""
-    conn = sqlite3.connect(DB_PATH)
+# Tabelas cujas escritas mudam a versão dos dados (invalidam o cache de resultados)
+DATA_VERSION_TABLES = ['desenhos', 'revisoes', 'historico_comentarios', 'export_watermarks']
+
+# Espera do SQLite por um lock antes de "database is locked" (segundos)
+DB_BUSY_TIMEOUT_S = 10.0
+
+# Escritas que ainda assim encontram a DB ocupada: novas tentativas com backoff exponencial (com jitter)
+WRITE_RETRY_ATTEMPTS = 5
+WRITE_RETRY_BASE_DELAY_S = 0.1
+WRITE_RETRY_MAX_DELAY_S = 2.0
+
+# Slow-query log threshold in ms (None = tracing off). See sql_trace.py.
+SQL_TRACE_THRESHOLD_MS = float(os.environ['JSJ_SQL_TRACE_MS']) if os.environ.get('JSJ_SQL_TRACE_MS') else None
+
+
+@timed
+def get_connection(trace_threshold_ms: float = None, **connect_kwargs):
+    """
+    Get SQLite database connection.
+    
+    Args:
+        trace_threshold_ms: Log statements slower than this (ms), with their
+            query plan, to the slow-query log. Defaults to SQL_TRACE_THRESHOLD_MS
+            (env JSJ_SQL_TRACE_MS); None disables tracing.
+        connect_kwargs: Extra sqlite3.connect() arguments (e.g. check_same_thread)
+    """
+    threshold = trace_threshold_ms if trace_threshold_ms is not None else SQL_TRACE_THRESHOLD_MS
+    if threshold is not None:
+        from sql_trace import connect_traced
+        conn = connect_traced(DB_PATH, threshold, timeout=DB_BUSY_TIMEOUT_S, **connect_kwargs)
+    else:
+        conn = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT_S, **connect_kwargs)
     conn.row_factory = sqlite3.Row  # Enable column access by name
     return conn
 
 
+@timed
+def open_read_snapshot(trace_threshold_ms: float = None):
+    """
+    Open a read-only connection that sees the whole database as of one instant.
+    
+    Under WAL the connection holds one read transaction: every query on it
+    reads the same snapshot while imports keep committing, and it never
+    blocks them. Without WAL a held read lock would stall the writers
+    instead, so the database is copied to memory with the backup API and
+    the lock released at once.
+    
+    Close it as soon as the reads are done - while it is open, WAL
+    checkpoints cannot get past its snapshot. It may be closed from another
+    thread (check_same_thread is off).
+    
+    Args:
+        trace_threshold_ms: As in get_connection() (WAL only)
+    
+    Returns:
+        Connection (row_factory sqlite3.Row, writes rejected)
+    """
+    conn = get_connection(trace_threshold_ms, check_same_thread=False)
+    if conn.execute("PRAGMA journal_mode").fetchone()[0].lower() != 'wal':
+        copy = sqlite3.connect(":memory:", check_same_thread=False)
+        conn.backup(copy)
+        conn.close()
+        conn = copy
+        conn.row_factory = sqlite3.Row
+    
+    conn.execute("PRAGMA query_only = ON")
+    # Under WAL the snapshot is fixed by the first read of the transaction
+    conn.execute("BEGIN")
+    conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    return conn
+
+
+class ChangeFeedReset(Exception):
+    """A change-feed token does not belong to this database state: the consumer must re-read everything."""
+
+
+class VersionConflict(Exception):
+    """
+    A desenho changed (or was deleted) after the version an edit was based on.
+    
+    Attributes:
+        desenho_id: ID of the desenho
+        expected_version: Version the edit was based on
+        current: Current row as a dict (None if the desenho no longer exists)
+    """
+    
+    def __init__(self, desenho_id: int, expected_version: int, current: Optional[Dict[str, Any]]):
+        self.desenho_id = desenho_id
+        self.expected_version = expected_version
+        self.current = current
+        state = f"versão atual {current['version']}" if current else "apagado"
+        super().__init__(
+            f"Desenho {desenho_id} alterado por outro utilizador (editado na versão {expected_version}, {state})"
+        )
+
+
+def is_busy_error(error: Exception) -> bool:
+    """True for SQLite "database is locked" / "database is busy" errors."""
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def retry_on_busy(func):
+    """
+    Retry a write function(conn, ...) when the database stays locked past
+    DB_BUSY_TIMEOUT_S: the transaction is rolled back and run again after an
+    exponential backoff with jitter, at most WRITE_RETRY_ATTEMPTS times.
+    
+    Only a call that owns its transaction is retried; if the connection was
+    already inside one (commit=False callers), the error is re-raised for the
+    caller to handle.
+    """
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        owns_transaction = not conn.in_transaction
+        for attempt in range(WRITE_RETRY_ATTEMPTS):
+            try:
+                return func(conn, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not (owns_transaction and is_busy_error(e)) or attempt == WRITE_RETRY_ATTEMPTS - 1:
+                    raise
+                conn.rollback()
+                delay = min(WRITE_RETRY_MAX_DELAY_S, WRITE_RETRY_BASE_DELAY_S * 2 ** attempt)
+                time.sleep(random.uniform(delay / 2, delay))
+    return wrapper
+
+
+def _count_writes(cursor):
+    """Add the rows of the cursor's last write (trigger writes excluded) to the WRITES_COUNTER counter."""
+    if cursor.rowcount > 0:
+        telemetry.count(WRITES_COUNTER, cursor.rowcount)
+
+
+def _rev_date_iso_sql(column: str) -> str:
+    """SQL expression turning a DD-MM-YYYY column into YYYY-MM-DD (for comparisons)."""
+    return f"(SUBSTR({column}, 7, 4) || '-' || SUBSTR({column}, 4, 2) || '-' || SUBSTR({column}, 1, 2))"
+
+
+def get_data_version(conn) -> Tuple[str, int]:
+    """
+    Current data version of the database (see DATA_VERSION_TABLES).
+    
+    Returns:
+        (token, version); the version grows with every written row
+    """
+    row = conn.execute("SELECT token, version FROM data_version WHERE id = 1").fetchone()
+    return row[0], row[1]
+
+
+@timed
 def criar_tabelas(conn):
     """
     Create desenhos, revisoes, and historico_comentarios tables if they don't exist.
     """
     cursor = conn.cursor()
     
+    # WAL: readers never block the writer (nor the writer the readers); persistent in the file
+    cursor.execute("PRAGMA journal_mode = WAL")
+    
     # Table: desenhos
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS desenhos (
@@ -121,6 +309,34 @@ def criar_tabelas(conn):
         )
     """)
     
+    # Table: ficheiros_importados (ficheiros importados pelo watcher)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ficheiros_importados (
+            path TEXT PRIMARY KEY,
+            mtime REAL,
+            size INTEGER,
+            content_hash TEXT,
+            desenhos_imported INTEGER,
+            arrived_at TEXT,
+            committed_at TEXT,
+            latency_ms REAL,
+            error TEXT
+        )
+    """)
+    
+    # Table: perf_log (rolling log of per-rerun timings from perf.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS perf_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            run_id TEXT NOT NULL,
+            name TEXT NOT NULL,
+            calls INTEGER,
+            total_ms REAL,
+            rows INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
     # Index on layout_name for faster lookups
     cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_layout_name ON desenhos(layout_name)
@@ -136,21 +352,293 @@ def criar_tabelas(conn):
         CREATE INDEX IF NOT EXISTS idx_estado_interno ON desenhos(estado_interno)
     """)
     
+    # Unique index on revisoes(desenho_id, rev_code): one row per revision letter.
+    # Older DBs may hold duplicates (replace_revisoes used to re-insert blindly),
+    # so keep only the newest row of each pair before creating the index.
+    cursor.execute("""
+        SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_revisoes_desenho_rev'
+    """)
+    if not cursor.fetchone():
+        cursor.execute("""
+            DELETE FROM revisoes WHERE id NOT IN (
+                SELECT MAX(id) FROM revisoes GROUP BY desenho_id, rev_code
+            )
+        """)
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_revisoes_desenho_rev ON revisoes(desenho_id, rev_code)
+        """)
+
+    # rev_iso: rev_date as YYYY-MM-DD (NULL without a date; shorter than 10
+    # characters when rev_date is not DD-MM-YYYY). Virtual column,
+    # but its values are stored in idx_revisoes_iso, so set-based history
+    # queries (get_historico_diff) read them from the index instead of
+    # re-parsing every rev_date
+    try:
+        cursor.execute(f"""
+            ALTER TABLE revisoes ADD COLUMN rev_iso TEXT GENERATED ALWAYS AS (
+                CASE WHEN rev_date IS NOT NULL AND rev_date NOT IN ('', '-')
+                     THEN {_rev_date_iso_sql('rev_date')} END
+            ) VIRTUAL
+        """)
+    except:
+        pass
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_revisoes_iso ON revisoes(desenho_id, rev_iso, rev_code)
+    """)
+
+    # Change sequence: bumped whenever a field exported to AutoCAD (or a revision) changes
+    try:
+        cursor.execute("ALTER TABLE desenhos ADD COLUMN change_seq INTEGER DEFAULT 0")
+    except:
+        pass
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_desenhos_change_seq ON desenhos(change_seq)
+    """)
+    
+    # Export watermarks: last change_seq exported per DWG (delta exports)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS export_watermarks (
+            dwg_name TEXT PRIMARY KEY,
+            change_seq INTEGER NOT NULL,
+            exported_at TIMESTAMP,
+            desenhos_exported INTEGER
+        )
+    """)
+    
+    # id_cad: AutoCAD handle of the layout, the identity of a desenho within
+    # its DWG (survives layout renames). Backfilled from raw_attributes once.
+    try:
+        cursor.execute("ALTER TABLE desenhos ADD COLUMN id_cad TEXT")
+        id_cad_added = True
+    except:
+        id_cad_added = False
+    if id_cad_added:
+        from export_columns import register_export_functions
+        register_export_functions(conn)
+        cursor.execute("UPDATE desenhos SET id_cad = COALESCE(raw_attr(raw_attributes, 'id_cad'), '')")
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_desenhos_id_cad ON desenhos(dwg_name, id_cad)
+    """)
+    
+    # Row version: incremented by every UPDATE of a desenho, so edits can be
+    # applied with compare-and-swap (optimistic concurrency, see VersionConflict)
+    try:
+        cursor.execute("ALTER TABLE desenhos ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+    except:
+        pass
+    
+    # Table: jobs (background LPP builds / imports, see jobs.py). The partial
+    # unique index makes an identical queued/running job impossible to duplicate.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT,
+            dedup_key TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            phase TEXT,
+            progress REAL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            cancel_requested INTEGER DEFAULT 0,
+            owner TEXT,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active ON jobs(dedup_key)
+        WHERE status IN ('queued', 'running')
+    """)
+    
+    # Table: id_cad_log (renames, merges and retirements done by reconcile_id_cad)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS id_cad_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            action TEXT NOT NULL,
+            dwg_name TEXT,
+            layout_name TEXT,
+            id_cad TEXT,
+            new_layout_name TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    
+    # Data version: one counter bumped by triggers on every write to the
+    # tables cached reads depend on (result_cache.py). The token tells apart
+    # databases that happen to be at the same version.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            token TEXT NOT NULL,
+            version INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO data_version (id, token, version) VALUES (1, lower(hex(randomblob(8))), 0)")
+    for table in DATA_VERSION_TABLES:
+        for operation in ('INSERT', 'UPDATE', 'DELETE'):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation.lower()}_data_version
+                AFTER {operation} ON {table}
+                BEGIN
+                    UPDATE data_version SET version = version + 1 WHERE id = 1;
+                END
+            """)
+    
+    # History snapshots: per date, the revision current for each desenho
+    # (zlib-compressed JSON, see prewarm_historico_snapshots). A revisoes row
+    # written with a date on or before a snapshot's date deletes that snapshot.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS historico_snapshots (
+            snapshot_date TEXT PRIMARY KEY,
+            target_iso TEXT NOT NULL,
+            revisoes BLOB,
+            built_at TEXT
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_historico_snapshots_iso ON historico_snapshots(target_iso)
+    """)
+    for operation, rows in (('INSERT', ['NEW']), ('UPDATE', ['OLD', 'NEW']), ('DELETE', ['OLD'])):
+        deletes = "".join(
+            f"""
+                    DELETE FROM historico_snapshots
+                    WHERE {row}.rev_date IS NOT NULL AND {row}.rev_date NOT IN ('', '-')
+                    AND target_iso >= {_rev_date_iso_sql(row + '.rev_date')};"""
+            for row in rows
+        )
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_revisoes_{operation.lower()}_historico
+            AFTER {operation} ON revisoes
+            BEGIN{deletes}
+            END
+        """)
+    # Snapshots built before dates shorter than DD-MM-YYYY were skipped (user_version 0)
+    # may hold such revisions: drop them once, prewarm rebuilds them
+    if cursor.execute("PRAGMA user_version").fetchone()[0] < 1:
+        cursor.execute("DELETE FROM historico_snapshots")
+        cursor.execute("PRAGMA user_version = 1")
+    
+    # Audit log of desenhos: undo log with one row per changed column holding
+    # its value before the change (an insert or delete also writes one row
+    # with column_name NULL). A desenho at any time is rebuilt from the first
+    # change of each column after that time: one index seek per column.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS desenhos_audit (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            desenho_id INTEGER NOT NULL,
+            changed_at TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            column_name TEXT,
+            old_value
+        )
+    """)
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_desenhos_audit_lookup ON desenhos_audit(desenho_id, column_name, changed_at)
+    """)
+    # Instante até ao qual a auditoria foi apagada (prune_desenhos_audit): antes
+    # dele get_desenho_as_of já não consegue reconstruir os desenhos
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS desenhos_audit_pruned (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            pruned_before TEXT NOT NULL
+        )
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_desenhos_insert_audit
+        AFTER INSERT ON desenhos
+        BEGIN
+            INSERT INTO desenhos_audit (desenho_id, changed_at, operation)
+            VALUES (NEW.id, {CHANGE_TIMESTAMP_SQL}, 'insert');
+        END
+    """)
+    changed_columns = "\n                UNION ALL ".join(
+        f"SELECT '{column}' AS column_name, OLD.{column} AS old_value WHERE OLD.{column} IS NOT NEW.{column}"
+        for column in AUDIT_COLUMNS
+    )
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_desenhos_update_audit
+        AFTER UPDATE OF {', '.join(AUDIT_COLUMNS)} ON desenhos
+        BEGIN
+            INSERT INTO desenhos_audit (desenho_id, changed_at, operation, column_name, old_value)
+            SELECT NEW.id, {CHANGE_TIMESTAMP_SQL}, 'update', column_name, old_value FROM (
+                {changed_columns}
+            );
+        END
+    """)
+    deleted_columns = "\n                UNION ALL ".join(f"SELECT '{column}', OLD.{column}" for column in AUDIT_COLUMNS)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_desenhos_delete_audit
+        AFTER DELETE ON desenhos
+        BEGIN
+            INSERT INTO desenhos_audit (desenho_id, changed_at, operation, column_name, old_value)
+            SELECT OLD.id, {CHANGE_TIMESTAMP_SQL}, 'delete', column_name, old_value FROM (
+                SELECT NULL AS column_name, NULL AS old_value
+                UNION ALL {deleted_columns}
+            );
+        END
+    """)
+    
+    # Change feed: one row per written row of CHANGE_FEED_TABLES, in commit
+    # order (AUTOINCREMENT: seq never goes back nor is reused). Consumers
+    # keep the token of the last change they read (get_changes_since).
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS change_feed (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            table_name TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            desenho_id INTEGER,
+            changed_at TEXT NOT NULL
+        )
+    """)
+    for table, desenho_column in CHANGE_FEED_TABLES.items():
+        for operation, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS trg_{table}_{operation.lower()}_change_feed
+                AFTER {operation} ON {table}
+                BEGIN
+                    INSERT INTO change_feed (table_name, operation, row_id, desenho_id, changed_at)
+                    VALUES ('{table}', '{operation.lower()}', {row}.id, {row}.{desenho_column}, {CHANGE_TIMESTAMP_SQL});
+                END
+            """)
+    
     conn.commit()
 
 
-def upsert_desenho(conn, desenho_data: Dict[str, Any]) -> int:
+@timed
+@retry_on_busy
+def upsert_desenho(conn, desenho_data: Dict[str, Any], reconcile: bool = True) -> int:
     """
     Insert or update a desenho based on layout_name.
     
+    When id_cad is given, the row with the same (dwg_name, id_cad) is
+    renamed to layout_name first (see reconcile_id_cad), so a renamed layout
+    updates its row instead of inserting a new one.
+    An existing row is only rewritten when one of its fields actually
+    changed; updated_at and change_seq move only in that case.
+    
     Args:
         conn: Database connection
         desenho_data: Dictionary with desenho fields
+        reconcile: False if the caller already ran reconcile_id_cad for
+            the whole file (skips the per-row id_cad lookup)
         
     Returns:
         desenho_id of the inserted/updated record
     """
     cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    values = [desenho_data.get(field, '') for field in DESENHO_DATA_FIELDS]
+    
+    # Renamed layout: move the row with the same id_cad onto the new name first
+    if reconcile and desenho_data.get('id_cad'):
+        reconcile_id_cad(
+            conn, [(desenho_data['layout_name'], desenho_data.get('dwg_name', ''), desenho_data['id_cad'])],
+            commit=False
+        )
     
     # Check if layout_name + dwg_name exists (composite key)
     cursor.execute(
@@ -160,130 +648,424 @@ def upsert_desenho(conn, desenho_data: Dict[str, Any]) -> int:
     existing = cursor.fetchone()
     
     if existing:
-        # UPDATE
+        # UPDATE (only if something changed)
         desenho_id = existing[0]
-        cursor.execute("""
+        set_clause = ', '.join(f"{field} = ?" for field in DESENHO_DATA_FIELDS)
+        changed_clause = ' OR '.join(f"{field} IS NOT ?" for field in DESENHO_DATA_FIELDS)
+        cursor.execute(f"""
             UPDATE desenhos SET
-                dwg_name = ?,
-                cliente = ?,
-                obra = ?,
-                localizacao = ?,
-                especialidade = ?,
-                fase = ?,
-                projetou = ?,
-                escalas = ?,
-                tipo_display = ?,
-                tipo_key = ?,
-                elemento = ?,
-                titulo = ?,
-                elemento_titulo = ?,
-                elemento_key = ?,
-                des_num = ?,
-                r = ?,
-                r_data = ?,
-                r_desc = ?,
-                data = ?,
-                raw_attributes = ?,
-                updated_at = ?
-            WHERE id = ?
-        """, (
-            desenho_data.get('dwg_name', ''),
-            desenho_data.get('cliente', ''),
-            desenho_data.get('obra', ''),
-            desenho_data.get('localizacao', ''),
-            desenho_data.get('especialidade', ''),
-            desenho_data.get('fase', ''),
-            desenho_data.get('projetou', ''),
-            desenho_data.get('escalas', ''),
-            desenho_data.get('tipo_display', ''),
-            desenho_data.get('tipo_key', ''),
-            desenho_data.get('elemento', ''),
-            desenho_data.get('titulo', ''),
-            desenho_data.get('elemento_titulo', ''),
-            desenho_data.get('elemento_key', ''),
-            desenho_data.get('des_num', ''),
-            desenho_data.get('r', ''),
-            desenho_data.get('r_data', ''),
-            desenho_data.get('r_desc', ''),
-            desenho_data.get('data', ''),
-            desenho_data.get('raw_attributes', ''),
-            datetime.now().isoformat(),
-            desenho_id
-        ))
+                {set_clause},
+                updated_at = ?,
+                change_seq = {NEXT_CHANGE_SEQ_SQL},
+                version = version + 1
+            WHERE id = ? AND ({changed_clause})
+        """, values + [now, desenho_id] + values)
+        _count_writes(cursor)
     else:
         # INSERT
-        cursor.execute("""
+        cursor.execute(f"""
             INSERT INTO desenhos (
-                layout_name, dwg_name, cliente, obra, localizacao,
-                especialidade, fase, projetou, escalas, tipo_display,
-                tipo_key, elemento, titulo, elemento_titulo, elemento_key, des_num,
-                r, r_data, r_desc, data, raw_attributes, created_at, updated_at
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            desenho_data['layout_name'],
-            desenho_data.get('dwg_name', ''),
-            desenho_data.get('cliente', ''),
-            desenho_data.get('obra', ''),
-            desenho_data.get('localizacao', ''),
-            desenho_data.get('especialidade', ''),
-            desenho_data.get('fase', ''),
-            desenho_data.get('projetou', ''),
-            desenho_data.get('escalas', ''),
-            desenho_data.get('tipo_display', ''),
-            desenho_data.get('tipo_key', ''),
-            desenho_data.get('elemento', ''),
-            desenho_data.get('titulo', ''),
-            desenho_data.get('elemento_titulo', ''),
-            desenho_data.get('elemento_key', ''),
-            desenho_data.get('des_num', ''),
-            desenho_data.get('r', ''),
-            desenho_data.get('r_data', ''),
-            desenho_data.get('r_desc', ''),
-            desenho_data.get('data', ''),
-            desenho_data.get('raw_attributes', ''),
-            datetime.now().isoformat(),
-            datetime.now().isoformat()
-        ))
+                layout_name, {', '.join(DESENHO_DATA_FIELDS)}, created_at, updated_at, change_seq
+            ) VALUES (?, {', '.join('?' * len(DESENHO_DATA_FIELDS))}, ?, ?, {NEXT_CHANGE_SEQ_SQL})
+        """, [desenho_data['layout_name']] + values + [now, now])
+        _count_writes(cursor)
         desenho_id = cursor.lastrowid
     
     conn.commit()
     return desenho_id
 
 
-def replace_revisoes(conn, desenho_id: int, revisoes_list: List[Dict[str, str]]):
+@timed(rows=True)
+@retry_on_busy
+def replace_revisoes(conn, desenho_id: int, revisoes_list: List[Dict[str, str]]) -> int:
     """
-    Delete all existing revisoes for desenho_id and insert new ones.
+    Sync revisoes for desenho_id with revisoes_list.
+    
+    Revisions are upserted on (desenho_id, rev_code) and only rows whose
+    date/description actually changed are rewritten; codes no longer present
+    are deleted. Re-importing an unchanged drawing writes nothing.
     
     Args:
         conn: Database connection
         desenho_id: ID of the desenho
         revisoes_list: List of revision dicts with keys: rev_code/rev, rev_date/data, rev_desc/desc
+        
+    Returns:
+        Number of revisoes rows written (inserted, updated or deleted)
     """
     cursor = conn.cursor()
+    # Rows of these statements only (conn.total_changes also counts trigger writes)
+    changes = 0
     
-    # Delete existing revisoes
-    cursor.execute("DELETE FROM revisoes WHERE desenho_id = ?", (desenho_id,))
-    
-    # Insert new revisoes (support both key naming conventions)
+    # Normalize input (support both key naming conventions)
+    rev_codes = []
     for rev in revisoes_list:
         rev_code = rev.get('rev_code', rev.get('rev', ''))
         rev_date = rev.get('rev_date', rev.get('data', ''))
         rev_desc = rev.get('rev_desc', rev.get('desc', ''))
         
-        if rev_code:  # Only insert if there's a revision code
+        if rev_code:  # Only keep rows with a revision code
+            rev_codes.append(rev_code)
             cursor.execute("""
                 INSERT INTO revisoes (desenho_id, rev_code, rev_date, rev_desc)
                 VALUES (?, ?, ?, ?)
+                ON CONFLICT(desenho_id, rev_code) DO UPDATE SET
+                    rev_date = excluded.rev_date,
+                    rev_desc = excluded.rev_desc
+                WHERE rev_date IS NOT excluded.rev_date
+                   OR rev_desc IS NOT excluded.rev_desc
             """, (
                 desenho_id,
                 rev_code,
                 rev_date,
                 rev_desc
             ))
+            _count_writes(cursor)
+            changes += cursor.rowcount
+    
+    # Delete revisoes that are no longer present
+    if rev_codes:
+        placeholders = ','.join('?' * len(rev_codes))
+        cursor.execute(
+            f"DELETE FROM revisoes WHERE desenho_id = ? AND rev_code NOT IN ({placeholders})",
+            [desenho_id] + rev_codes
+        )
+    else:
+        cursor.execute("DELETE FROM revisoes WHERE desenho_id = ?", (desenho_id,))
+    _count_writes(cursor)
+    changes += cursor.rowcount
+    
+    if changes:
+        # Revisions are exported with the desenho - mark it as changed
+        cursor.execute(f"""
+            UPDATE desenhos SET updated_at = ?, change_seq = {NEXT_CHANGE_SEQ_SQL}, version = version + 1 WHERE id = ?
+        """, (datetime.now().isoformat(), desenho_id))
+        _count_writes(cursor)
     
     conn.commit()
+    return changes
+
+
+@timed
+@retry_on_busy
+def reconcile_id_cad(conn, keys: List[Tuple[str, str, str]], commit: bool = True) -> Dict[str, int]:
+    """
+    Match incoming desenhos to existing rows by (dwg_name, id_cad) before an upsert.
+    
+    The LISP tools rename layouts (ATUALIZAR NOMES, NUMERAR SEQ, ...) but the
+    AutoCAD handle stays, so for every incoming (layout_name, dwg_name, id_cad):
+        - the row with that handle is renamed to layout_name (renamed)
+        - other rows with the same handle, left behind by earlier renames,
+          are folded into it: internal fields it lacks and its comment
+          history are moved over, then they are deleted (merged)
+        - a row that held layout_name with another handle is deleted
+          (retired); one without a handle is folded in (merged)
+    Afterwards the usual (layout_name, dwg_name) upsert hits the right row.
+    Keys without id_cad are left to that layout-name fallback. Every action
+    is recorded in id_cad_log.
+    
+    Args:
+        conn: Database connection
+        keys: (layout_name, dwg_name, id_cad) of the desenhos about to be upserted
+        commit: Commit at the end (False leaves the transaction open for the caller)
+        
+    Returns:
+        Dict with counts: renamed, merged, retired
+    """
+    counts = {'renamed': 0, 'merged': 0, 'retired': 0}
+    incoming = {(dwg_name, id_cad): layout_name for layout_name, dwg_name, id_cad in keys if id_cad}
+    if not incoming:
+        return counts
+    
+    cursor = conn.cursor()
+    columns = ['id', 'layout_name', 'dwg_name', 'id_cad', *DESENHO_INTERNAL_FIELDS]
+    wanted: Dict[str, Tuple[set, set]] = {}
+    for (dwg_name, id_cad), layout_name in incoming.items():
+        handles, layouts = wanted.setdefault(dwg_name, (set(), set()))
+        handles.add(id_cad)
+        layouts.add(layout_name)
+    
+    # Rows holding one of the incoming handles or layout names (both indexed)
+    rows: Dict[int, Dict[str, Any]] = {}
+    for dwg_name, (handles, layouts) in wanted.items():
+        for field, values in (('id_cad', sorted(handles)), ('layout_name', sorted(layouts))):
+            for start in range(0, len(values), 500):
+                chunk = values[start:start + 500]
+                cursor.execute(
+                    f"""SELECT {', '.join(columns)} FROM desenhos
+                        WHERE dwg_name = ? AND {field} IN ({','.join('?' * len(chunk))})""",
+                    [dwg_name] + chunk
+                )
+                for row in cursor.fetchall():
+                    rows[row[0]] = dict(zip(columns, row))
+    
+    by_handle: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+    by_layout: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    for row in rows.values():
+        if row['id_cad']:
+            by_handle.setdefault((row['dwg_name'], row['id_cad']), []).append(row)
+        by_layout[(row['dwg_name'], row['layout_name'])] = row
+    
+    merges = []    # (duplicate, kept row)
+    renames = {}   # row id -> (row, new layout_name)
+    for (dwg_name, id_cad), layout_name in incoming.items():
+        group = by_handle.get((dwg_name, id_cad))
+        if not group:
+            continue
+        keep = next((r for r in group if r['layout_name'] == layout_name), min(group, key=lambda r: r['id']))
+        merges.extend((r, keep) for r in group if r is not keep)
+        if keep['layout_name'] != layout_name:
+            renames[keep['id']] = (keep, layout_name)
+    
+    removed = {dup['id'] for dup, _ in merges}
+    retires = []
+    for row_id, (keep, layout_name) in list(renames.items()):
+        holder = by_layout.get((keep['dwg_name'], layout_name))
+        if holder is None or holder['id'] in removed or holder['id'] in renames:
+            # Free name, or its holder is itself renamed away (layouts swapped)
+            continue
+        if holder['id_cad'] and (holder['dwg_name'], holder['id_cad']) in incoming:
+            # Two handles claim the same layout in this import: leave it to the layout fallback
+            del renames[row_id]
+        elif holder['id_cad']:
+            retires.append(holder)
+            removed.add(holder['id'])
+        else:
+            merges.append((holder, keep))
+            removed.add(holder['id'])
+    
+    now = datetime.now().isoformat()
+    log = []
+    
+    for dup, keep in merges:
+        new_layout = renames[keep['id']][1] if keep['id'] in renames else keep['layout_name']
+        set_clause = ', '.join(
+            f"{field} = CASE WHEN {field} IS NULL OR {field} = ? THEN COALESCE(?, {field}) ELSE {field} END"
+            for field in DESENHO_INTERNAL_FIELDS
+        )
+        params = []
+        for field in DESENHO_INTERNAL_FIELDS:
+            params += ['projeto' if field == 'estado_interno' else '', dup[field]]
+        cursor.execute(f"UPDATE desenhos SET {set_clause}, version = version + 1 WHERE id = ?", params + [keep['id']])
+        _count_writes(cursor)
+        cursor.execute(
+            "UPDATE historico_comentarios SET desenho_id = ? WHERE desenho_id = ?", (keep['id'], dup['id'])
+        )
+        _count_writes(cursor)
+        log.append(('merged', dup['dwg_name'], dup['layout_name'], dup['id_cad'], new_layout, now))
+    
+    for holder in retires:
+        cursor.execute("DELETE FROM historico_comentarios WHERE desenho_id = ?", (holder['id'],))
+        _count_writes(cursor)
+        log.append(('retired', holder['dwg_name'], holder['layout_name'], holder['id_cad'], None, now))
+    
+    for row_id in removed:
+        cursor.execute("DELETE FROM revisoes WHERE desenho_id = ?", (row_id,))
+        _count_writes(cursor)
+        cursor.execute("DELETE FROM desenhos WHERE id = ?", (row_id,))
+        _count_writes(cursor)
+    
+    # Renames never collide on UNIQUE(layout_name, dwg_name): a row whose new
+    # name is held by another renamed row goes after it (shifted numbering:
+    # D -> E after E -> F), and only rows whose names form a cycle (swapped
+    # layouts) pass through a placeholder. Every other row is renamed in one
+    # step (one audit / change feed entry).
+    blockers = {}
+    for row_id, (keep, layout_name) in renames.items():
+        holder = by_layout.get((keep['dwg_name'], layout_name))
+        blockers[row_id] = holder['id'] if holder is not None and holder['id'] in renames else None
+    ordered, swapped, done = [], [], set()
+    for start in renames:
+        path, on_path = [], set()
+        row_id = start
+        while row_id is not None and row_id not in done and row_id not in on_path:
+            path.append(row_id)
+            on_path.add(row_id)
+            row_id = blockers[row_id]
+        cycle = path[path.index(row_id):] if row_id in on_path else []
+        swapped.extend(cycle)
+        ordered.extend(reversed(path[:len(path) - len(cycle)]))
+        done.update(path)
+    
+    cursor.executemany(
+        "UPDATE desenhos SET layout_name = ? WHERE id = ?",
+        [(f"\x00{row_id}", row_id) for row_id in swapped]
+    )
+    _count_writes(cursor)
+    cursor.executemany(f"""
+        UPDATE desenhos SET
+            layout_name = ?, updated_at = ?, change_seq = {NEXT_CHANGE_SEQ_SQL}, version = version + 1
+        WHERE id = ?
+    """, [(renames[row_id][1], now, row_id) for row_id in ordered + swapped])
+    _count_writes(cursor)
+    log.extend(
+        ('renamed', keep['dwg_name'], keep['layout_name'], keep['id_cad'], layout_name, now)
+        for keep, layout_name in renames.values()
+    )
+    
+    cursor.executemany("""
+        INSERT INTO id_cad_log (action, dwg_name, layout_name, id_cad, new_layout_name, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, log)
+    _count_writes(cursor)
+    
+    if commit:
+        conn.commit()
+    for entry in log:
+        counts[entry[0]] += 1
+    return counts
+
+
+@timed
+@retry_on_busy
+def bulk_upsert_desenhos(conn, records: List[Sequence[Any]], commit: bool = True) -> Dict[Tuple[str, str], int]:
+    """
+    Insert or update many desenhos in one executemany (one transaction).
+
+    Same semantics as upsert_desenho per row: rows are matched by id_cad
+    first (reconcile_id_cad), then upserted on (layout_name, dwg_name);
+    unchanged rows are not rewritten and updated_at/change_seq only move
+    for rows that were inserted or actually changed.
+
+    Args:
+        conn: Database connection
+        records: Tuples of (layout_name, *DESENHO_DATA_FIELDS values)
+        commit: Commit at the end (False leaves the transaction open for the caller)
+
+    Returns:
+        Dict (layout_name, dwg_name) -> desenho_id for every record
+    """
+    if not records:
+        return {}
+
+    dwg_index = 1 + DESENHO_DATA_FIELDS.index('dwg_name')
+    id_cad_index = 1 + DESENHO_DATA_FIELDS.index('id_cad')
+    reconcile_id_cad(
+        conn, [(record[0], record[dwg_index], record[id_cad_index]) for record in records], commit=False
+    )
+
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    update_clause = ', '.join(f"{field} = excluded.{field}" for field in DESENHO_DATA_FIELDS)
+    changed_clause = ' OR '.join(f"{field} IS NOT excluded.{field}" for field in DESENHO_DATA_FIELDS)
+
+    cursor.executemany(f"""
+        INSERT INTO desenhos (
+            layout_name, {', '.join(DESENHO_DATA_FIELDS)}, created_at, updated_at, change_seq
+        ) VALUES (?, {', '.join('?' * len(DESENHO_DATA_FIELDS))}, ?, ?, {NEXT_CHANGE_SEQ_SQL})
+        ON CONFLICT(layout_name, dwg_name) DO UPDATE SET
+            {update_clause},
+            updated_at = excluded.updated_at,
+            change_seq = excluded.change_seq,
+            version = version + 1
+        WHERE {changed_clause}
+    """, (tuple(record) + (now, now) for record in records))
+    _count_writes(cursor)
+
+    dwg_names = sorted({record[dwg_index] for record in records})
+    keys = {(record[0], record[dwg_index]) for record in records}
+
+    ids = {}
+    for start in range(0, len(dwg_names), 500):
+        chunk = dwg_names[start:start + 500]
+        cursor.execute(
+            f"SELECT layout_name, dwg_name, id FROM desenhos WHERE dwg_name IN ({','.join('?' * len(chunk))})",
+            chunk
+        )
+        for layout_name, dwg_name, desenho_id in cursor.fetchall():
+            if (layout_name, dwg_name) in keys:
+                ids[(layout_name, dwg_name)] = desenho_id
+
+    if commit:
+        conn.commit()
+    return ids
+
+
+@timed
+@retry_on_busy
+def bulk_sync_revisoes(
+    conn,
+    revisoes_by_desenho: Dict[int, List[Tuple[str, str, str]]],
+    commit: bool = True
+) -> int:
+    """
+    Sync the revisoes of many desenhos at once (bulk replace_revisoes).
 
+    Current revisoes are read in one pass and compared in memory; only
+    desenhos whose revision set differs are written, and those get their
+    updated_at/change_seq bumped like replace_revisoes does.
 
+    Args:
+        conn: Database connection
+        revisoes_by_desenho: Dict desenho_id -> list of (rev_code, rev_date, rev_desc);
+            an empty list removes every revision of that desenho
+        commit: Commit at the end (False leaves the transaction open for the caller)
+
+    Returns:
+        Number of revisoes rows written (inserted, updated or deleted)
+    """
+    if not revisoes_by_desenho:
+        return 0
+
+    cursor = conn.cursor()
+
+    desenho_ids = list(revisoes_by_desenho)
+    existing: Dict[int, Dict[str, Tuple[str, str]]] = {}
+    for start in range(0, len(desenho_ids), 500):
+        chunk = desenho_ids[start:start + 500]
+        cursor.execute(
+            f"""SELECT desenho_id, rev_code, rev_date, rev_desc FROM revisoes
+                WHERE desenho_id IN ({','.join('?' * len(chunk))})""",
+            chunk
+        )
+        for desenho_id, rev_code, rev_date, rev_desc in cursor.fetchall():
+            existing.setdefault(desenho_id, {})[rev_code] = (rev_date, rev_desc)
+
+    upserts = []
+    deletes = []
+    changed_ids = []
+    for desenho_id, revisoes in revisoes_by_desenho.items():
+        # Last occurrence of a code wins, as with the ON CONFLICT upsert
+        wanted = {rev_code: (rev_date, rev_desc) for rev_code, rev_date, rev_desc in revisoes if rev_code}
+        current = existing.get(desenho_id, {})
+        if wanted == current:
+            continue
+        changed_ids.append(desenho_id)
+        upserts.extend(
+            (desenho_id, rev_code, rev_date, rev_desc)
+            for rev_code, (rev_date, rev_desc) in wanted.items()
+            if current.get(rev_code) != (rev_date, rev_desc)
+        )
+        deletes.extend((desenho_id, rev_code) for rev_code in current if rev_code not in wanted)
+
+    cursor.executemany("""
+        INSERT INTO revisoes (desenho_id, rev_code, rev_date, rev_desc)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(desenho_id, rev_code) DO UPDATE SET
+            rev_date = excluded.rev_date,
+            rev_desc = excluded.rev_desc
+    """, upserts)
+    # Rows of these statements only (conn.total_changes also counts trigger writes)
+    _count_writes(cursor)
+    changes = cursor.rowcount
+    cursor.executemany("DELETE FROM revisoes WHERE desenho_id = ? AND rev_code = ?", deletes)
+    _count_writes(cursor)
+    changes += cursor.rowcount
+
+    if changed_ids:
+        # Revisions are exported with the desenho - mark them as changed
+        now = datetime.now().isoformat()
+        cursor.executemany(f"""
+            UPDATE desenhos SET updated_at = ?, change_seq = {NEXT_CHANGE_SEQ_SQL}, version = version + 1 WHERE id = ?
+        """, ((now, desenho_id) for desenho_id in changed_ids))
+        _count_writes(cursor)
+
+    if commit:
+        conn.commit()
+    return changes
+
+
+@timed
 def get_all_desenhos(conn) -> List[Dict[str, Any]]:
     """
     Get all desenhos from database.
@@ -292,7 +1074,7 @@ def get_all_desenhos(conn) -> List[Dict[str, Any]]:
         List of desenho dictionaries
     """
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM desenhos ORDER BY tipo_key, elemento_key, des_num")
+    cursor.execute(f"SELECT * FROM desenhos ORDER BY {', '.join(DESENHOS_BASE_ORDER)}")
     rows = cursor.fetchall()
     
     result = []
@@ -302,6 +1084,58 @@ def get_all_desenhos(conn) -> List[Dict[str, Any]]:
     return result
 
 
+@timed
+def get_desenhos_table_columns(conn) -> List[str]:
+    """Get the column names of the desenhos table (in table order)."""
+    cursor = conn.cursor()
+    cursor.execute("PRAGMA table_info(desenhos)")
+    return [row[1] for row in cursor.fetchall()]
+
+
+@timed
+def get_desenhos_columns(conn, columns: List[str], batch_size: int = 5000) -> Dict[str, List[Any]]:
+    """
+    Get selected columns of all desenhos as column lists.
+
+    Rows are fetched in batches of plain tuples and transposed into one list
+    per column, so no per-row dict is built and unselected columns (e.g.
+    raw_attributes) are never read.
+
+    Args:
+        conn: Database connection
+        columns: Column names to fetch (unknown names raise ValueError)
+        batch_size: Rows per fetchmany() call
+
+    Returns:
+        Dict column -> list of values, ordered like get_all_desenhos
+    """
+    table_columns = set(get_desenhos_table_columns(conn))
+    unknown = [c for c in columns if c not in table_columns]
+    if unknown:
+        raise ValueError(f"Colunas desconhecidas: {', '.join(unknown)}")
+
+    result = {col: [] for col in columns}
+    if not columns:
+        return result
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(
+        f"SELECT {', '.join(columns)} FROM desenhos ORDER BY {', '.join(DESENHOS_BASE_ORDER)}"
+    )
+
+    targets = [result[col] for col in columns]
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            break
+        for target, values in zip(targets, zip(*batch)):
+            target.extend(values)
+
+    return result
+
+
+@timed
 def get_desenhos_by_tipo_elemento(conn, tipo_key: str, elemento_key: str) -> List[Dict[str, Any]]:
     """
     Get desenhos filtered by tipo_key and elemento_key.
@@ -325,6 +1159,7 @@ def get_desenhos_by_tipo_elemento(conn, tipo_key: str, elemento_key: str) -> Lis
     return [dict(row) for row in rows]
 
 
+@timed
 def get_revisoes_by_desenho_id(conn, desenho_id: int) -> List[Dict[str, Any]]:
     """
     Get all revisions for a specific desenho.
@@ -348,6 +1183,7 @@ def get_revisoes_by_desenho_id(conn, desenho_id: int) -> List[Dict[str, Any]]:
     return [dict(row) for row in rows]
 
 
+@timed
 def get_desenho_by_layout(conn, layout_name: str) -> Dict[str, Any]:
     """
     Get a single desenho by layout_name.
@@ -365,6 +1201,7 @@ def get_desenho_by_layout(conn, layout_name: str) -> Dict[str, Any]:
     return dict(row) if row else None
 
 
+@timed
 def get_dwg_list(conn) -> List[Dict[str, Any]]:
     """
     Get list of all DWG files in database with counts.
@@ -383,6 +1220,8 @@ def get_dwg_list(conn) -> List[Dict[str, Any]]:
     return [dict(row) for row in rows]
 
 
+@timed(rows=True)
+@retry_on_busy
 def delete_all_desenhos(conn) -> int:
     """
     Delete ALL desenhos and revisoes from database.
@@ -406,6 +1245,8 @@ def delete_all_desenhos(conn) -> int:
     return count
 
 
+@timed(rows=True)
+@retry_on_busy
 def delete_desenhos_by_dwg(conn, dwg_name: str) -> int:
     """
     Delete all desenhos from a specific DWG file.
@@ -436,6 +1277,8 @@ def delete_desenhos_by_dwg(conn, dwg_name: str) -> int:
     return count
 
 
+@timed
+@cached
 def get_db_stats(conn) -> Dict[str, Any]:
     """
     Get database statistics.
@@ -460,6 +1303,8 @@ def get_db_stats(conn) -> Dict[str, Any]:
     }
 
 
+@timed(rows=True)
+@retry_on_busy
 def delete_desenhos_by_tipo(conn, tipo: str) -> int:
     """
     Delete all desenhos with a specific tipo_display.
@@ -490,6 +1335,8 @@ def delete_desenhos_by_tipo(conn, tipo: str) -> int:
     return count
 
 
+@timed(rows=True)
+@retry_on_busy
 def delete_desenhos_by_elemento(conn, elemento: str) -> int:
     """
     Delete all desenhos with a specific elemento_key.
@@ -520,6 +1367,8 @@ def delete_desenhos_by_elemento(conn, elemento: str) -> int:
     return count
 
 
+@timed(rows=True)
+@retry_on_busy
 def delete_desenho_by_layout(conn, layout_name: str) -> int:
     """
     Delete a single desenho by layout_name.
@@ -549,6 +1398,7 @@ def delete_desenho_by_layout(conn, layout_name: str) -> int:
     return 0
 
 
+@timed
 def get_unique_tipos(conn) -> List[str]:
     """Get list of unique tipo_display values."""
     cursor = conn.cursor()
@@ -556,6 +1406,7 @@ def get_unique_tipos(conn) -> List[str]:
     return [row[0] for row in cursor.fetchall()]
 
 
+@timed
 def get_unique_elementos(conn) -> List[str]:
     """Get list of unique elemento_key values."""
     cursor = conn.cursor()
@@ -563,6 +1414,7 @@ def get_unique_elementos(conn) -> List[str]:
     return [row[0] for row in cursor.fetchall()]
 
 
+@timed
 def get_all_layout_names(conn) -> List[str]:
     """Get list of all layout_names."""
     cursor = conn.cursor()
@@ -570,6 +1422,7 @@ def get_all_layout_names(conn) -> List[str]:
     return [row[0] for row in cursor.fetchall()]
 
 
+@timed
 def get_desenho_with_revisoes(conn, desenho_id: int) -> Dict[str, Any]:
     """
     Get a desenho with all revisões A-E expanded.
@@ -593,6 +1446,11 @@ def get_desenho_with_revisoes(conn, desenho_id: int) -> Dict[str, Any]:
     # Get revisoes
     revisoes = get_revisoes_by_desenho_id(conn, desenho_id)
     
+    return _expand_revisoes(desenho, revisoes)
+
+
+def _expand_revisoes(desenho: Dict[str, Any], revisoes: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Add rev_a..desc_e fields (from revisoes) to a desenho dict (id_cad NULL -> '')."""
     # Initialize all revision fields
     for letter in ['a', 'b', 'c', 'd', 'e']:
         desenho[f'rev_{letter}'] = ''
@@ -601,125 +1459,270 @@ def get_desenho_with_revisoes(conn, desenho_id: int) -> Dict[str, Any]:
     
     # Map revisoes to fields
     for rev in revisoes:
-        code = rev.get('rev_code', '').upper()
+        code = (rev.get('rev_code') or '').upper()
         if code in ['A', 'B', 'C', 'D', 'E']:
             letter = code.lower()
             desenho[f'rev_{letter}'] = code
             desenho[f'data_{letter}'] = rev.get('rev_date', '')
             desenho[f'desc_{letter}'] = rev.get('rev_desc', '')
     
-    # Extract id_cad from raw_attributes if available
-    raw = desenho.get('raw_attributes', '')
-    if raw:
-        try:
-            # raw_attributes is stored as str(dict), try to parse it
-            import ast
-            parsed = ast.literal_eval(raw)
-            desenho['id_cad'] = parsed.get('id_cad', '')
-        except:
-            desenho['id_cad'] = ''
-    else:
-        desenho['id_cad'] = ''
+    desenho['id_cad'] = desenho.get('id_cad') or ''
     
     return desenho
 
 
-def get_all_desenhos_with_revisoes(conn, dwg_name: str = None) -> List[Dict[str, Any]]:
+@timed
+@cached
+def get_all_desenhos_with_revisoes(conn, dwg_name: str = None, changed_only: bool = False) -> List[Dict[str, Any]]:
     """
     Get all desenhos with revisões A-E expanded.
     
     Args:
         conn: Database connection
         dwg_name: Optional DWG name filter
+        changed_only: Only desenhos changed since the last export of their DWG
+            (change_seq above the DWG's export watermark)
         
     Returns:
         List of desenhos with all revision fields
     """
     cursor = conn.cursor()
     
+    # Two queries in total (desenhos, then their revisoes) instead of one per desenho
+    query = "FROM desenhos d"
+    conditions = []
+    params = []
+    if changed_only:
+        query += " LEFT JOIN export_watermarks w ON w.dwg_name = d.dwg_name"
+        conditions.append("d.change_seq > COALESCE(w.change_seq, -1)")
     if dwg_name:
-        cursor.execute("SELECT id FROM desenhos WHERE dwg_name = ?", (dwg_name,))
-    else:
-        cursor.execute("SELECT id FROM desenhos")
-    
-    rows = cursor.fetchall()
-    
-    result = []
-    for row in rows:
-        desenho = get_desenho_with_revisoes(conn, row['id'])
-        if desenho:
-            result.append(desenho)
+        conditions.append("d.dwg_name = ?")
+        params.append(dwg_name)
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    
+    cursor.execute(f"SELECT d.* {query} ORDER BY d.id", params)
+    desenhos = [dict(row) for row in cursor.fetchall()]
+    if not desenhos:
+        return []
+    
+    revisoes_by_id = {}
+    cursor.execute(f"""
+        SELECT desenho_id, rev_code, rev_date, rev_desc
+        FROM revisoes
+        WHERE desenho_id IN (SELECT d.id {query})
+        ORDER BY desenho_id, rev_code
+    """, params)
+    for row in cursor.fetchall():
+        revisoes_by_id.setdefault(row['desenho_id'], []).append(dict(row))
     
-    return result
-
-
-# ============================================
-# FUNÇÕES PARA ESTADO INTERNO E COMENTÁRIOS
-# ============================================
-
-ESTADOS_VALIDOS = ['projeto', 'needs_revision', 'built']
+    return [_expand_revisoes(d, revisoes_by_id.get(d['id'], [])) for d in desenhos]
 
 
-def update_estado_interno(conn, desenho_id: int, novo_estado: str, autor: str = None) -> bool:
+@timed
+def get_dwg_change_seqs(conn, dwg_name: str = None) -> Dict[str, int]:
     """
-    Update the internal state of a desenho and log to history.
+    Get the current (maximum) change_seq of each DWG.
     
     Args:
         conn: Database connection
-        desenho_id: ID of the desenho
-        novo_estado: New state (projeto, needs_revision, built)
-        autor: Optional author of the change
+        dwg_name: Optional DWG name filter
         
     Returns:
-        True if updated successfully
+        Dict dwg_name -> change_seq
     """
-    if novo_estado not in ESTADOS_VALIDOS:
-        return False
-    
     cursor = conn.cursor()
-    
-    # Get current state
-    cursor.execute("SELECT estado_interno, comentario, data_limite, responsavel FROM desenhos WHERE id = ?", (desenho_id,))
+    if dwg_name:
+        cursor.execute(
+            "SELECT dwg_name, MAX(change_seq) FROM desenhos WHERE dwg_name = ? GROUP BY dwg_name",
+            (dwg_name,)
+        )
+    else:
+        cursor.execute("SELECT dwg_name, MAX(change_seq) FROM desenhos GROUP BY dwg_name")
+    return {row[0]: row[1] or 0 for row in cursor.fetchall()}
+
+
+@timed
+def get_export_watermarks(conn) -> List[Dict[str, Any]]:
+    """
+    Get the export watermark of every exported DWG.
+    
+    Returns:
+        List of dicts: dwg_name, change_seq, exported_at, desenhos_exported
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM export_watermarks ORDER BY dwg_name")
+    return [dict(row) for row in cursor.fetchall()]
+
+
+@timed
+@retry_on_busy
+def set_export_watermarks(conn, change_seqs: Dict[str, int], desenhos_exported: Dict[str, int] = None):
+    """
+    Record that each DWG was exported up to the given change_seq.
+    
+    Args:
+        conn: Database connection
+        change_seqs: Dict dwg_name -> change_seq (from get_dwg_change_seqs,
+            read before the exported rows)
+        desenhos_exported: Optional dict dwg_name -> desenhos written
+    """
+    desenhos_exported = desenhos_exported or {}
+    now = datetime.now().isoformat()
+    conn.executemany("""
+        INSERT INTO export_watermarks (dwg_name, change_seq, exported_at, desenhos_exported)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(dwg_name) DO UPDATE SET
+            change_seq = excluded.change_seq,
+            exported_at = excluded.exported_at,
+            desenhos_exported = excluded.desenhos_exported
+    """, [
+        (dwg, seq, now, desenhos_exported.get(dwg, 0))
+        for dwg, seq in change_seqs.items()
+    ])
+    conn.commit()
+
+
+# ============================================
+# FUNÇÕES PARA ESTADO INTERNO E COMENTÁRIOS
+# ============================================
+
+ESTADOS_VALIDOS = ['projeto', 'needs_revision', 'built']
+
+
+def _read_for_update(conn, desenho_id: int, expected_version: int = None) -> Optional[sqlite3.Row]:
+    """
+    Read the internal fields and version of a desenho about to be edited.
+    
+    Raises:
+        VersionConflict: expected_version given and the row has moved past it (or was deleted)
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT estado_interno, comentario, data_limite, responsavel, version
+        FROM desenhos WHERE id = ?
+    """, (desenho_id,))
     row = cursor.fetchone()
+    if expected_version is not None and (row is None or row['version'] != expected_version):
+        raise VersionConflict(desenho_id, expected_version, get_desenho_by_id(conn, desenho_id))
+    return row
+
+
+def _compare_and_swap(
+    conn, desenho_id: int, version: int, assignments: Dict[str, Any], mark_changed: bool = False
+):
+    """
+    UPDATE a desenho only if it is still at `version` (and bump the version).
+    Nothing is written on a conflict.
+    
+    Args:
+        conn: Database connection
+        desenho_id: ID of the desenho
+        version: Version the new values were computed from
+        assignments: Column -> new value
+        mark_changed: Also bump change_seq (fields exported to AutoCAD changed)
+        
+    Raises:
+        VersionConflict: the row changed or was deleted since `version`
+    """
+    set_clause = ', '.join(f"{column} = ?" for column in assignments)
+    if mark_changed:
+        set_clause += f", change_seq = {NEXT_CHANGE_SEQ_SQL}"
+    cursor = conn.cursor()
+    cursor.execute(
+        f"UPDATE desenhos SET {set_clause}, version = version + 1 WHERE id = ? AND version = ?",
+        list(assignments.values()) + [desenho_id, version]
+    )
+    if cursor.rowcount == 0:
+        raise VersionConflict(desenho_id, version, get_desenho_by_id(conn, desenho_id))
+
+
+def _optimistic(func):
+    """
+    For update functions taking expected_version: on a VersionConflict the
+    transaction is rolled back (releasing the write lock); if the caller gave
+    no expected_version, the read-modify-write is simply run again instead.
+    """
+    @functools.wraps(func)
+    def wrapper(conn, *args, expected_version: int = None, **kwargs):
+        owns_transaction = not conn.in_transaction
+        for attempt in range(WRITE_RETRY_ATTEMPTS):
+            try:
+                return func(conn, *args, expected_version=expected_version, **kwargs)
+            except VersionConflict:
+                if owns_transaction:
+                    conn.rollback()
+                if expected_version is not None or attempt == WRITE_RETRY_ATTEMPTS - 1:
+                    raise
+    return wrapper
+
+
+def _log_historico(conn, desenho_id: int, comentario, estado_anterior, estado_novo, data_limite, responsavel, autor):
+    conn.execute("""
+        INSERT INTO historico_comentarios 
+        (desenho_id, comentario, estado_anterior, estado_novo, data_limite, responsavel, autor)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (desenho_id, comentario, estado_anterior, estado_novo, data_limite, responsavel, autor))
+
+
+@timed
+@retry_on_busy
+@_optimistic
+def update_estado_interno(
+    conn, desenho_id: int, novo_estado: str, autor: str = None, expected_version: int = None
+) -> bool:
+    """
+    Update the internal state of a desenho and log to history.
     
+    Args:
+        conn: Database connection
+        desenho_id: ID of the desenho
+        novo_estado: New state (projeto, needs_revision, built)
+        autor: Optional author of the change
+        expected_version: Version the edit was based on (None = the version read now)
+        
+    Returns:
+        True if updated successfully
+        
+    Raises:
+        VersionConflict: the desenho changed since expected_version (nothing is written)
+    """
+    if novo_estado not in ESTADOS_VALIDOS:
+        return False
+    
+    # Get current state
+    row = _read_for_update(conn, desenho_id, expected_version)
     if not row:
         return False
     
     estado_anterior = row[0] or 'projeto'
     
+    # Update state
+    _compare_and_swap(conn, desenho_id, row['version'], {
+        'estado_interno': novo_estado,
+        'updated_at': datetime.now().isoformat(),
+    })
+    
     # Only log if state changed
     if estado_anterior != novo_estado:
-        # Log to history
-        cursor.execute("""
-            INSERT INTO historico_comentarios 
-            (desenho_id, comentario, estado_anterior, estado_novo, data_limite, responsavel, autor)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            desenho_id,
-            row[1],  # current comment
-            estado_anterior,
-            novo_estado,
-            row[2],  # data_limite
-            row[3],  # responsavel
-            autor
-        ))
-    
-    # Update state
-    cursor.execute("""
-        UPDATE desenhos SET estado_interno = ?, updated_at = ? WHERE id = ?
-    """, (novo_estado, datetime.now().isoformat(), desenho_id))
+        # row[1..3]: current comment, data_limite, responsavel
+        _log_historico(conn, desenho_id, row[1], estado_anterior, novo_estado, row[2], row[3], autor)
     
     conn.commit()
     return True
 
 
+@timed
+@retry_on_busy
+@_optimistic
 def update_comentario_interno(
     conn, 
     desenho_id: int, 
     comentario: str, 
     data_limite: str = None, 
     responsavel: str = None,
-    autor: str = None
+    autor: str = None,
+    expected_version: int = None
 ) -> bool:
     """
     Update internal comment, deadline and responsible for a desenho.
@@ -732,53 +1735,39 @@ def update_comentario_interno(
         data_limite: Optional deadline date (YYYY-MM-DD)
         responsavel: Optional responsible person
         autor: Optional author of the change
+        expected_version: Version the edit was based on (None = the version read now)
         
     Returns:
         True if updated successfully
+        
+    Raises:
+        VersionConflict: the desenho changed since expected_version (nothing is written)
     """
-    cursor = conn.cursor()
-    
     # Get current values
-    cursor.execute("""
-        SELECT estado_interno, comentario, data_limite, responsavel 
-        FROM desenhos WHERE id = ?
-    """, (desenho_id,))
-    row = cursor.fetchone()
-    
+    row = _read_for_update(conn, desenho_id, expected_version)
     if not row:
         return False
     
-    # Log to history if comment changed
+    # Update fields
+    _compare_and_swap(conn, desenho_id, row['version'], {
+        'comentario': comentario,
+        'data_limite': data_limite,
+        'responsavel': responsavel,
+        'updated_at': datetime.now().isoformat(),
+    })
+    
+    # Log to history if comment changed (estado_interno stays the same; old data_limite/responsavel)
     old_comentario = row[1] or ''
     if old_comentario != comentario:
-        cursor.execute("""
-            INSERT INTO historico_comentarios 
-            (desenho_id, comentario, estado_anterior, estado_novo, data_limite, responsavel, autor)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            desenho_id,
-            old_comentario,
-            row[0],  # estado_interno stays same
-            row[0],
-            row[2],  # old data_limite
-            row[3],  # old responsavel
-            autor
-        ))
-    
-    # Update fields
-    cursor.execute("""
-        UPDATE desenhos SET 
-            comentario = ?, 
-            data_limite = ?, 
-            responsavel = ?,
-            updated_at = ? 
-        WHERE id = ?
-    """, (comentario, data_limite, responsavel, datetime.now().isoformat(), desenho_id))
+        _log_historico(conn, desenho_id, old_comentario, row[0], row[0], row[2], row[3], autor)
     
     conn.commit()
     return True
 
 
+@timed
+@retry_on_busy
+@_optimistic
 def update_estado_e_comentario(
     conn,
     desenho_id: int,
@@ -786,7 +1775,8 @@ def update_estado_e_comentario(
     comentario: str = None,
     data_limite: str = None,
     responsavel: str = None,
-    autor: str = None
+    autor: str = None,
+    expected_version: int = None
 ) -> bool:
     """
     Update state and/or comment in one operation.
@@ -799,22 +1789,19 @@ def update_estado_e_comentario(
         data_limite: Deadline date (optional)
         responsavel: Responsible person (optional)
         autor: Author of change (optional)
+        expected_version: Version the edit was based on (None = the version read now)
         
     Returns:
         True if updated successfully
+        
+    Raises:
+        VersionConflict: the desenho changed since expected_version (nothing is written)
     """
     if estado and estado not in ESTADOS_VALIDOS:
         return False
     
-    cursor = conn.cursor()
-    
     # Get current values
-    cursor.execute("""
-        SELECT estado_interno, comentario, data_limite, responsavel 
-        FROM desenhos WHERE id = ?
-    """, (desenho_id,))
-    row = cursor.fetchone()
-    
+    row = _read_for_update(conn, desenho_id, expected_version)
     if not row:
         return False
     
@@ -827,38 +1814,78 @@ def update_estado_e_comentario(
     responsavel_anterior = row[3]
     novo_responsavel = responsavel if responsavel is not None else responsavel_anterior
     
+    # Update all fields
+    _compare_and_swap(conn, desenho_id, row['version'], {
+        'estado_interno': novo_estado,
+        'comentario': novo_comentario,
+        'data_limite': nova_data_limite,
+        'responsavel': novo_responsavel,
+        'updated_at': datetime.now().isoformat(),
+    })
+    
     # Log to history if anything important changed
     if estado_anterior != novo_estado or comentario_anterior != novo_comentario:
-        cursor.execute("""
-            INSERT INTO historico_comentarios 
-            (desenho_id, comentario, estado_anterior, estado_novo, data_limite, responsavel, autor)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            desenho_id,
-            comentario_anterior,
-            estado_anterior,
-            novo_estado,
-            data_limite_anterior,
-            responsavel_anterior,
-            autor
-        ))
-    
-    # Update all fields
-    cursor.execute("""
-        UPDATE desenhos SET 
-            estado_interno = ?,
-            comentario = ?, 
-            data_limite = ?, 
-            responsavel = ?,
-            updated_at = ? 
-        WHERE id = ?
-    """, (novo_estado, novo_comentario, nova_data_limite, novo_responsavel, 
-          datetime.now().isoformat(), desenho_id))
+        _log_historico(
+            conn, desenho_id, comentario_anterior, estado_anterior, novo_estado,
+            data_limite_anterior, responsavel_anterior, autor
+        )
     
     conn.commit()
     return True
 
 
+@timed
+@retry_on_busy
+def save_desenho_edits(conn, edits: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Apply edits from the table editor with compare-and-swap, in one transaction.
+    
+    Each edit is written only if its desenho is still at the version the
+    editor showed; the others are reported as conflicts and left untouched.
+    
+    Args:
+        conn: Database connection
+        edits: List of dicts with id, version (as loaded in the editor),
+            fields (column -> new value) and mark_changed (True if fields
+            exported to AutoCAD changed: bumps change_seq)
+        
+    Returns:
+        Dict with updated (number of desenhos written), versions (id -> new
+        version of each written desenho) and conflicts (list of VersionConflict)
+    
+    Raises:
+        ValueError: If an edit touches a non-editable field (nothing is written)
+        sqlite3.Error: Any database error; the whole batch is rolled back
+    """
+    editable = {'layout_name', *DESENHO_DATA_FIELDS, *DESENHO_INTERNAL_FIELDS}
+    now = datetime.now().isoformat()
+    versions = {}
+    conflicts = []
+    
+    # Valida tudo antes da primeira escrita
+    unknown = set().union(*(edit['fields'] for edit in edits)) - editable
+    if unknown:
+        raise ValueError(f"Campos não editáveis: {', '.join(sorted(unknown))}")
+    
+    try:
+        for edit in edits:
+            try:
+                _compare_and_swap(
+                    conn, edit['id'], edit['version'], {**edit['fields'], 'updated_at': now}, edit.get('mark_changed', False)
+                )
+                versions[edit['id']] = edit['version'] + 1
+            except VersionConflict as conflict:
+                conflicts.append(conflict)
+    except Exception:
+        # Nada fica gravado e o lock de escrita é libertado
+        conn.rollback()
+        raise
+    
+    conn.commit()
+    return {'updated': len(versions), 'versions': versions, 'conflicts': conflicts}
+
+
+@timed
 def get_historico_comentarios(conn, desenho_id: int) -> List[Dict[str, Any]]:
     """
     Get comment history for a desenho.
@@ -883,6 +1910,317 @@ def get_historico_comentarios(conn, desenho_id: int) -> List[Dict[str, Any]]:
     return [dict(row) for row in rows]
 
 
+# Período coberto por um instante dado só até à hora / minuto / segundo
+_AUDIT_TIME_SPANS = {2: timedelta(hours=1), 5: timedelta(minutes=1), 8: timedelta(seconds=1)}
+
+
+def _audit_upper_bound(as_of: str) -> str:
+    """
+    Last instant covered by 'YYYY-MM-DD[ HH:MM[:SS[.fff]]]' (ISO 8601), comparable with desenhos_audit.changed_at.
+    
+    Raises:
+        ValueError: as_of is not an ISO date/time (e.g. DD-MM-YYYY)
+    """
+    text = as_of.strip().replace('T', ' ')
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        raise ValueError(f"Data/hora inválida: {as_of!r} (usar AAAA-MM-DD [HH:MM[:SS]], UTC)") from None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    # Uma data cobre o dia inteiro, 'HH:MM' o minuto inteiro, etc.
+    time_part = text.partition(' ')[2]
+    span = _AUDIT_TIME_SPANS.get(len(time_part), timedelta(0)) if time_part else timedelta(days=1)
+    if span:
+        moment += span - timedelta(milliseconds=1)
+    return moment.strftime('%Y-%m-%d %H:%M:%S.%f')[:23]
+
+
+@timed
+def get_desenho_as_of(conn, desenho_id: int, as_of: str) -> Optional[Dict[str, Any]]:
+    """
+    Rebuild a desenho as it was at a given time from desenhos_audit.
+    
+    Each column's value is the old value of its first change after as_of
+    (one index seek per column), or the current value if it has not changed
+    since. Desenhos that existed before the audit log was added count as
+    existing since then.
+    
+    Args:
+        conn: Database connection
+        desenho_id: ID of the desenho (also of deleted ones)
+        as_of: UTC time 'YYYY-MM-DD[ HH:MM[:SS]]' (a date or minute covers
+            all of it, e.g. '2024-05-01' = end of that day)
+        
+    Returns:
+        Dict with id and AUDIT_COLUMNS, or None if the desenho did not exist then
+        
+    Raises:
+        ValueError: as_of is not an ISO date/time (e.g. DD-MM-YYYY), or is
+            before the audit rows removed by prune_desenhos_audit
+    """
+    upper_bound = _audit_upper_bound(as_of)
+    pruned = conn.execute("SELECT pruned_before FROM desenhos_audit_pruned WHERE id = 1").fetchone()
+    if pruned is not None and upper_bound < pruned[0]:
+        raise ValueError(f"Auditoria anterior a {pruned[0]} (UTC) foi apagada")
+    
+    columns_sql = " UNION ALL ".join(["SELECT NULL AS column_name"] + [f"SELECT '{c}'" for c in AUDIT_COLUMNS])
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT c.column_name, a.operation, a.old_value
+        FROM ({columns_sql}) c
+        JOIN desenhos_audit a ON a.id = (
+            SELECT id FROM desenhos_audit
+            WHERE desenho_id = ? AND column_name IS c.column_name AND changed_at > ?
+            ORDER BY changed_at, id
+            LIMIT 1
+        )
+    """, (desenho_id, upper_bound))
+    first_changes = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+    
+    # Primeiro insert/delete depois de as_of: insert = ainda não existia
+    existence = first_changes.pop(None, None)
+    if existence and existence[0] == 'insert':
+        return None
+    cursor.execute(f"SELECT {', '.join(AUDIT_COLUMNS)} FROM desenhos WHERE id = ?", (desenho_id,))
+    current = cursor.fetchone()
+    if current is None and existence is None:
+        return None
+    
+    desenho = {'id': desenho_id}
+    for i, column in enumerate(AUDIT_COLUMNS):
+        if column in first_changes:
+            desenho[column] = first_changes[column][1]
+        else:
+            desenho[column] = current[i] if current is not None else None
+    return desenho
+
+
+@timed
+def get_desenho_audit(conn, desenho_id: int) -> List[Dict[str, Any]]:
+    """
+    Get every recorded change of a desenho (all AUDIT_COLUMNS, not only the internal ones).
+    
+    Args:
+        conn: Database connection
+        desenho_id: ID of the desenho (also of deleted ones)
+        
+    Returns:
+        List of entries, newest first: changed_at (UTC), operation
+        ('insert', 'update', 'delete'), column_name (None for insert/delete),
+        old_value, new_value
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT changed_at, operation, column_name, old_value
+        FROM desenhos_audit
+        WHERE desenho_id = ?
+        ORDER BY changed_at, id
+    """, (desenho_id,))
+    changes = [dict(zip(('changed_at', 'operation', 'column_name', 'old_value'), row)) for row in cursor.fetchall()]
+    
+    cursor.execute(f"SELECT {', '.join(AUDIT_COLUMNS)} FROM desenhos WHERE id = ?", (desenho_id,))
+    current = cursor.fetchone()
+    new_values = dict(zip(AUDIT_COLUMNS, current)) if current is not None else {}
+    
+    # Do mais recente para o mais antigo: o valor novo é o anterior da alteração seguinte
+    entries = []
+    for change in reversed(changes):
+        column = change['column_name']
+        if column is None:
+            entries.append({**change, 'old_value': None, 'new_value': None})
+            continue
+        if change['operation'] == 'update':
+            entries.append({**change, 'new_value': new_values.get(column)})
+        new_values[column] = change['old_value']
+    return entries
+
+
+# Dias de auditoria mantidos por omissão (cli prune-audit)
+AUDIT_RETENTION_DAYS = 365
+
+
+@timed(rows=True)
+@retry_on_busy
+def prune_desenhos_audit(conn, older_than_days: int = AUDIT_RETENTION_DAYS) -> int:
+    """
+    Delete desenhos_audit rows older than a number of days.
+    
+    The cutoff is recorded: get_desenho_as_of refuses times before it
+    instead of rebuilding them from an incomplete log.
+    
+    Args:
+        conn: Database connection
+        older_than_days: Keep the changes of the last older_than_days days
+        
+    Returns:
+        Number of audit rows deleted
+    """
+    if older_than_days < 0:
+        raise ValueError(f"Número de dias inválido: {older_than_days}")
+    cursor = conn.cursor()
+    cursor.execute("SELECT strftime('%Y-%m-%d %H:%M:%f', 'now', ?)", (f"-{older_than_days} days",))
+    cutoff = cursor.fetchone()[0]
+    cursor.execute("DELETE FROM desenhos_audit WHERE changed_at < ?", (cutoff,))
+    deleted = cursor.rowcount
+    cursor.execute("""
+        INSERT INTO desenhos_audit_pruned (id, pruned_before) VALUES (1, ?)
+        ON CONFLICT(id) DO UPDATE SET pruned_before = MAX(pruned_before, excluded.pruned_before)
+    """, (cutoff,))
+    conn.commit()
+    return deleted
+
+
+def _parse_change_token(token: str) -> Tuple[str, int]:
+    database_token, _, seq = token.rpartition(':')
+    if not database_token or not seq.isdigit():
+        raise ValueError(f"Token de alterações inválido: {token!r}")
+    return database_token, int(seq)
+
+
+def _change_feed_bounds(conn) -> Tuple[int, int]:
+    """
+    (first, last) seq still readable from change_feed; first = last + 1 when it is empty.
+    
+    last comes from sqlite_sequence, so it survives prune_change_feed
+    emptying the table.
+    """
+    row = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'change_feed'").fetchone()
+    last_seq = row[0] if row else 0
+    first_seq = conn.execute("SELECT MIN(seq) FROM change_feed").fetchone()[0]
+    return (first_seq if first_seq is not None else last_seq + 1), last_seq
+
+
+@timed
+def get_change_token(conn) -> str:
+    """
+    Token of the latest change in change_feed, to pass later to get_changes_since.
+    
+    Read it in the same transaction as a full read of the data (e.g. an
+    open_read_snapshot connection) to start syncing from that state.
+    
+    Returns:
+        'database_token:seq' (database_token: see get_data_version)
+    """
+    return f"{get_data_version(conn)[0]}:{_change_feed_bounds(conn)[1]}"
+
+
+@timed
+def get_changes_since(conn, token: str, limit: int = None, with_rows: bool = False) -> Dict[str, Any]:
+    """
+    Changes to desenhos, revisoes and historico_comentarios after a token.
+    
+    Reads only the change_feed rows after the token (primary key range),
+    so a consumer that keeps the returned token syncs in O(changes).
+    
+    Args:
+        conn: Database connection
+        token: Token from get_change_token or a previous call
+        limit: Maximum number of changes (more=True when some are left)
+        with_rows: Add each changed row as it is now ('row', None if deleted since)
+        
+    Returns:
+        Dict with changes (oldest first: seq, table_name, operation,
+        row_id, desenho_id, changed_at), token (pass it to the next call)
+        and more
+        
+    Raises:
+        ChangeFeedReset: token from another database (or a restored copy
+            older than the token), or older than the changes removed by
+            prune_change_feed
+        ValueError: malformed token
+    """
+    database_token, since_seq = _parse_change_token(token)
+    cursor = conn.cursor()
+    first_seq, last_seq = _change_feed_bounds(conn)
+    if database_token != get_data_version(conn)[0] or since_seq > last_seq:
+        raise ChangeFeedReset(f"Token {token} não corresponde a esta base de dados")
+    if since_seq < first_seq - 1:
+        raise ChangeFeedReset(f"As alterações a seguir ao token {token} já foram apagadas")
+    
+    sql = """
+        SELECT seq, table_name, operation, row_id, desenho_id, changed_at
+        FROM change_feed WHERE seq > ? ORDER BY seq
+    """
+    params: List[Any] = [since_seq]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit + 1)
+    cursor.execute(sql, params)
+    changes = [
+        dict(zip(('seq', 'table_name', 'operation', 'row_id', 'desenho_id', 'changed_at'), row))
+        for row in cursor.fetchall()
+    ]
+    more = bool(limit) and len(changes) > limit
+    if more:
+        changes = changes[:limit]
+    
+    if with_rows:
+        rows: Dict[Tuple[str, int], Dict[str, Any]] = {}
+        for table in CHANGE_FEED_TABLES:
+            ids = list({change['row_id'] for change in changes if change['table_name'] == table})
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                cursor.execute(f"SELECT * FROM {table} WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+                rows.update(((table, row['id']), dict(row)) for row in cursor.fetchall())
+        for change in changes:
+            change['row'] = rows.get((change['table_name'], change['row_id']))
+    
+    next_seq = changes[-1]['seq'] if changes else since_seq
+    return {'changes': changes, 'token': f"{database_token}:{next_seq}", 'more': more}
+
+
+# Dias do feed de alterações mantidos por omissão (cli prune-changes)
+CHANGE_FEED_RETENTION_DAYS = 90
+
+
+@timed(rows=True)
+@retry_on_busy
+def prune_change_feed(conn, older_than_days: int = None, before_token: str = None) -> int:
+    """
+    Delete change_feed rows by age or up to a token.
+    
+    Pass the oldest token still held by a consumer as before_token to keep
+    every change it has not read. A consumer whose token is older than
+    what was deleted gets ChangeFeedReset from get_changes_since (and must
+    re-read everything) instead of silently missing changes.
+    
+    Args:
+        conn: Database connection
+        older_than_days: Delete changes older than this many days
+        before_token: Delete the changes up to this token (already read by every consumer)
+        
+    Returns:
+        Number of change_feed rows deleted
+        
+    Raises:
+        ValueError: neither or both limits given, or a malformed token
+        ChangeFeedReset: before_token from another database
+    """
+    if (older_than_days is None) == (before_token is None):
+        raise ValueError("Indicar older_than_days ou before_token")
+    cursor = conn.cursor()
+    if before_token is not None:
+        database_token, through_seq = _parse_change_token(before_token)
+        if database_token != get_data_version(conn)[0]:
+            raise ChangeFeedReset(f"Token {before_token} não corresponde a esta base de dados")
+        cursor.execute("DELETE FROM change_feed WHERE seq <= ?", (through_seq,))
+    else:
+        if older_than_days < 0:
+            raise ValueError(f"Número de dias inválido: {older_than_days}")
+        # Sempre um prefixo de seq (get_changes_since deteta o que falta pelo MIN(seq))
+        cursor.execute("""
+            DELETE FROM change_feed WHERE seq <= (
+                SELECT MAX(seq) FROM change_feed WHERE changed_at < strftime('%Y-%m-%d %H:%M:%f', 'now', ?)
+            )
+        """, (f"-{older_than_days} days",))
+    deleted = cursor.rowcount
+    conn.commit()
+    return deleted
+
+
+@timed
 def get_desenhos_by_estado(conn, estado: str) -> List[Dict[str, Any]]:
     """
     Get all desenhos with a specific internal state.
@@ -905,6 +2243,7 @@ def get_desenhos_by_estado(conn, estado: str) -> List[Dict[str, Any]]:
     return [dict(row) for row in rows]
 
 
+@timed
 def get_desenhos_em_atraso(conn) -> List[Dict[str, Any]]:
     """
     Get all desenhos with needs_revision state and past deadline.
@@ -928,6 +2267,7 @@ def get_desenhos_em_atraso(conn) -> List[Dict[str, Any]]:
     return [dict(row) for row in rows]
 
 
+@timed
 def get_desenho_by_id(conn, desenho_id: int) -> Dict[str, Any]:
     """
     Get a single desenho by ID.
@@ -945,6 +2285,8 @@ def get_desenho_by_id(conn, desenho_id: int) -> Dict[str, Any]:
     return dict(row) if row else None
 
 
+@timed
+@cached(vary=lambda: datetime.now().strftime('%Y-%m-%d'))
 def get_stats_by_estado(conn) -> Dict[str, int]:
     """
     Get count of desenhos by each state.
@@ -984,10 +2326,13 @@ def get_stats_by_estado(conn) -> Dict[str, int]:
     return stats
 
 
+@timed
+@cached
 def get_unique_revision_dates(conn) -> List[str]:
     """
     Get all unique revision dates from revisoes table.
-    Returns dates sorted descending (most recent first).
+    Returns dates sorted descending (most recent first); dates shorter than
+    DD-MM-YYYY are left out, as in the history views.
     
     Returns:
         List of date strings in format DD-MM-YYYY
@@ -1001,6 +2346,7 @@ def get_unique_revision_dates(conn) -> List[str]:
         WHERE rev_date IS NOT NULL 
         AND rev_date != '' 
         AND rev_date != '-'
+        AND LENGTH(rev_date) >= 10
         ORDER BY 
             SUBSTR(rev_date, 7, 4) DESC,
             SUBSTR(rev_date, 4, 2) DESC,
@@ -1010,11 +2356,63 @@ def get_unique_revision_dates(conn) -> List[str]:
     return [row[0] for row in cursor.fetchall()]
 
 
+def _date_to_iso(date_str: str) -> str:
+    """DD-MM-YYYY -> YYYY-MM-DD (other formats are returned unchanged)."""
+    parts = date_str.split('-')
+    if len(parts) == 3:
+        return f"{parts[2]}-{parts[1]}-{parts[0]}"
+    return date_str
+
+
+def _revisoes_at_date(conn, target_iso: str) -> Dict[int, Tuple[str, str, str]]:
+    """
+    Revision current on target_iso for each desenho that has one (computed, not cached).
+    
+    Returns:
+        Dict desenho_id -> (rev_code, rev_date, rev_desc)
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT desenho_id, rev_code, rev_date, rev_desc FROM (
+            SELECT desenho_id, rev_code, rev_date, rev_desc,
+                   ROW_NUMBER() OVER (
+                       PARTITION BY desenho_id
+                       ORDER BY SUBSTR(rev_date, 7, 4) DESC, SUBSTR(rev_date, 4, 2) DESC,
+                                SUBSTR(rev_date, 1, 2) DESC, rev_code DESC
+                   ) AS position
+            FROM revisoes
+            WHERE rev_date IS NOT NULL
+            AND rev_date != ''
+            AND rev_date != '-'
+            AND LENGTH(rev_date) >= 10
+            AND {_rev_date_iso_sql('rev_date')} <= ?
+        )
+        WHERE position = 1
+    """, (target_iso,))
+    return {row[0]: (row[1], row[2], row[3]) for row in cursor.fetchall()}
+
+
+def _load_historico_snapshot(conn, target_date: str) -> Optional[Dict[int, Tuple[str, str, str]]]:
+    """Cached revisions of a date (see prewarm_historico_snapshots), None if not built / invalidated."""
+    row = conn.execute(
+        "SELECT revisoes FROM historico_snapshots WHERE snapshot_date = ? AND revisoes IS NOT NULL",
+        (target_date,)
+    ).fetchone()
+    if row is None:
+        return None
+    return {desenho_id: (rev_code, rev_date, rev_desc) for desenho_id, rev_code, rev_date, rev_desc in json.loads(zlib.decompress(row[0]))}
+
+
+@timed
 def get_desenhos_at_date(conn, target_date: str) -> List[Dict[str, Any]]:
     """
     Get all desenhos with their latest revision as of a specific date.
     For each desenho, shows the revision that was current on that date.
     
+    The revisions come from the date's history snapshot when it is built
+    (prewarm_historico_snapshots) and are computed in one query otherwise;
+    the desenho fields are always read live.
+    
     Args:
         conn: Database connection
         target_date: Date string in format DD-MM-YYYY
@@ -1025,14 +2423,11 @@ def get_desenhos_at_date(conn, target_date: str) -> List[Dict[str, Any]]:
     cursor = conn.cursor()
     
     # Parse target date to comparable format (YYYY-MM-DD for SQLite comparison)
-    try:
-        parts = target_date.split('-')
-        if len(parts) == 3:
-            target_date_iso = f"{parts[2]}-{parts[1]}-{parts[0]}"
-        else:
-            target_date_iso = target_date
-    except:
-        target_date_iso = target_date
+    target_date_iso = _date_to_iso(target_date)
+    
+    revisoes_at_date = _load_historico_snapshot(conn, target_date)
+    if revisoes_at_date is None:
+        revisoes_at_date = _revisoes_at_date(conn, target_date_iso)
     
     # Get all desenhos
     cursor.execute("""
@@ -1046,64 +2441,541 @@ def get_desenhos_at_date(conn, target_date: str) -> List[Dict[str, Any]]:
     desenhos = []
     
     for row in cursor.fetchall():
-        desenho = {
-            'id': row[0],
-            'layout_name': row[1],
-            'dwg_name': row[2],
-            'des_num': row[3],
-            'tipo_display': row[4],
-            'elemento': row[5],
-            'elemento_key': row[6],
-            'titulo': row[7],
-            'elemento_titulo': row[8],
-            'cliente': row[9],
-            'obra': row[10],
-            'data': row[11],
-            'r': '-',
-            'r_data': '-',
-            'r_desc': '-'
+        rev_row = revisoes_at_date.get(row[0])
+        
+        # Only include desenhos that had revisions on or before this date
+        # or whose first emission date is on or before it
+        first_emission_date = row[11]
+        has_first_emission = False
+        if not rev_row and first_emission_date and first_emission_date not in ['', '-']:
+            ep = first_emission_date.split('-')
+            if len(ep) == 3:
+                has_first_emission = f"{ep[2]}-{ep[1]}-{ep[0]}" <= target_date_iso
+        
+        if rev_row or has_first_emission:
+            desenhos.append({
+                'id': row[0],
+                'layout_name': row[1],
+                'dwg_name': row[2],
+                'des_num': row[3],
+                'tipo_display': row[4],
+                'elemento': row[5],
+                'elemento_key': row[6],
+                'titulo': row[7],
+                'elemento_titulo': row[8],
+                'cliente': row[9],
+                'obra': row[10],
+                'data': row[11],
+                'r': rev_row[0] if rev_row else '-',
+                'r_data': rev_row[1] if rev_row else '-',
+                'r_desc': rev_row[2] if rev_row else '-'
+            })
+    
+    return desenhos
+
+
+# Estado de cada desenho na comparação de duas datas (get_historico_diff)
+HISTORICO_DIFF_STATUS = ['added', 'changed', 'unchanged']
+
+
+@timed
+def get_historico_diff(conn, date_from: str, date_to: str) -> List[Dict[str, Any]]:
+    """
+    Compare the desenhos at two dates in one set-based query.
+    
+    A single grouped pass over idx_revisoes_iso picks, for each desenho, the
+    latest revision (by date, then rev_code) on or before each date; existing
+    at a date means having a revision or the first emission (desenhos.data)
+    on or before it, as in get_desenhos_at_date.
+    
+    Args:
+        conn: Database connection
+        date_from: Date string in format DD-MM-YYYY
+        date_to: Date string in format DD-MM-YYYY (the two dates are put in
+            chronological order)
+        
+    Returns:
+        List of desenhos existing at date_to, ordered by layout_name, with
+        r_from / r_data_from and r_to / r_data_to / r_desc_to ('-' when none)
+        and status: 'added' (absent at date_from), 'changed' (other revision)
+        or 'unchanged'
+    """
+    iso_from, iso_to = sorted([_date_to_iso(date_from), _date_to_iso(date_to)])
+    
+    existed_sql = f"""(d.data IS NOT NULL AND d.data NOT IN ('', '-')
+                       AND LENGTH(d.data) - LENGTH(REPLACE(d.data, '-', '')) = 2
+                       AND {_rev_date_iso_sql('d.data')} <= ?)"""
+    cursor = conn.cursor()
+    # Chave rev_iso || rev_code: o MAX dá a revisão mais recente. Só datas completas
+    # (rev_iso com 10 caracteres, como em _revisoes_at_date), senão o SUBSTR desalinha
+    cursor.execute(f"""
+        WITH latest AS (
+            SELECT desenho_id,
+                   MAX(CASE WHEN rev_iso <= ? THEN rev_iso || rev_code END) AS key_from,
+                   MAX(rev_iso || rev_code) AS key_to
+            FROM revisoes
+            WHERE rev_iso <= ? AND LENGTH(rev_iso) = 10
+            GROUP BY desenho_id
+        )
+        SELECT d.id, d.layout_name, d.dwg_name, d.des_num, d.tipo_display, d.elemento, d.titulo,
+               COALESCE(rf.rev_code, '-'), COALESCE(rf.rev_date, '-'),
+               COALESCE(rt.rev_code, '-'), COALESCE(rt.rev_date, '-'), COALESCE(rt.rev_desc, '-'),
+               CASE
+                   WHEN rf.id IS NULL AND NOT {existed_sql} THEN 'added'
+                   WHEN rf.id IS NOT rt.id THEN 'changed'
+                   ELSE 'unchanged'
+               END
+        FROM desenhos d
+        LEFT JOIN latest l ON l.desenho_id = d.id
+        LEFT JOIN revisoes rf ON rf.desenho_id = d.id
+            AND rf.rev_iso = SUBSTR(l.key_from, 1, 10) AND rf.rev_code = SUBSTR(l.key_from, 11)
+        LEFT JOIN revisoes rt ON rt.desenho_id = d.id
+            AND rt.rev_iso = SUBSTR(l.key_to, 1, 10) AND rt.rev_code = SUBSTR(l.key_to, 11)
+        WHERE rt.id IS NOT NULL OR {existed_sql}
+        ORDER BY d.layout_name
+    """, (iso_from, iso_to, iso_from, iso_to))
+    
+    return [
+        {
+            'id': row[0], 'layout_name': row[1], 'dwg_name': row[2], 'des_num': row[3],
+            'tipo_display': row[4], 'elemento': row[5], 'titulo': row[6],
+            'r_from': row[7], 'r_data_from': row[8],
+            'r_to': row[9], 'r_data_to': row[10], 'r_desc_to': row[11],
+            'status': row[12],
         }
+        for row in cursor.fetchall()
+    ]
+
+
+@timed
+@retry_on_busy
+def prewarm_historico_snapshots(conn) -> int:
+    """
+    Build the history snapshot of every revision date that has none (run after imports).
+    
+    Placeholders for the missing dates are committed first; the revisions are
+    then read in one pass and each date's snapshot is computed while sweeping
+    the dates in order. A snapshot is only stored if its placeholder still
+    exists, i.e. no revisoes write touching that date happened meanwhile
+    (the triggers delete it). Reported as telemetry phase 'histórico'.
+    
+    Args:
+        conn: Database connection
         
-        # Get the latest revision on or before the target date
+    Returns:
+        Number of snapshots built
+    """
+    cursor = conn.cursor()
+    
+    built = {row[0] for row in cursor.execute(
+        "SELECT snapshot_date FROM historico_snapshots WHERE revisoes IS NOT NULL"
+    )}
+    missing = [d for d in get_unique_revision_dates(conn) if d not in built]
+    if not missing:
+        return 0
+    
+    cursor.executemany(
+        "INSERT OR IGNORE INTO historico_snapshots (snapshot_date, target_iso) VALUES (?, ?)",
+        [(d, _date_to_iso(d)) for d in missing]
+    )
+    conn.commit()
+    
+    snapshots = {}
+    with telemetry.phase('histórico', total=len(missing)):
+        cursor.execute("BEGIN")
+        try:
+            cursor.execute(f"""
+                SELECT desenho_id, rev_code, rev_date, rev_desc, {_rev_date_iso_sql('rev_date')} AS rev_iso
+                FROM revisoes
+                WHERE rev_date IS NOT NULL AND rev_date != '' AND rev_date != '-' AND LENGTH(rev_date) >= 10
+                ORDER BY rev_iso
+            """)
+            revisoes = cursor.fetchall()
+        finally:
+            conn.commit()
+        
+        # Sweep: revisions dated up to each date, latest per desenho as in _revisoes_at_date
+        current: Dict[int, Tuple[str, str, str]] = {}
+        current_keys: Dict[int, Tuple[str, str, str, str]] = {}
+        position = 0
+        for done, snapshot_date in enumerate(sorted(missing, key=_date_to_iso)):
+            telemetry.progress(done, snapshot_date)
+            target_iso = _date_to_iso(snapshot_date)
+            while position < len(revisoes) and revisoes[position][4] <= target_iso:
+                desenho_id, rev_code, rev_date, rev_desc, _ = revisoes[position]
+                key = (rev_date[6:10], rev_date[3:5], rev_date[0:2], rev_code)
+                if desenho_id not in current_keys or key >= current_keys[desenho_id]:
+                    current_keys[desenho_id] = key
+                    current[desenho_id] = (rev_code, rev_date, rev_desc)
+                position += 1
+            snapshots[snapshot_date] = zlib.compress(json.dumps(
+                [[desenho_id, *rev] for desenho_id, rev in current.items()], ensure_ascii=False
+            ).encode('utf-8'))
+        telemetry.progress(len(missing))
+        
+        now = datetime.now().isoformat()
+        stored = 0
+        for snapshot_date, blob in snapshots.items():
+            cursor.execute("""
+                UPDATE historico_snapshots SET revisoes = ?, built_at = ?
+                WHERE snapshot_date = ? AND revisoes IS NULL
+            """, (blob, now, snapshot_date))
+            stored += cursor.rowcount
+        conn.commit()
+        telemetry.count('datas', stored)
+    
+    return stored
+
+
+# ============================================
+# FUNÇÕES PARA FICHEIROS IMPORTADOS (WATCHER)
+# ============================================
+
+@timed
+def get_imported_file(conn, path: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the import record of a watched file.
+    
+    Args:
+        conn: Database connection
+        path: File path as seen by the watcher
+        
+    Returns:
+        Record dictionary or None if the file was never imported
+    """
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM ficheiros_importados WHERE path = ?", (path,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+@timed
+@retry_on_busy
+def record_imported_file(
+    conn,
+    path: str,
+    mtime: float,
+    size: int,
+    content_hash: str,
+    desenhos_imported: int,
+    arrived_at: float,
+    committed_at: float,
+    error: str = None
+):
+    """
+    Insert or replace the import record of a watched file.
+    
+    Args:
+        conn: Database connection
+        path: File path as seen by the watcher
+        mtime: File modification time (epoch seconds)
+        size: File size in bytes
+        content_hash: SHA-1 of the file contents
+        desenhos_imported: Number of desenhos imported from the file
+        arrived_at: When the file was first seen (epoch seconds)
+        committed_at: When the import was committed (epoch seconds)
+        error: Optional error message if the import failed
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT OR REPLACE INTO ficheiros_importados
+        (path, mtime, size, content_hash, desenhos_imported, arrived_at, committed_at, latency_ms, error)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (
+        path,
+        mtime,
+        size,
+        content_hash,
+        desenhos_imported,
+        datetime.fromtimestamp(arrived_at).isoformat(),
+        datetime.fromtimestamp(committed_at).isoformat(),
+        (committed_at - arrived_at) * 1000.0,
+        error
+    ))
+    conn.commit()
+
+
+@timed
+def get_imported_files(conn, limit: int = 50) -> List[Dict[str, Any]]:
+    """
+    Get the most recent watcher import records.
+    
+    Args:
+        conn: Database connection
+        limit: Maximum number of records
+        
+    Returns:
+        List of records, newest first
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT * FROM ficheiros_importados
+        ORDER BY committed_at DESC
+        LIMIT ?
+    """, (limit,))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+# ============================================
+# FUNÇÕES PARA LOG DE PERFORMANCE
+# ============================================
+
+PERF_LOG_MAX_ROWS = 20000
+
+
+@retry_on_busy
+def insert_perf_log(conn, run_id: str, records: Dict[str, Dict[str, Any]], max_rows: int = PERF_LOG_MAX_ROWS):
+    """
+    Append the timings of one run to perf_log and trim the log to max_rows.
+    
+    Args:
+        conn: Database connection
+        run_id: Identifier of the run (e.g. rerun timestamp)
+        records: perf.get_records() output
+        max_rows: Rolling log size
+    """
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    cursor.executemany("""
+        INSERT INTO perf_log (run_id, name, calls, total_ms, rows, created_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [
+        (run_id, name, r['calls'], r['total_ms'], r['rows'], now)
+        for name, r in records.items()
+    ])
+    cursor.execute("""
+        DELETE FROM perf_log WHERE id <= (SELECT MAX(id) FROM perf_log) - ?
+    """, (max_rows,))
+    conn.commit()
+
+
+def get_perf_trend(conn, limit_runs: int = 50) -> List[Dict[str, Any]]:
+    """
+    Get per-name averages over the last runs in perf_log.
+    
+    Args:
+        conn: Database connection
+        limit_runs: Number of most recent runs to aggregate
+        
+    Returns:
+        List of dicts (name, runs, avg_ms, max_ms, avg_calls), slowest first
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT name, COUNT(*) AS runs, AVG(total_ms) AS avg_ms, MAX(total_ms) AS max_ms,
+               AVG(calls) AS avg_calls
+        FROM perf_log
+        WHERE run_id IN (
+            SELECT run_id FROM perf_log GROUP BY run_id ORDER BY MAX(id) DESC LIMIT ?
+        )
+        GROUP BY name
+        ORDER BY avg_ms DESC
+    """, (limit_runs,))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+@timed
+def get_id_cad_log(conn, since_id: int = 0, limit: int = None) -> List[Dict[str, Any]]:
+    """
+    Get id_cad_log entries (layouts renamed, merged or retired on import).
+    
+    Args:
+        conn: Database connection
+        since_id: Only entries with id > since_id
+        limit: Maximum number of entries (newest)
+        
+    Returns:
+        List of entries, oldest first
+    """
+    cursor = conn.cursor()
+    sql = "SELECT * FROM id_cad_log WHERE id > ? ORDER BY id DESC"
+    params: List[Any] = [since_id]
+    if limit:
+        sql += " LIMIT ?"
+        params.append(limit)
+    cursor.execute(sql, params)
+    return [dict(row) for row in reversed(cursor.fetchall())]
+
+
+@timed
+def get_id_cad_log_last_id(conn) -> int:
+    """Id of the newest id_cad_log entry (0 if empty), e.g. to report one import."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(MAX(id), 0) FROM id_cad_log")
+    return cursor.fetchone()[0]
+
+
+# Estados de uma tarefa (jobs.py); as duas primeiras são "ativas"
+JOB_STATUSES = ['queued', 'running', 'done', 'failed', 'cancelled']
+JOB_ACTIVE_STATUSES = ('queued', 'running')
+
+
+def _job_row(row) -> Optional[Dict[str, Any]]:
+    """Job row as a dict with params/result decoded from JSON."""
+    if row is None:
+        return None
+    job = dict(row)
+    job['params'] = json.loads(job['params']) if job['params'] else {}
+    job['result'] = json.loads(job['result']) if job['result'] else None
+    return job
+
+
+@timed
+@retry_on_busy
+def create_job(conn, kind: str, params: Dict[str, Any], owner: str = None) -> Tuple[int, bool]:
+    """
+    Queue a job unless an identical one (same kind and params) is queued or running.
+    
+    Args:
+        conn: Database connection
+        kind: Job kind (see jobs.JOB_TASKS)
+        params: JSON-serializable task arguments
+        owner: Process that will run it ("host:pid")
+        
+    Returns:
+        (job_id, created): created is False when an identical active job was reused
+    """
+    params_json = json.dumps(params, sort_keys=True, ensure_ascii=False)
+    dedup_key = f"{kind}:{params_json}"
+    cursor = conn.cursor()
+    
+    while True:
         cursor.execute("""
-            SELECT rev_code, rev_date, rev_desc
-            FROM revisoes
-            WHERE desenho_id = ?
-            AND rev_date IS NOT NULL
-            AND rev_date != ''
-            AND rev_date != '-'
-            AND (
-                SUBSTR(rev_date, 7, 4) || '-' || SUBSTR(rev_date, 4, 2) || '-' || SUBSTR(rev_date, 1, 2)
-            ) <= ?
-            ORDER BY 
-                SUBSTR(rev_date, 7, 4) DESC,
-                SUBSTR(rev_date, 4, 2) DESC,
-                SUBSTR(rev_date, 1, 2) DESC,
-                rev_code DESC
-            LIMIT 1
-        """, (row[0], target_date_iso))
+            INSERT OR IGNORE INTO jobs (kind, params, dedup_key, status, owner, created_at)
+            VALUES (?, ?, ?, 'queued', ?, ?)
+        """, (kind, params_json, dedup_key, owner, datetime.now().isoformat()))
+        conn.commit()
+        if cursor.rowcount == 1:
+            return cursor.lastrowid, True
         
-        rev_row = cursor.fetchone()
-        if rev_row:
-            desenho['r'] = rev_row[0]
-            desenho['r_data'] = rev_row[1]
-            desenho['r_desc'] = rev_row[2]
+        cursor.execute(
+            "SELECT id FROM jobs WHERE dedup_key = ? AND status IN ('queued', 'running')", (dedup_key,)
+        )
+        row = cursor.fetchone()
+        if row:
+            return row[0], False
+        # The active job finished in between - try again
+
+
+@timed
+def get_job(conn, job_id: int) -> Optional[Dict[str, Any]]:
+    """Get one job (params/result decoded), or None."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+    return _job_row(cursor.fetchone())
+
+
+@timed
+def get_jobs(conn, limit: int = 20, active_only: bool = False) -> List[Dict[str, Any]]:
+    """
+    Get the most recent jobs.
+    
+    Args:
+        conn: Database connection
+        limit: Maximum number of jobs
+        active_only: Only queued/running jobs
         
-        # Only include desenhos that had revisions on or before this date
-        # Check if desenho existed by looking at any revision <= target date
-        # or if the first emission date <= target date
-        first_emission_date = desenho.get('data', '')
-        has_first_emission = False
-        if first_emission_date and first_emission_date not in ['', '-']:
-            try:
-                ep = first_emission_date.split('-')
-                if len(ep) == 3:
-                    first_iso = f"{ep[2]}-{ep[1]}-{ep[0]}"
-                    has_first_emission = first_iso <= target_date_iso
-            except:
-                pass
+    Returns:
+        List of jobs, newest first
+    """
+    cursor = conn.cursor()
+    where = "WHERE status IN ('queued', 'running')" if active_only else ""
+    cursor.execute(f"SELECT * FROM jobs {where} ORDER BY id DESC LIMIT ?", (limit,))
+    return [_job_row(row) for row in cursor.fetchall()]
+
+
+@timed
+@retry_on_busy
+def start_job(conn, job_id: int) -> bool:
+    """
+    Mark a queued job as running.
+    
+    Returns:
+        False if the job is no longer queued (e.g. cancelled before it started)
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE jobs SET status = 'running', started_at = ?
+        WHERE id = ? AND status = 'queued' AND cancel_requested = 0
+    """, (datetime.now().isoformat(), job_id))
+    conn.commit()
+    return cursor.rowcount == 1
+
+
+@timed
+@retry_on_busy
+def update_job_progress(conn, job_id: int, phase: str, progress: float, message: str = None) -> bool:
+    """
+    Store the progress of a running job.
+    
+    Args:
+        conn: Database connection
+        job_id: Job ID
+        phase: Current phase name
+        progress: Fraction of the phase done (0-1)
+        message: Optional detail (file, anchor, ...)
         
-        if rev_row or has_first_emission:
-            desenhos.append(desenho)
+    Returns:
+        True if cancellation was requested
+    """
+    cursor = conn.cursor()
+    cursor.execute(
+        "UPDATE jobs SET phase = ?, progress = ?, message = ? WHERE id = ?",
+        (phase, max(0.0, min(1.0, progress)), message, job_id)
+    )
+    conn.commit()
+    cursor.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,))
+    row = cursor.fetchone()
+    return bool(row and row[0])
+
+
+@timed
+@retry_on_busy
+def finish_job(conn, job_id: int, status: str, result: Dict[str, Any] = None, error: str = None):
+    """
+    Mark a job as done, failed or cancelled.
+    
+    Args:
+        conn: Database connection
+        job_id: Job ID
+        status: 'done', 'failed' or 'cancelled'
+        result: Optional JSON-serializable result
+        error: Optional error message
+    """
+    if status not in JOB_STATUSES[2:]:
+        raise ValueError(f"Estado final inválido: {status}")
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?,
+            progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END
+        WHERE id = ?
+    """, (
+        status,
+        json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+        error,
+        datetime.now().isoformat(),
+        status,
+        job_id
+    ))
+    conn.commit()
+
+
+@timed
+@retry_on_busy
+def request_job_cancel(conn, job_id: int) -> bool:
+    """
+    Ask a job to stop; a job that has not started yet is cancelled right away.
     
-    return desenhos
\ No newline at end of file
+    Returns:
+        True if the job was still queued/running
+    """
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE jobs SET
+            cancel_requested = 1,
+            status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE status END,
+            finished_at = CASE WHEN status = 'queued' THEN ? ELSE finished_at END
+        WHERE id = ? AND status IN ('queued', 'running')
+    """, (datetime.now().isoformat(), job_id))
+    conn.commit()
+    return cursor.rowcount == 1
@@ -0,0 +1,261 @@
+"""
+Export column engine - compiles a column spec into one SQL projection.
+
+A column spec is a list of (header, source) pairs. Sources are resolved as:
+    1. csv_config.json / LISP column names (DWG_SOURCE, PFIX, REVISAO, ...)
+    2. REV_X / DATA_X / DESC_X (X = A-E): revisões pivoted with MAX(CASE ...)
+    3. desenhos table columns (layout_name, elemento_key, ...)
+    4. anything else: read from raw_attributes by the raw_attr() SQL function
+The revisoes pivot is only joined when a revision column is requested, so a
+narrow export only reads the columns it asks for.
+"""
+import ast
+import json
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from db import DESENHOS_BASE_ORDER, get_desenhos_table_columns
+
+
+# Spec de colunas: lista de (header CSV, origem)
+ColumnSpec = List[Tuple[str, str]]
+
+CSV_CONFIG_PATH = "csv_config.json"
+
+# Nomes de coluna do csv_config.json / LISP -> expressão SQL sobre desenhos d
+CONFIG_COLUMN_SQL = {
+    'DWG_SOURCE': 'd.dwg_name',
+    'LAYOUT': 'd.layout_name',
+    'CLIENTE': 'd.cliente',
+    'OBRA': 'd.obra',
+    'LOCALIZACAO': 'd.localizacao',
+    'ESPECIALIDADE': 'd.especialidade',
+    'PROJETOU': 'd.projetou',
+    'FASE': 'd.fase',
+    'DATA': 'd.data',
+    'DES_NUM': 'd.des_num',
+    'TIPO': 'd.tipo_display',
+    'ELEMENTO': 'd.elemento',
+    'TITULO': 'd.titulo',
+    'ELEMENTO_TITULO': 'd.elemento_titulo',
+    'R': 'd.r',
+    'REVISAO': 'd.r',
+    'DATA_REV': 'd.r_data',
+    'DESC_REV': 'd.r_desc',
+}
+
+_REVISION_COLUMN_RE = re.compile(r'^(REV|DATA|DESC)_([A-E])$', re.IGNORECASE)
+
+# Coluna da revisoes pivotada por prefixo
+_REVISION_FIELDS = {'REV': 'UPPER(rev_code)', 'DATA': 'rev_date', 'DESC': 'rev_desc'}
+
+# Presets (header, origem). 'autocad' é o layout de 29 campos lido pela importação LISP.
+EXPORT_PRESETS: Dict[str, ColumnSpec] = {
+    'autocad': [
+        ('TAG DO LAYOUT', 'layout_name'),
+        ('CLIENTE', 'cliente'),
+        ('OBRA', 'obra'),
+        ('LOCALIZACAO', 'localizacao'),
+        ('ESPECIALIDADE', 'especialidade'),
+        ('FASE', 'fase'),
+        ('DATA 1ª EMISSÃO', 'data'),
+        ('PROJETOU', 'projetou'),
+        ('NUMERO DE DESENHO', 'des_num'),
+        ('TIPO', 'tipo_display'),
+        ('ELEMENTO', 'elemento_key'),
+        ('TITULO', 'titulo'),
+        ('REVISÃO A', 'rev_a'),
+        ('DATA REVISAO A', 'data_a'),
+        ('DESCRIÇÃO REVISÃO A', 'desc_a'),
+        ('REVISÃO B', 'rev_b'),
+        ('DATA REVISAO B', 'data_b'),
+        ('DESCRIÇÃO REVISÃO B', 'desc_b'),
+        ('REVISÃO C', 'rev_c'),
+        ('DATA REVISAO C', 'data_c'),
+        ('DESCRIÇÃO REVISÃO C', 'desc_c'),
+        ('REVISÃO D', 'rev_d'),
+        ('DATA REVISAO D', 'data_d'),
+        ('DESCRIÇÃO REVISÃO D', 'desc_d'),
+        ('REVISÃO E', 'rev_e'),
+        ('DATA REVISAO E', 'data_e'),
+        ('DESCRIÇÃO REVISÃO E', 'desc_e'),
+        ('NOME DWG', 'dwg_name'),
+        ('ID_CAD', 'id_cad'),
+    ],
+    # "Gerar CSV (Campos Principais)" da LISP
+    'principal': [
+        ('DWG_SOURCE', 'DWG_SOURCE'), ('PROJ_NUM', 'PROJ_NUM'), ('PFIX', 'PFIX'),
+        ('DES_NUM', 'DES_NUM'), ('TIPO', 'TIPO'), ('ELEMENTO', 'ELEMENTO'), ('TITULO', 'TITULO'),
+        ('REVISAO', 'REVISAO'), ('DATA', 'DATA_REV'), ('DESCRICAO', 'DESC_REV'),
+        ('ID_CAD', 'ID_CAD'), ('LAYOUT', 'LAYOUT'),
+    ],
+    # "Gerar CSV (Todos os Campos)" da LISP (_ListaCompleta.csv)
+    'completo': [
+        (name, name) for name in [
+            'PROJ_NUM', 'PROJ_NOME', 'CLIENTE', 'OBRA', 'LOCALIZACAO', 'ESPECIALIDADE', 'PROJETOU',
+            'FASE', 'FASE_PFIX', 'EMISSAO', 'DATA', 'PFIX', 'LAYOUT', 'DES_NUM', 'TIPO', 'ELEMENTO',
+            'TITULO', 'REV_A', 'DATA_A', 'DESC_A', 'REV_B', 'DATA_B', 'DESC_B', 'REV_C', 'DATA_C',
+            'DESC_C', 'REV_D', 'DATA_D', 'DESC_D', 'REV_E', 'DATA_E', 'DESC_E', 'DWG_SOURCE', 'ID_CAD',
+        ]
+    ],
+}
+
+
+def load_csv_config(config_path: str = CSV_CONFIG_PATH) -> Dict[str, Any]:
+    """
+    Read csv_config.json into a column spec.
+
+    Returns:
+        Dict with spec (ColumnSpec), separator and include_header
+    """
+    with open(config_path, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    columns = config.get('columns') or []
+    if not columns:
+        raise ValueError(f"Nenhuma coluna definida em {config_path}")
+    return {
+        'spec': [(name, name) for name in columns],
+        'separator': config.get('separator', ';'),
+        'include_header': config.get('includeHeader', True),
+    }
+
+
+def resolve_columns(columns: Any = None, config_path: str = CSV_CONFIG_PATH) -> Dict[str, Any]:
+    """
+    Resolve a preset name, 'config' (csv_config.json) or an explicit spec.
+
+    Args:
+        columns: None/'autocad', a preset name, 'config', or a list of
+            column names / (header, source) pairs
+        config_path: csv_config.json path used for 'config'
+
+    Returns:
+        Dict with spec (ColumnSpec), separator and include_header
+    """
+    if columns == 'config':
+        return load_csv_config(config_path)
+    if columns is None:
+        spec = EXPORT_PRESETS['autocad']
+    elif isinstance(columns, str):
+        if columns not in EXPORT_PRESETS:
+            raise ValueError(f"Preset desconhecido: {columns}")
+        spec = EXPORT_PRESETS[columns]
+    else:
+        spec = [(c, c) if isinstance(c, str) else tuple(c) for c in columns]
+    return {'spec': spec, 'separator': ';', 'include_header': True}
+
+
+@lru_cache(maxsize=8)
+def _parse_raw_attributes(raw: str) -> Dict[str, Any]:
+    """Parse raw_attributes (JSON from the JSON importer, str(dict) from the CSV importer); keys upper-cased."""
+    try:
+        parsed = json.loads(raw)
+    except ValueError:
+        try:
+            parsed = ast.literal_eval(raw)
+        except (ValueError, SyntaxError):
+            return {}
+    if not isinstance(parsed, dict):
+        return {}
+    return {str(k).upper(): v for k, v in parsed.items()}
+
+
+@lru_cache(maxsize=256)
+def _repr_value_re(name: str):
+    """Regex for "'name': '<value>'" inside a str(dict) repr (either quote style)."""
+    return re.compile(
+        r"""['"]""" + re.escape(name) + r"""['"]:\s*('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")""",
+        re.IGNORECASE
+    )
+
+
+def raw_attr(raw: Optional[str], name: str) -> Optional[str]:
+    """SQL function raw_attr(raw_attributes, name): one attribute of the stored raw dict."""
+    if not raw:
+        return None
+    if raw.startswith("{'"):
+        # str(dict) from the CSV importer: literal_eval of the whole dict is slow,
+        # pick the one string value out of the repr instead
+        match = _repr_value_re(name).search(raw)
+        if match:
+            return ast.literal_eval(match.group(1))
+    value = _parse_raw_attributes(raw).get(name.upper())
+    return None if value is None else str(value)
+
+
+def register_export_functions(conn):
+    """Register raw_attr() on a connection (needed by compiled export queries)."""
+    conn.create_function('raw_attr', 2, raw_attr, deterministic=True)
+
+
+def _column_sql(source: str, table_columns: Sequence[str], pivot: Dict[str, str], params: List[Any]) -> str:
+    """SQL expression for one column source (adds pivot columns / params as needed)."""
+    upper = source.upper()
+    if upper in CONFIG_COLUMN_SQL:
+        return CONFIG_COLUMN_SQL[upper]
+
+    match = _REVISION_COLUMN_RE.match(source)
+    if match:
+        prefix, letter = match.group(1).upper(), match.group(2).upper()
+        alias = f"{prefix.lower()}_{letter.lower()}"
+        pivot[alias] = f"MAX(CASE WHEN UPPER(rev_code) = '{letter}' THEN {_REVISION_FIELDS[prefix]} END)"
+        return f"rv.{alias}"
+
+    if source.lower() in table_columns:
+        return f"d.{source.lower()}"
+
+    params.append(source)
+    return "raw_attr(d.raw_attributes, ?)"
+
+
+def compile_export_query(
+    conn,
+    spec: ColumnSpec,
+    dwg_name: str = None,
+    changed_only: bool = False,
+    extra_fields: Sequence[str] = ()
+) -> Tuple[str, List[Any]]:
+    """
+    Compile a column spec into one SELECT over desenhos (+ pivoted revisoes).
+
+    Args:
+        conn: Database connection (raw_attr must be registered to run the query)
+        spec: ColumnSpec
+        dwg_name: Optional DWG name filter
+        changed_only: Only desenhos changed since the last export of their DWG
+        extra_fields: desenhos columns appended after the spec columns
+            (e.g. sort keys, dwg_name for grouping)
+
+    Returns:
+        (sql, params); the projection has len(spec) + len(extra_fields)
+        columns, NULLs as '' for spec columns, rows in the grid's base
+        order (DESENHOS_BASE_ORDER)
+    """
+    table_columns = get_desenhos_table_columns(conn)
+    pivot: Dict[str, str] = {}
+    params: List[Any] = []
+
+    select = [f"COALESCE({_column_sql(source, table_columns, pivot, params)}, '')" for _, source in spec]
+    for field in extra_fields:
+        if field not in table_columns:
+            raise ValueError(f"Coluna desconhecida: {field}")
+        select.append(f"d.{field}")
+
+    sql = f"SELECT {', '.join(select)} FROM desenhos d"
+    if pivot:
+        pivot_select = ', '.join(f"{expr} AS {alias}" for alias, expr in pivot.items())
+        sql += f" LEFT JOIN (SELECT desenho_id, {pivot_select} FROM revisoes GROUP BY desenho_id) rv ON rv.desenho_id = d.id"
+
+    conditions = []
+    if changed_only:
+        sql += " LEFT JOIN export_watermarks w ON w.dwg_name = d.dwg_name"
+        conditions.append("d.change_seq > COALESCE(w.change_seq, -1)")
+    if dwg_name:
+        conditions.append("d.dwg_name = ?")
+        params.append(dwg_name)
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += " ORDER BY " + ", ".join(f"d.{col}" for col in DESENHOS_BASE_ORDER)
+
+    return sql, params
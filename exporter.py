@@ -0,0 +1,247 @@
+"""
+AutoCAD exporter - writes ALTERACOES_PARA_AUTOCAD CSV files from database.
+Uses the 29-field "Todos os Campos" layout read back by the AutoLISP import;
+other column sets (presets or csv_config.json) go through the same engine,
+see export_columns.py. Rows are streamed from one compiled SQL query into
+csv.writer - no per-row dicts.
+
+Every AutoCAD export stores a per-DWG watermark (the DWG's change_seq at
+export time); a delta export (changed_only=True) writes only desenhos whose
+change_seq moved past it, and just the header when nothing changed.
+
+export_all_dwgs() reads the table once and writes one file per DWG on a
+thread pool, optionally packed into a single zip.
+"""
+import csv
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Sequence
+
+from db import get_dwg_change_seqs, set_export_watermarks
+from export_columns import compile_export_query, register_export_functions, resolve_columns
+from perf import timed
+from sorting import sort_positions
+import telemetry
+from utils import atomic_write_path
+
+
+# Threads para escrita dos ficheiros por DWG
+EXPORT_MAX_WORKERS = 4
+
+# Linhas por fetchmany() ao exportar sem ordenação
+EXPORT_BATCH_SIZE = 5000
+
+
+def _is_autocad_export(columns: Any) -> bool:
+    """True for the 29-field layout imported back by the LISP (the only one that moves watermarks)."""
+    return columns is None or columns == 'autocad'
+
+
+def get_export_filename(dwg_name: str = None, columns: Any = None) -> str:
+    """Return output file name for a DWG export (or for all DWGs)."""
+    if _is_autocad_export(columns):
+        prefix = "ALTERACOES_PARA_AUTOCAD"
+    else:
+        prefix = f"LISTA_{columns.upper() if isinstance(columns, str) else 'PERSONALIZADA'}"
+    if dwg_name:
+        return f"{prefix}_{dwg_name.replace(' ', '_')}.csv"
+    return f"{prefix}.csv"
+
+
+@timed
+def write_export_csv(
+    rows: Iterable[Sequence[Any]],
+    output_path: str,
+    headers: Sequence[str],
+    separator: str = ';',
+    include_header: bool = True
+):
+    """
+    Write export rows to CSV (UTF-8 with BOM for Excel/AutoCAD), atomically.
+
+    Args:
+        rows: Row tuples in header order
+        output_path: Destination file path
+        headers: CSV header
+        separator: Field separator
+        include_header: Write the header line
+    """
+    with atomic_write_path(output_path) as tmp_path:
+        with open(tmp_path, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, delimiter=separator, lineterminator='\n')
+            if include_header:
+                writer.writerow(headers)
+            writer.writerows(rows)
+
+
+def _run_export_query(conn, spec, dwg_name, changed_only, hidden: List[str], sort_cols, orders):
+    """
+    Run the compiled export query.
+
+    Returns:
+        Iterable of row tuples (spec columns followed by the hidden fields),
+        sorted with the shared sort engine if sort_cols is given, otherwise
+        streamed in batches.
+    """
+    register_export_functions(conn)
+    sql, params = compile_export_query(conn, spec, dwg_name, changed_only, hidden)
+
+    cursor = conn.cursor()
+    cursor.row_factory = None
+    cursor.execute(sql, params)
+
+    if not sort_cols:
+        return chain.from_iterable(iter(lambda: cursor.fetchmany(EXPORT_BATCH_SIZE), []))
+
+    rows = cursor.fetchall()
+    n = len(spec)
+    positions = sort_positions(
+        {field: [row[n + i] for row in rows] for i, field in enumerate(hidden)},
+        sort_cols,
+        orders
+    )
+    return rows if positions is None else [rows[i] for i in positions]
+
+
+@timed
+def export_autocad_csv(
+    conn,
+    dwg_name: str = None,
+    output_dir: str = "output",
+    sort_cols: List[str] = None,
+    orders: Dict[str, List[Any]] = None,
+    changed_only: bool = False,
+    columns: Any = None
+) -> Dict[str, Any]:
+    """
+    Export desenhos of one DWG (or all) to ALTERACOES_PARA_AUTOCAD CSV.
+
+    Args:
+        conn: Database connection
+        dwg_name: Optional DWG name filter
+        output_dir: Output folder
+        sort_cols: Optional sort criteria (desenho fields, see sorting.py)
+        orders: Optional dict field -> custom value order
+        changed_only: Only desenhos changed since the last export of their DWG
+        columns: Column set - None/'autocad' (29 fields), another preset,
+            'config' (csv_config.json) or an explicit spec; see export_columns.py
+
+    Returns:
+        Dictionary with stats: output_path, desenhos_exported, changed_only
+    """
+    resolved = resolve_columns(columns)
+    spec = resolved['spec']
+    sort_cols = [c for c in (sort_cols or []) if c]
+    hidden = list(dict.fromkeys(['dwg_name', *sort_cols]))
+    n = len(spec)
+
+    # Watermarks are read first: changes made while exporting go in the next delta
+    change_seqs = get_dwg_change_seqs(conn, dwg_name)
+    rows = _run_export_query(conn, spec, dwg_name, changed_only, hidden, sort_cols, orders)
+
+    per_dwg = {}
+
+    def counted(rows):
+        for row in rows:
+            per_dwg[row[n]] = per_dwg.get(row[n], 0) + 1
+            yield row[:n]
+
+    output_path = Path(output_dir) / get_export_filename(dwg_name, columns)
+    write_export_csv(
+        counted(rows), str(output_path), [header for header, _ in spec],
+        resolved['separator'], resolved['include_header']
+    )
+
+    if _is_autocad_export(columns):
+        set_export_watermarks(conn, change_seqs, per_dwg)
+
+    return {
+        'output_path': str(output_path),
+        'desenhos_exported': sum(per_dwg.values()),
+        'changed_only': changed_only
+    }
+
+
+@timed
+def export_all_dwgs(
+    conn,
+    output_dir: str = "output",
+    sort_cols: List[str] = None,
+    orders: Dict[str, List[Any]] = None,
+    changed_only: bool = False,
+    make_zip: bool = False,
+    max_workers: int = EXPORT_MAX_WORKERS,
+    columns: Any = None
+) -> Dict[str, Any]:
+    """
+    Export every DWG to its own ALTERACOES_PARA_AUTOCAD_<dwg>.csv in one pass.
+
+    The table is read once, rows are grouped by dwg_name (keeping the sort
+    order) and the files are written on a thread pool. With changed_only,
+    DWGs without changes still get a header-only file.
+
+    Args:
+        conn: Database connection
+        output_dir: Output folder
+        sort_cols: Optional sort criteria (desenho fields, see sorting.py)
+        orders: Optional dict field -> custom value order
+        changed_only: Only desenhos changed since the last export of their DWG
+        make_zip: Also pack all files into one zip (ALTERACOES_PARA_AUTOCAD.zip)
+        max_workers: Writer threads
+        columns: Column set (see export_autocad_csv)
+
+    Returns:
+        Dictionary with stats: files (dwg_name -> path), desenhos_exported,
+        dwgs_exported, zip_path (or None), changed_only
+    """
+    resolved = resolve_columns(columns)
+    spec = resolved['spec']
+    headers = [header for header, _ in spec]
+    sort_cols = [c for c in (sort_cols or []) if c]
+    hidden = list(dict.fromkeys(['dwg_name', *sort_cols]))
+    n = len(spec)
+
+    # Watermarks are read first: changes made while exporting go in the next delta
+    change_seqs = get_dwg_change_seqs(conn)
+
+    rows_by_dwg = {dwg: [] for dwg in change_seqs}
+    for row in _run_export_query(conn, spec, None, changed_only, hidden, sort_cols, orders):
+        rows_by_dwg.setdefault(row[n], []).append(row[:n])
+
+    files = {dwg: str(Path(output_dir) / get_export_filename(dwg, columns)) for dwg in rows_by_dwg}
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    with telemetry.phase('exportar', total=len(files), message=output_dir):
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # Progresso reportado por esta thread (a sessão de telemetria é por thread);
+            # o ciclo re-levanta o primeiro erro de escrita, se houver
+            written = pool.map(
+                lambda dwg: write_export_csv(
+                    rows_by_dwg[dwg], files[dwg], headers, resolved['separator'], resolved['include_header']
+                ),
+                files
+            )
+            for done, (dwg, _) in enumerate(zip(files, written), 1):
+                telemetry.progress(done, dwg)
+                telemetry.count('desenhos', len(rows_by_dwg[dwg]))
+
+    zip_path = None
+    if make_zip:
+        zip_path = str(Path(output_dir) / Path(get_export_filename(None, columns)).with_suffix('.zip'))
+        with telemetry.phase('zip', message=Path(zip_path).name):
+            with atomic_write_path(zip_path) as tmp_path:
+                with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+                    for path in files.values():
+                        zf.write(path, arcname=Path(path).name)
+
+    if _is_autocad_export(columns):
+        set_export_watermarks(conn, change_seqs, {dwg: len(rows) for dwg, rows in rows_by_dwg.items()})
+
+    return {
+        'files': files,
+        'desenhos_exported': sum(len(rows) for rows in rows_by_dwg.values()),
+        'dwgs_exported': len(files),
+        'zip_path': zip_path,
+        'changed_only': changed_only
+    }
@@ -0,0 +1,118 @@
+"""
+DataFrame builders for the Streamlit views.
+
+Only the columns a view needs are read (db.get_desenhos_columns fetches them
+in batches straight into column lists), low-cardinality columns are stored as
+pandas categoricals and columns the views never show (raw_attributes,
+timestamps) are left out, so the main DataFrame is a fraction of the size of
+the plain list-of-dicts conversion.
+"""
+from typing import Iterable, List
+
+import perf
+from db import get_desenhos_columns, get_desenhos_table_columns
+from perf import timed
+from utils import lazy_import
+
+pd = lazy_import("pandas")
+
+
+# Colunas com poucos valores distintos -> categoricals
+CATEGORICAL_COLUMNS = [
+    'tipo_display', 'tipo_key', 'elemento', 'elemento_key', 'estado_interno', 'dwg_name',
+    'fase', 'cliente', 'obra', 'localizacao', 'especialidade', 'projetou', 'escalas',
+    'r', 'data', 'responsavel',
+]
+
+# Colunas que as vistas nunca mostram (raw_attributes é um blob de texto por linha)
+UNUSED_COLUMNS = ['raw_attributes', 'created_at', 'updated_at', 'change_seq']
+
+# Colunas sempre necessárias à vista atual: chaves de edição (id + version
+# para gravar com compare-and-swap), filtros, ordenação, lista de DWGs para
+# exportação e estatísticas
+BASE_COLUMNS = [
+    'id', 'version', 'layout_name', 'dwg_name', 'des_num', 'tipo_display', 'elemento_key',
+    'r', 'estado_interno', 'data_limite',
+]
+
+# Campos internos e respetivo valor por defeito
+INTERNAL_DEFAULTS = {
+    'estado_interno': 'projeto',
+    'comentario': '',
+    'data_limite': '',
+    'responsavel': '',
+}
+
+
+def frame_memory_mb(df) -> float:
+    """Deep memory footprint of a DataFrame in MB."""
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+
+def compact_desenhos_df(df):
+    """
+    Drop unused columns, fill internal defaults and convert low-cardinality
+    columns to categoricals.
+
+    Args:
+        df: DataFrame of desenhos rows
+
+    Returns:
+        Compact DataFrame
+    """
+    df = df.drop(columns=[c for c in UNUSED_COLUMNS if c in df.columns])
+
+    for col, default in INTERNAL_DEFAULTS.items():
+        if col in df.columns:
+            df[col] = df[col].fillna(default)
+
+    for col in CATEGORICAL_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+
+    return df
+
+
+def view_columns(selected: Iterable[str]) -> List[str]:
+    """BASE_COLUMNS followed by the selected view columns (no duplicates)."""
+    return list(dict.fromkeys([*BASE_COLUMNS, *selected]))
+
+
+@timed
+def load_desenhos_df(conn, columns: List[str] = None, measure_memory: bool = False):
+    """
+    Load desenhos into a compact DataFrame.
+
+    Args:
+        conn: Database connection
+        columns: Columns to load (default: every column except UNUSED_COLUMNS);
+            names that are not desenhos columns are ignored
+        measure_memory: Record the memory footprint before/after compaction
+            as perf metrics (costs a deep memory scan)
+
+    Returns:
+        DataFrame (empty if there are no desenhos)
+    """
+    table_columns = get_desenhos_table_columns(conn)
+    if columns is None:
+        columns = [c for c in table_columns if c not in UNUSED_COLUMNS]
+    else:
+        columns = [c for c in columns if c in table_columns]
+
+    data = get_desenhos_columns(conn, columns)
+    if not columns or not data[columns[0]]:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(data, columns=columns)
+    del data
+    if measure_memory:
+        before_mb = frame_memory_mb(df)
+
+    df = compact_desenhos_df(df)
+
+    if measure_memory:
+        after_mb = frame_memory_mb(df)
+        perf.record_metric("Colunas carregadas", f"{len(columns)}/{len(table_columns)}")
+        perf.record_metric("Memória DataFrame", f"{before_mb:.2f} MB → {after_mb:.2f} MB")
+
+    return df
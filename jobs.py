@@ -0,0 +1,262 @@
+"""
+Background jobs - LPP builds and imports off the Streamlit script thread.
+
+A job is a row of the jobs table (db.py) run on a thread pool shared by every
+session of the process:
+    - submit_job() queues it; an identical job (same kind and params) that
+      is already queued or running is reused instead (partial unique index)
+    - the task runs in a telemetry session whose ProgressSink stores the
+      phase/progress in the job row (on a connection of its own, at most
+      every JOB_PROGRESS_MIN_INTERVAL_S per phase); the same call raises
+      JobCancelled once cancel_job() was requested
+    - outputs are written atomically (utils.atomic_write_path), so a
+      cancelled or crashed build never leaves a half-written LPP.xlsx
+Jobs left queued/running by a process that no longer exists are marked
+failed the next time the job list is read.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import telemetry
+from db import (
+    JOB_ACTIVE_STATUSES, create_job, finish_job, get_connection, get_job, get_jobs, is_busy_error,
+    prewarm_historico_snapshots, request_job_cancel, start_job, update_job_progress
+)
+
+
+# Tarefas em simultâneo por processo
+JOB_MAX_WORKERS = 2
+
+# Intervalo mínimo entre gravações de progresso da mesma fase (cada uma é um commit)
+JOB_PROGRESS_MIN_INTERVAL_S = 0.5
+
+# Processo dono das tarefas que submete
+OWNER = f"{socket.gethostname()}:{os.getpid()}"
+
+# Nomes mostrados na UI / CLI
+JOB_LABELS = {
+    'build_lpp': "Gerar LPP",
+    'import_csv': "Importar CSV",
+    'import_json': "Importar JSON",
+    'import_csv_file': "Importar ficheiro CSV",
+}
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+class JobCancelled(Exception):
+    """Raised inside a task when its job was cancelled."""
+
+
+def _task_build_lpp(conn, template_path: str, output_path: str) -> Dict[str, Any]:
+    from lpp_builder import build_lpp_from_db
+
+    stats = build_lpp_from_db(template_path, output_path, conn)
+    if stats is None:
+        raise ValueError(f"Template inválido ou inexistente: {template_path}")
+    return stats
+
+
+def _after_import(conn, stats: Dict[str, Any]) -> Dict[str, Any]:
+    """Rebuild the history snapshots the import invalidated ("Ver Histórico" stays instant)."""
+    stats['historico_snapshots'] = prewarm_historico_snapshots(conn)
+    return stats
+
+
+def _task_import_csv(conn, csv_dir: str, engine: str = 'python') -> Dict[str, Any]:
+    from csv_importer import import_all_csv
+
+    return _after_import(conn, import_all_csv(csv_dir, conn, engine))
+
+
+def _task_import_json(conn, json_dir: str) -> Dict[str, Any]:
+    from json_importer import import_all_json
+
+    return _after_import(conn, import_all_json(json_dir, conn))
+
+
+def _task_import_csv_file(conn, path: str, engine: str = 'python') -> Dict[str, Any]:
+    from csv_importer import import_single_csv
+
+    return _after_import(conn, import_single_csv(path, conn, engine))
+
+
+# kind -> task(conn, **params) -> result dict (progress via telemetry)
+JOB_TASKS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    'build_lpp': _task_build_lpp,
+    'import_csv': _task_import_csv,
+    'import_json': _task_import_json,
+    'import_csv_file': _task_import_csv_file,
+}
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="job")
+        return _executor
+
+
+def _run_job(job_id: int, kind: str, params: Dict[str, Any]):
+    """Worker thread body: run one job with its own connection and record the outcome."""
+    conn = get_connection()
+    # O commit do progresso nunca pode gravar a meio uma transação da tarefa
+    progress_conn = get_connection()
+    try:
+        if not start_job(conn, job_id):
+            return  # cancelled before it started
+
+        last_write = {'phase': None, 'at': 0.0}
+
+        def progress(phase: str, fraction: float, message: str = None):
+            now = time.monotonic()
+            if (phase == last_write['phase'] and fraction < 1.0
+                    and now - last_write['at'] < JOB_PROGRESS_MIN_INTERVAL_S):
+                return
+            last_write.update(phase=phase, at=now)
+            try:
+                cancelled = update_job_progress(progress_conn, job_id, phase, fraction, message)
+            except sqlite3.OperationalError as e:
+                if not is_busy_error(e):
+                    raise
+                return  # o progresso é só informativo: fica para a próxima gravação
+            if cancelled:
+                raise JobCancelled()
+
+        try:
+            sinks = [telemetry.ProgressSink(progress)]
+            if telemetry.TELEMETRY_LOG:
+                sinks.append(telemetry.JsonlSink(telemetry.TELEMETRY_LOG))
+            with telemetry.session(*sinks):
+                result = JOB_TASKS[kind](conn, **params)
+        except JobCancelled:
+            conn.rollback()
+            finish_job(conn, job_id, 'cancelled')
+        except Exception as e:
+            conn.rollback()
+            finish_job(conn, job_id, 'failed', error=f"{type(e).__name__}: {e}")
+        else:
+            finish_job(conn, job_id, 'done', result=result)
+    finally:
+        progress_conn.close()
+        conn.close()
+
+
+def submit_job(kind: str, params: Dict[str, Any]) -> Tuple[int, bool]:
+    """
+    Queue a job, or return the identical job already queued/running.
+
+    Args:
+        kind: Job kind (key of JOB_TASKS)
+        params: Task arguments (JSON-serializable)
+
+    Returns:
+        (job_id, created)
+    """
+    if kind not in JOB_TASKS:
+        raise ValueError(f"Tipo de tarefa desconhecido: {kind}")
+
+    conn = get_connection()
+    try:
+        recover_stale_jobs(conn)
+        job_id, created = create_job(conn, kind, params, OWNER)
+    finally:
+        conn.close()
+
+    if created:
+        _get_executor().submit(_run_job, job_id, kind, params)
+    return job_id, created
+
+
+def cancel_job(job_id: int) -> bool:
+    """
+    Request cancellation of a job (a running task stops at its next stored progress update).
+
+    Returns:
+        True if the job was still queued/running
+    """
+    conn = get_connection()
+    try:
+        return request_job_cancel(conn, job_id)
+    finally:
+        conn.close()
+
+
+def _pid_alive(pid: int) -> bool:
+    """True if a process with this pid exists on this machine."""
+    if os.name == 'nt':
+        # os.kill(pid, 0) would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        exit_code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code))
+        kernel32.CloseHandle(handle)
+        return exit_code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def recover_stale_jobs(conn) -> int:
+    """
+    Mark as failed the active jobs whose owner process (on this host) is gone.
+
+    Returns:
+        Number of jobs marked failed
+    """
+    host = socket.gethostname()
+    recovered = 0
+    for job in get_jobs(conn, limit=100, active_only=True):
+        owner_host, _, pid = (job['owner'] or '').rpartition(':')
+        if job['owner'] == OWNER or owner_host != host or not pid.isdigit():
+            continue
+        if not _pid_alive(int(pid)):
+            finish_job(conn, job['id'], 'failed', error="Interrompida: o processo terminou")
+            recovered += 1
+    return recovered
+
+
+def list_jobs(conn, limit: int = 10) -> List[Dict[str, Any]]:
+    """Most recent jobs (newest first), after recovering stale ones."""
+    recover_stale_jobs(conn)
+    return get_jobs(conn, limit)
+
+
+def wait_for_job(job_id: int, timeout: float = None, poll_interval: float = 0.2) -> Dict[str, Any]:
+    """
+    Block until a job is no longer queued/running (CLI / scripts).
+
+    Args:
+        job_id: Job ID
+        timeout: Seconds to wait (None = forever)
+        poll_interval: Seconds between checks
+
+    Returns:
+        The job dict (possibly still active if the timeout expired)
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    conn = get_connection()
+    try:
+        while True:
+            job = get_job(conn, job_id)
+            if job is None or job['status'] not in JOB_ACTIVE_STATUSES:
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(poll_interval)
+    finally:
+        conn.close()
@@ -1,129 +1,292 @@
 """
 JSON importer - reads JSON files from data/json_in/ and imports to database.
+
+Files are processed one at a time and written in bounded batches (one
+transaction per batch), so memory does not grow with the folder and a bad
+file only fails its own batch. Two layouts are accepted:
+    *.json              {"dwg_name": ..., "desenhos": [...]} (LISP export)
+    *.ndjson / *.jsonl  one drawing per line, streamed line by line:
+                        {"dwg_name": ..., "layout_name": ..., "attributes": {...}, "revisoes": [...]}
 """
 import json
 import os
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import Iterable, Iterator, List, Dict, Any, Optional, Tuple
 
-from db import upsert_desenho, replace_revisoes
+from db import DESENHO_DATA_FIELDS, WRITES_COUNTER, bulk_sync_revisoes, bulk_upsert_desenhos, retry_on_busy
+from perf import timed
+import telemetry
 from utils import normalize_tipo_display_to_key, normalize_elemento_to_key
 
 
-def load_all_json_files(json_dir: str) -> List[Dict[str, Any]]:
+# Desenhos escritos por transação
+JSON_BATCH_SIZE = 1000
+
+NDJSON_SUFFIXES = ['.ndjson', '.jsonl']
+JSON_SUFFIXES = ['.json', *NDJSON_SUFFIXES]
+
+
+def iter_json_desenhos(json_path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
     """
-    Load all .json files from directory.
-    
+    Yield (dwg_name, desenho) from a JSON or NDJSON file.
+
+    A .json file is parsed as a whole (one file in memory at a time); NDJSON
+    is read one line at a time.
+
     Args:
-        json_dir: Path to directory containing JSON files
-        
+        json_path: Path to .json / .ndjson / .jsonl file
+
     Returns:
-        List of parsed JSON objects
+        Iterator of (dwg_name, desenho dict with layout_name/attributes/revisoes)
     """
-    json_objects = []
-    json_path = Path(json_dir)
-    
-    if not json_path.exists():
-        print(f"Warning: Directory {json_dir} does not exist")
-        return json_objects
-    
-    for json_file in json_path.glob("*.json"):
-        try:
-            with open(json_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                json_objects.append(data)
-                print(f"Loaded: {json_file.name}")
-        except Exception as e:
-            print(f"Error loading {json_file.name}: {e}")
-    
-    return json_objects
+    if Path(json_path).suffix.lower() in NDJSON_SUFFIXES:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            for line_num, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    desenho = json.loads(line)
+                except ValueError as e:
+                    raise ValueError(f"{Path(json_path).name}, linha {line_num}: {e}") from e
+                yield desenho.get('dwg_name', 'UNKNOWN'), desenho
+        return
+
+    with open(json_path, 'r', encoding='utf-8') as f:
+        json_obj = json.load(f)
+    dwg_name = json_obj.get('dwg_name', 'UNKNOWN')
+    for desenho in json_obj.get('desenhos', []):
+        yield dwg_name, desenho
+
+
+def build_desenho_data(dwg_name: str, desenho: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Map one JSON desenho to desenhos fields.
+
+    Args:
+        dwg_name: DWG the desenho belongs to
+        desenho: Dict with layout_name, attributes and revisoes
+
+    Returns:
+        Dictionary with desenho fields, or None if there is no layout_name
+    """
+    layout_name = desenho.get('layout_name', '')
+    attributes = desenho.get('attributes', {})
+
+    if not layout_name:
+        return None
+
+    # Extract main fields from attributes
+    tipo_display = attributes.get('TIPO', '')
+    tipo_key = normalize_tipo_display_to_key(tipo_display)
+
+    elemento_raw = attributes.get('ELEMENTO', '')
+    elemento_key = normalize_elemento_to_key(elemento_raw)
 
+    return {
+        'layout_name': layout_name,
+        'dwg_name': dwg_name,
+        'cliente': attributes.get('CLIENTE', ''),
+        'obra': attributes.get('OBRA', ''),
+        'localizacao': attributes.get('LOCALIZACAO', ''),
+        'especialidade': attributes.get('ESPECIALIDADE', ''),
+        'fase': attributes.get('FASE', ''),
+        'projetou': attributes.get('PROJETOU', ''),
+        'escalas': attributes.get('ESCALAS', ''),
+        'tipo_display': tipo_display,
+        'tipo_key': tipo_key,
+        'elemento_titulo': attributes.get('ELEMENTO_TITULO', ''),
+        'elemento_key': elemento_key,
+        'des_num': attributes.get('DES_NUM', ''),
+        'r': attributes.get('R', ''),
+        'data': attributes.get('DATA', ''),
+        'id_cad': attributes.get('ID_CAD', ''),
+        'raw_attributes': json.dumps(attributes, ensure_ascii=False)
+    }
+
+
+@retry_on_busy
+def write_desenhos_batch(conn, batch: List[Tuple[Dict[str, Any], List[Dict[str, str]]]]):
+    """
+    Write one batch of desenhos and their revisoes in a single transaction
+    (run again with backoff if the database stays locked, see db.retry_on_busy).
+
+    Args:
+        conn: Database connection
+        batch: List of (desenho_data, revisoes); revisoes use rev_code/rev,
+            rev_date/data, rev_desc/desc keys as in replace_revisoes
+    """
+    try:
+        ids = bulk_upsert_desenhos(
+            conn,
+            [(data['layout_name'], *(data.get(field, '') for field in DESENHO_DATA_FIELDS)) for data, _ in batch],
+            commit=False
+        )
+        # Layout repetido: ficam as revisões da última ocorrência
+        revisoes_by_desenho = {}
+        for data, revisoes in batch:
+            revisoes_by_desenho[ids[(data['layout_name'], data['dwg_name'])]] = [
+                (
+                    rev.get('rev_code', rev.get('rev', '')),
+                    rev.get('rev_date', rev.get('data', '')),
+                    rev.get('rev_desc', rev.get('desc', '')),
+                )
+                for rev in revisoes
+            ]
+        bulk_sync_revisoes(conn, revisoes_by_desenho, commit=False)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+@timed(rows=True)
+def import_desenhos(
+    conn,
+    desenhos: Iterable[Tuple[str, Dict[str, Any]]],
+    batch_size: int = JSON_BATCH_SIZE
+) -> int:
+    """
+    Import (dwg_name, desenho) pairs in batches of batch_size.
+
+    Batches already written stay committed if a later one fails (the
+    exception is re-raised after rolling back the failing batch).
+
+    Args:
+        conn: Database connection
+        desenhos: Iterable of (dwg_name, desenho), e.g. iter_json_desenhos()
+        batch_size: Desenhos per transaction
+
+    Returns:
+        Number of desenhos imported
+    """
+    count = 0
+    batch = []
 
+    for dwg_name, desenho in desenhos:
+        desenho_data = build_desenho_data(dwg_name, desenho)
+        if desenho_data is None:
+            telemetry.count('sem_layout')
+            continue
+        batch.append((desenho_data, desenho.get('revisoes', [])))
+
+        if len(batch) >= batch_size:
+            write_desenhos_batch(conn, batch)
+            count += len(batch)
+            telemetry.count('desenhos', len(batch))
+            telemetry.detail(f"  Imported: {count} desenhos")
+            batch = []
+
+    if batch:
+        write_desenhos_batch(conn, batch)
+        count += len(batch)
+        telemetry.count('desenhos', len(batch))
+        telemetry.detail(f"  Imported: {count} desenhos")
+
+    return count
+
+
+@timed(rows=True)
 def import_json_to_db(json_obj: Dict[str, Any], conn) -> int:
     """
     Import one JSON object into database.
-    
+
     Args:
         json_obj: Parsed JSON with dwg_name and desenhos[]
         conn: Database connection
-        
+
     Returns:
         Number of desenhos imported
     """
     dwg_name = json_obj.get('dwg_name', 'UNKNOWN')
-    desenhos = json_obj.get('desenhos', [])
-    
-    count = 0
-    
-    for desenho in desenhos:
-        layout_name = desenho.get('layout_name', '')
-        attributes = desenho.get('attributes', {})
-        revisoes = desenho.get('revisoes', [])
-        
-        if not layout_name:
-            print("Warning: Desenho without layout_name, skipping")
-            continue
-        
-        # Extract main fields from attributes
-        tipo_display = attributes.get('TIPO', '')
-        tipo_key = normalize_tipo_display_to_key(tipo_display)
-        
-        elemento_raw = attributes.get('ELEMENTO', '')
-        elemento_key = normalize_elemento_to_key(elemento_raw)
-        
-        # Prepare desenho data
-        desenho_data = {
-            'layout_name': layout_name,
-            'dwg_name': dwg_name,
-            'cliente': attributes.get('CLIENTE', ''),
-            'obra': attributes.get('OBRA', ''),
-            'localizacao': attributes.get('LOCALIZACAO', ''),
-            'especialidade': attributes.get('ESPECIALIDADE', ''),
-            'fase': attributes.get('FASE', ''),
-            'projetou': attributes.get('PROJETOU', ''),
-            'escalas': attributes.get('ESCALAS', ''),
-            'tipo_display': tipo_display,
-            'tipo_key': tipo_key,
-            'elemento_titulo': attributes.get('ELEMENTO_TITULO', ''),
-            'elemento_key': elemento_key,
-            'des_num': attributes.get('DES_NUM', ''),
-            'r': attributes.get('R', ''),
-            'data': attributes.get('DATA', ''),
-            'raw_attributes': json.dumps(attributes, ensure_ascii=False)
-        }
-        
-        # Upsert desenho
-        desenho_id = upsert_desenho(conn, desenho_data)
-        
-        # Replace revisoes
-        replace_revisoes(conn, desenho_id, revisoes)
-        
-        count += 1
-        print(f"  Imported: {layout_name} (ID: {desenho_id})")
-    
-    return count
+    return import_desenhos(conn, ((dwg_name, desenho) for desenho in json_obj.get('desenhos', [])))
+
+
+@timed(rows=True)
+def import_json_file(json_path: str, conn, batch_size: int = JSON_BATCH_SIZE) -> int:
+    """
+    Import one .json / .ndjson / .jsonl file in batches.
+
+    Args:
+        json_path: Path to the file
+        conn: Database connection
+        batch_size: Desenhos per transaction
+
+    Returns:
+        Number of desenhos imported
+    """
+    return import_desenhos(conn, iter_json_desenhos(json_path), batch_size)
 
 
-def import_all_json(json_dir: str, conn) -> Dict[str, int]:
+@timed
+def import_all_json(
+    json_dir: str,
+    conn,
+    batch_size: int = JSON_BATCH_SIZE
+) -> Dict[str, Any]:
     """
-    Import all JSON files from directory into database.
-    
+    Import all JSON/NDJSON files from directory into database, one file at a time.
+
+    A file that fails to parse or write is reported in errors; its earlier
+    batches stay committed and the remaining files are still imported.
+    Reported as telemetry phase 'importar', one progress step per file.
+
     Args:
         json_dir: Path to directory with JSON files
         conn: Database connection
-        
+        batch_size: Desenhos per transaction
+
     Returns:
-        Dictionary with stats: files_processed, desenhos_imported
-    """
-    json_objects = load_all_json_files(json_dir)
-    
-    total_desenhos = 0
-    
-    for json_obj in json_objects:
-        count = import_json_to_db(json_obj, conn)
-        total_desenhos += count
-    
+        Dictionary with stats: files_processed, desenhos_imported,
+        db_writes (rows inserted/updated/deleted by the import's own
+        statements, not by triggers), errors (file -> message)
+    """
+    json_path = Path(json_dir)
+    stats = {'files_processed': 0, 'desenhos_imported': 0, 'db_writes': 0, 'errors': {}}
+
+    if not json_path.exists():
+        telemetry.warning(f"Directory {json_dir} does not exist")
+        return stats
+
+    json_files = [f for f in sorted(json_path.iterdir()) if f.suffix.lower() in JSON_SUFFIXES]
+    with telemetry.phase('importar', total=len(json_files), message=json_dir) as phase_state:
+        for i, json_file in enumerate(json_files):
+            telemetry.progress(i, json_file.name)
+            try:
+                stats['desenhos_imported'] += import_json_file(str(json_file), conn, batch_size)
+                stats['files_processed'] += 1
+                telemetry.count('ficheiros')
+            except Exception as e:
+                telemetry.warning(f"Error loading {json_file.name}: {e}")
+                telemetry.count('erros')
+                stats['errors'][json_file.name] = str(e)
+        telemetry.progress(len(json_files))
+
+    stats['db_writes'] = phase_state['counters'].get(WRITES_COUNTER, 0)
+    return stats
+
+
+@timed
+def import_single_json(json_path: str, conn, batch_size: int = JSON_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Import a single JSON/NDJSON file into database.
+
+    Args:
+        json_path: Path to JSON file
+        conn: Database connection
+        batch_size: Desenhos per transaction
+
+    Returns:
+        Dictionary with stats
+    """
+    if not Path(json_path).exists():
+        return {'files_processed': 0, 'desenhos_imported': 0, 'db_writes': 0, 'error': 'File not found'}
+
+    with telemetry.phase('importar', total=1, message=Path(json_path).name) as phase_state:
+        count = import_json_file(json_path, conn, batch_size)
+        telemetry.count('ficheiros')
+
     return {
-        'files_processed': len(json_objects),
-        'desenhos_imported': total_desenhos
+        'files_processed': 1,
+        'desenhos_imported': count,
+        'db_writes': phase_state['counters'].get(WRITES_COUNTER, 0)
     }
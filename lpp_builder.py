@@ -3,11 +3,12 @@ LPP Builder - generates/updates LPP.xlsx from database using template.
 """
 from pathlib import Path
 from typing import Dict, List, Tuple, Any
-from openpyxl import load_workbook, Workbook
-from openpyxl.styles import PatternFill, Font, Alignment
 from collections import defaultdict
 
 from db import get_all_desenhos
+from perf import timed
+import telemetry
+from utils import atomic_write_path
 
 
 def find_header_row(sheet) -> int:
@@ -54,7 +55,7 @@ def find_elemento_anchors(sheet, header_row: int, col_indices: Dict[str, int]) -
     elemento_key_col = col_indices.get('ELEMENTO_KEY')
     
     if not all([row_kind_col, tipo_key_col, elemento_key_col]):
-        print("Warning: Missing required columns (ROW_KIND, TIPO_KEY, ELEMENTO_KEY)")
+        telemetry.warning("Missing required columns (ROW_KIND, TIPO_KEY, ELEMENTO_KEY)")
         return anchors
     
     # Start searching after header
@@ -161,75 +162,96 @@ def insert_desenho_rows(sheet, anchor_row: int, desenhos: List[Dict[str, Any]],
         insert_row += 1
 
 
+@timed
 def build_lpp_from_db(template_path: str, output_path: str, conn):
     """
     Generate LPP.xlsx from database using template.
     
+    The output is written atomically: an interrupted or cancelled build
+    leaves the previous LPP.xlsx untouched. Reported as telemetry phases
+    'template', 'desenhos', 'âncoras' (one progress step per anchor) and
+    'gravar'.
+    
     Args:
         template_path: Path to LPP_TEMPLATE.xlsx
         output_path: Path to output LPP.xlsx
         conn: Database connection
+        
+    Returns:
+        Dictionary with stats: output_path, anchors, desenhos (None if the
+        template is missing or invalid)
     """
     # Load template
     if not Path(template_path).exists():
-        print(f"Error: Template not found at {template_path}")
-        return
-    
-    wb = load_workbook(template_path)
-    sheet = wb.active  # Assume first sheet
-    
-    # Find header row
-    header_row = find_header_row(sheet)
-    if not header_row:
-        print("Error: Could not find header row with 'Nº.' and 'DESIGNAÇÃO'")
-        return
-    
-    print(f"Header row found at: {header_row}")
-    
-    # Get column indices
-    col_indices = get_column_indices(sheet, header_row)
-    print(f"Columns found: {list(col_indices.keys())}")
-    
-    # Find ELEMENTO anchors
-    anchors = find_elemento_anchors(sheet, header_row, col_indices)
-    print(f"Found {len(anchors)} ELEMENTO anchors")
-    
-    # Get all desenhos from DB
-    all_desenhos = get_all_desenhos(conn)
-    print(f"Loaded {len(all_desenhos)} desenhos from database")
+        telemetry.warning(f"Template not found at {template_path}")
+        return None
     
-    # Group desenhos by (tipo_key, elemento_key)
-    desenhos_by_key = defaultdict(list)
-    for desenho in all_desenhos:
-        key = (desenho['tipo_key'], desenho['elemento_key'])
-        desenhos_by_key[key].append(desenho)
+    # openpyxl is only needed here; importing it lazily keeps app/CLI start-up fast
+    from openpyxl import load_workbook
     
-    # Process each anchor
-    for anchor in anchors:
-        tipo_key = anchor['tipo_key']
-        elemento_key = anchor['elemento_key']
-        row_index = anchor['row_index']
+    with telemetry.phase('template', message=Path(template_path).name):
+        wb = load_workbook(template_path)
+        sheet = wb.active  # Assume first sheet
         
-        print(f"\nProcessing anchor at row {row_index}: TIPO={tipo_key}, ELEMENTO={elemento_key}")
+        # Find header row
+        header_row = find_header_row(sheet)
+        if not header_row:
+            telemetry.warning("Could not find header row with 'Nº.' and 'DESIGNAÇÃO'")
+            return None
         
-        # Delete existing DESENHO rows
-        deleted = delete_desenho_rows(sheet, row_index, tipo_key, elemento_key, col_indices)
-        print(f"  Deleted {deleted} existing rows")
+        telemetry.detail(f"Header row found at: {header_row}")
         
-        # Get desenhos for this anchor
-        key = (tipo_key, elemento_key)
-        desenhos = desenhos_by_key.get(key, [])
+        # Get column indices
+        col_indices = get_column_indices(sheet, header_row)
+        telemetry.detail(f"Columns found: {list(col_indices.keys())}")
         
-        if desenhos:
-            # Insert new desenho rows
-            insert_desenho_rows(sheet, row_index, desenhos, col_indices)
-            print(f"  Inserted {len(desenhos)} new rows")
-        else:
-            print(f"  No desenhos found for this anchor")
+        # Find ELEMENTO anchors
+        anchors = find_elemento_anchors(sheet, header_row, col_indices)
+        telemetry.count('âncoras', len(anchors))
+    
+    # Get all desenhos from DB
+    with telemetry.phase('desenhos'):
+        all_desenhos = get_all_desenhos(conn)
+        telemetry.count('desenhos', len(all_desenhos))
+        
+        # Group desenhos by (tipo_key, elemento_key)
+        desenhos_by_key = defaultdict(list)
+        for desenho in all_desenhos:
+            key = (desenho['tipo_key'], desenho['elemento_key'])
+            desenhos_by_key[key].append(desenho)
+    
+    # Process each anchor
+    with telemetry.phase('âncoras', total=len(anchors)):
+        for i, anchor in enumerate(anchors):
+            tipo_key = anchor['tipo_key']
+            elemento_key = anchor['elemento_key']
+            row_index = anchor['row_index']
+            telemetry.progress(i, f"{tipo_key} / {elemento_key}")
+            
+            telemetry.detail(f"Processing anchor at row {row_index}: TIPO={tipo_key}, ELEMENTO={elemento_key}")
+            
+            # Delete existing DESENHO rows
+            deleted = delete_desenho_rows(sheet, row_index, tipo_key, elemento_key, col_indices)
+            telemetry.count('linhas_removidas', deleted)
+            
+            # Get desenhos for this anchor
+            key = (tipo_key, elemento_key)
+            desenhos = desenhos_by_key.get(key, [])
+            
+            if desenhos:
+                # Insert new desenho rows
+                insert_desenho_rows(sheet, row_index, desenhos, col_indices)
+                telemetry.count('linhas_inseridas', len(desenhos))
+                telemetry.detail(f"  Deleted {deleted}, inserted {len(desenhos)} rows")
+            else:
+                telemetry.count('âncoras_vazias')
+                telemetry.detail(f"  Deleted {deleted} rows, no desenhos found for this anchor")
+        telemetry.progress(len(anchors))
     
     # Save output
-    output_path_obj = Path(output_path)
-    output_path_obj.parent.mkdir(parents=True, exist_ok=True)
+    with telemetry.phase('gravar', message=Path(output_path).name):
+        with atomic_write_path(output_path) as tmp_path:
+            wb.save(tmp_path)
+    telemetry.info(f"LPP saved to: {output_path}")
     
-    wb.save(output_path)
-    print(f"\nLPP saved to: {output_path}")
+    return {'output_path': output_path, 'anchors': len(anchors), 'desenhos': len(all_desenhos)}
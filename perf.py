@@ -0,0 +1,163 @@
+"""
+Performance instrumentation - wall time, row counts and call counts per Streamlit rerun.
+
+db.py, the importers, lpp_builder and exporter decorate their functions with
+@timed; app.py marks its sections with lap()/section(). Nothing is recorded
+unless start_run() was called in the current thread, so CLI/batch use pays
+only a flag check.
+"""
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+_state = threading.local()
+
+
+def start_run():
+    """Start collecting timings for a new run (one Streamlit rerun) in this thread."""
+    _state.records = {}
+    _state.metrics = {}
+    _state.started = time.perf_counter()
+    _state.last_lap = _state.started
+
+
+def is_active() -> bool:
+    """True if a run is being collected in this thread."""
+    return getattr(_state, 'records', None) is not None
+
+
+def get_records() -> Dict[str, Dict[str, Any]]:
+    """
+    Get timings of the current run.
+
+    Returns:
+        Dict name -> {'calls', 'total_ms', 'rows'}
+    """
+    return dict(getattr(_state, 'records', None) or {})
+
+
+def get_metrics() -> Dict[str, Any]:
+    """Get free-form metrics of the current run (e.g. DataFrame memory)."""
+    return dict(getattr(_state, 'metrics', None) or {})
+
+
+def get_run_ms() -> float:
+    """Wall time since start_run()."""
+    if not is_active():
+        return 0.0
+    return (time.perf_counter() - _state.started) * 1000.0
+
+
+def record(name: str, elapsed_ms: float, rows: Optional[int] = None):
+    """
+    Add one call of `name` to the current run.
+
+    Args:
+        name: Function or section name
+        elapsed_ms: Wall time of the call
+        rows: Optional number of rows returned/processed
+    """
+    records = getattr(_state, 'records', None)
+    if records is None:
+        return
+
+    entry = records.get(name)
+    if entry is None:
+        entry = records[name] = {'calls': 0, 'total_ms': 0.0, 'rows': None}
+    entry['calls'] += 1
+    entry['total_ms'] += elapsed_ms
+    if rows is not None:
+        entry['rows'] = (entry['rows'] or 0) + rows
+
+
+def record_metric(name: str, value: Any):
+    """Store a free-form metric for the current run."""
+    metrics = getattr(_state, 'metrics', None)
+    if metrics is not None:
+        metrics[name] = value
+
+
+def _count_rows(result: Any) -> Optional[int]:
+    """
+    Row count of a function result: len() of a sequence / DataFrame, or the
+    desenhos_imported / desenhos_exported count of a stats dict. Other
+    results (ids, bare ints, strings) are not rows.
+    """
+    if result is None or isinstance(result, (bool, int, float, str, bytes)):
+        return None
+    if isinstance(result, dict):
+        for key in ('desenhos_imported', 'desenhos_exported'):
+            if key in result:
+                return result[key]
+        return None
+    if hasattr(result, '__len__'):
+        return len(result)
+    return None
+
+
+def timed(func: Callable = None, *, name: str = None, rows: bool = False):
+    """
+    Decorator recording wall time, call count and returned rows of func.
+
+    Usage:
+        @timed
+        def get_all_desenhos(conn): ...
+
+        @timed(rows=True)
+        def delete_all_desenhos(conn) -> int: ...
+
+    Args:
+        name: Label (default module.function)
+        rows: The int result is the number of rows processed (bare ints,
+            e.g. ids, are not counted otherwise)
+    """
+    if func is None:
+        return lambda f: timed(f, name=name, rows=rows)
+
+    label = name or f"{func.__module__}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if getattr(_state, 'records', None) is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        count = result if rows and isinstance(result, int) else _count_rows(result)
+        record(label, (time.perf_counter() - start) * 1000.0, count)
+        return result
+
+    return wrapper
+
+
+@contextmanager
+def section(name: str):
+    """
+    Time a block of code. The yielded dict accepts an optional 'rows' count.
+
+    Usage:
+        with section("app.load_data") as s:
+            df = load_data()
+            s['rows'] = len(df)
+    """
+    info = {'rows': None}
+    start = time.perf_counter()
+    try:
+        yield info
+    finally:
+        record(name, (time.perf_counter() - start) * 1000.0, info['rows'])
+
+
+def lap(name: str, rows: Optional[int] = None):
+    """
+    Record the time since the previous lap (or start_run) under `name`.
+
+    Lets a long script be split into sections without re-indenting it.
+    """
+    if not is_active():
+        return
+    now = time.perf_counter()
+    record(name, (now - _state.last_lap) * 1000.0, rows)
+    _state.last_lap = now
@@ -0,0 +1,266 @@
+"""
+Result cache - results of expensive reads shared by every session and process.
+
+Entries live in a SQLite file next to the database (cache.db), so every
+Streamlit session and every app process on the machine reuses them:
+    - key: function, database file and arguments (plus an optional `vary`
+      value, e.g. today's date); an entry is only valid for the data
+      version it was computed at (db.get_data_version: a counter bumped by
+      triggers on every write to the tables the cached reads depend on)
+    - values are pickled; the file stays under CACHE_MAX_BYTES by evicting
+      the least recently used entries
+    - hits, misses, stores and evictions are counted per function (cache_stats)
+An error of the cache itself never fails the call: the function just runs.
+Connections that are not on a database file (the in-memory copy made by
+db.open_read_snapshot without WAL) bypass the cache.
+"""
+import functools
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+# Cache ligado (JSJ_CACHE=0 desliga)
+CACHE_ENABLED = os.environ.get('JSJ_CACHE', '1') != '0'
+
+# Tamanho máximo dos valores guardados (MB, env JSJ_CACHE_MAX_MB)
+CACHE_MAX_BYTES = int(float(os.environ.get('JSJ_CACHE_MAX_MB', '256')) * 1024 * 1024)
+
+# Nome do ficheiro de cache, na pasta da base de dados
+CACHE_FILENAME = "cache.db"
+
+# Espera curta por locks: um cache ocupado não deve atrasar a página
+CACHE_BUSY_TIMEOUT_S = 1.0
+
+_initialized = set()
+
+
+def cache_path_for(db_path: str) -> Path:
+    """Cache file used for a database file (same folder)."""
+    return Path(db_path).resolve().parent / CACHE_FILENAME
+
+
+def _connect(cache_path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(cache_path), timeout=CACHE_BUSY_TIMEOUT_S)
+    if cache_path not in _initialized:
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                function TEXT NOT NULL,
+                data_version TEXT NOT NULL,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_used ON entries(last_used)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS stats (
+                function TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0,
+                stores INTEGER NOT NULL DEFAULT 0,
+                evictions INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        conn.commit()
+        _initialized.add(cache_path)
+    # Um cache perdido num crash do SO só custa recalcular
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+
+def _database_file(conn) -> str:
+    """Path of the main database of conn ('' for in-memory databases)."""
+    return conn.execute("PRAGMA database_list").fetchone()[2] or ''
+
+
+def _count(cache, function: str, column: str, n: int = 1):
+    cache.execute(
+        f"""INSERT INTO stats (function, {column}) VALUES (?, ?)
+            ON CONFLICT(function) DO UPDATE SET {column} = {column} + excluded.{column}""",
+        (function, n)
+    )
+
+
+def _evict(cache, max_bytes: int) -> Dict[str, int]:
+    """Delete least recently used entries until the values fit in max_bytes; evictions per function."""
+    total = cache.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+    evicted: Dict[str, int] = {}
+    if total <= max_bytes:
+        return evicted
+    for key, function, size in cache.execute(
+        "SELECT key, function, size FROM entries ORDER BY last_used"
+    ).fetchall():
+        cache.execute("DELETE FROM entries WHERE key = ?", (key,))
+        evicted[function] = evicted.get(function, 0) + 1
+        total -= size
+        if total <= max_bytes:
+            break
+    return evicted
+
+
+def _call(cache, key: str, name: str, func: Callable, conn, args, kwargs):
+    """Look key up at conn's data version; on a miss run func and store its result."""
+    from db import get_data_version
+
+    # Versão e resultado lidos na mesma transação: o valor guardado corresponde à versão
+    owns_transaction = not conn.in_transaction
+    if owns_transaction:
+        conn.execute("BEGIN")
+    try:
+        try:
+            token, version = get_data_version(conn)
+            data_version = f"{token}:{version}"
+            row = cache.execute(
+                "SELECT value FROM entries WHERE key = ? AND data_version = ?", (key, data_version)
+            ).fetchone()
+            if row is not None:
+                value = pickle.loads(row[0])
+        except (sqlite3.Error, pickle.UnpicklingError, EOFError, TypeError):
+            data_version = row = None
+
+        if row is not None:
+            try:
+                with cache:
+                    cache.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+                    _count(cache, name, 'hits')
+            except sqlite3.Error:
+                pass
+            return value
+
+        value = func(conn, *args, **kwargs)
+        # Dentro da transação de escrita de outro código a versão inclui escritas por confirmar
+        storable = owns_transaction or conn.execute("PRAGMA query_only").fetchone()[0]
+    finally:
+        if owns_transaction and conn.in_transaction:
+            conn.commit()
+
+    if data_version is None:
+        return value
+    try:
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL) if storable else None
+        with cache:
+            _count(cache, name, 'misses')
+            # Um valor maior que o cache inteiro não se guarda
+            if blob is not None and len(blob) <= CACHE_MAX_BYTES:
+                now = time.time()
+                cache.execute(
+                    """INSERT OR REPLACE INTO entries
+                       (key, function, data_version, value, size, created_at, last_used)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                    (key, name, data_version, blob, len(blob), now, now)
+                )
+                _count(cache, name, 'stores')
+                for function, n in _evict(cache, CACHE_MAX_BYTES).items():
+                    _count(cache, function, 'evictions', n)
+    except (sqlite3.Error, pickle.PicklingError, TypeError):
+        pass
+    return value
+
+
+def cached(func: Callable = None, *, vary: Callable[[], Any] = None):
+    """
+    Cache the result of a read function(conn, ...) in the shared result cache.
+
+    Example:
+        @timed
+        @cached(vary=lambda: datetime.now().strftime('%Y-%m-%d'))
+        def get_stats_by_estado(conn): ...
+
+    Args:
+        func: Function to cache (arguments must be JSON-serializable, the
+            result picklable)
+        vary: Extra key part computed on each call, for results that depend
+            on more than the data (e.g. today's date)
+    """
+    if func is None:
+        return functools.partial(cached, vary=vary)
+
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(conn, *args, **kwargs):
+        if not CACHE_ENABLED:
+            return func(conn, *args, **kwargs)
+        try:
+            db_file = _database_file(conn)
+            if not db_file:
+                return func(conn, *args, **kwargs)
+            key = hashlib.sha256(json.dumps(
+                [name, db_file, args, kwargs, vary() if vary else None], sort_keys=True, default=repr
+            ).encode('utf-8')).hexdigest()
+            cache = _connect(cache_path_for(db_file))
+        except (sqlite3.Error, OSError, TypeError, ValueError):
+            return func(conn, *args, **kwargs)
+
+        try:
+            return _call(cache, key, name, func, conn, args, kwargs)
+        finally:
+            cache.close()
+
+    return wrapper
+
+
+def cache_stats(db_path: str) -> List[Dict[str, Any]]:
+    """
+    Hit rate per cached function since the cache file was created (all processes).
+
+    Args:
+        db_path: Database file whose cache to read
+
+    Returns:
+        List of dicts: function, hits, misses, hit_rate, stores, evictions,
+        entries, bytes (most used first)
+    """
+    cache_path = cache_path_for(db_path)
+    if not cache_path.exists():
+        return []
+    cache = _connect(cache_path)
+    try:
+        rows = cache.execute("""
+            SELECT s.function, s.hits, s.misses, s.stores, s.evictions,
+                   COUNT(e.key), COALESCE(SUM(e.size), 0)
+            FROM stats s
+            LEFT JOIN entries e ON e.function = s.function
+            GROUP BY s.function
+            ORDER BY s.hits + s.misses DESC
+        """).fetchall()
+    finally:
+        cache.close()
+
+    return [
+        {
+            'function': function, 'hits': hits, 'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else None,
+            'stores': stores, 'evictions': evictions, 'entries': entries, 'bytes': size,
+        }
+        for function, hits, misses, stores, evictions, entries, size in rows
+    ]
+
+
+def clear_cache(db_path: str, reset_stats: bool = False) -> int:
+    """
+    Delete every cached result in the cache file of db_path's folder (and optionally the hit counters).
+
+    Returns:
+        Number of entries deleted
+    """
+    cache_path = cache_path_for(db_path)
+    if not cache_path.exists():
+        return 0
+    cache = _connect(cache_path)
+    try:
+        with cache:
+            deleted = cache.execute("DELETE FROM entries").rowcount
+            if reset_stats:
+                cache.execute("DELETE FROM stats")
+    finally:
+        cache.close()
+    return deleted
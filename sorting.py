@@ -0,0 +1,155 @@
+"""
+Sort engine shared by the grid (app.py) and the AutoCAD export.
+
+Every sort column is turned into an integer rank array once (values are
+factorized, only the distinct values are ordered) and the final row order
+comes from a single np.lexsort over those arrays - no per-row Python
+callbacks and no repeated sort_values passes. DES_NUM is ranked in natural
+order ("2" before "10", "E2" before "E10").
+"""
+import re
+from typing import Any, Dict, List, Sequence
+
+from utils import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+# Colunas ordenadas em ordem natural (números dentro do texto comparados como números)
+NATURAL_SORT_COLUMNS = {'des_num'}
+
+_DIGITS_RE = re.compile(r'(\d+)')
+
+
+def natural_key(value: Any) -> List[Any]:
+    """
+    Natural sort key: digit runs compare as integers, text case-insensitively.
+
+    Example:
+        sorted(['E10', 'E2', 'E1'], key=natural_key) -> ['E1', 'E2', 'E10']
+    """
+    # re.split alterna texto/dígitos, por isso as posições comparam sempre str com str e int com int
+    return [int(part) if i % 2 else part.lower() for i, part in enumerate(_DIGITS_RE.split(str(value)))]
+
+
+def sorted_values(values: Sequence[Any], natural: bool = False) -> List[Any]:
+    """
+    Distinct non-null values in sort order.
+
+    Args:
+        values: Any sequence (list, Series, Categorical)
+        natural: Use natural_key ordering
+
+    Returns:
+        Sorted list of unique values
+    """
+    unique = [v for v in pd.unique(pd.Series(values, dtype=object)) if not pd.isna(v)]
+    if natural:
+        return sorted(unique, key=natural_key)
+    try:
+        return sorted(unique)
+    except TypeError:
+        return sorted(unique, key=str)
+
+
+def rank_codes(values: Sequence[Any], order: Sequence[Any] = None, natural: bool = False):
+    """
+    Integer rank of each value.
+
+    Args:
+        values: Column values (a categorical column reuses its codes)
+        order: Optional custom order of values; values not listed rank after
+            them, in normal order
+        natural: Natural ordering for values not covered by `order`
+
+    Returns:
+        numpy int array; missing values get the highest rank (sorted last)
+    """
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        categorical = pd.Series(values).array
+    else:
+        categorical = pd.Categorical(values)
+
+    categories = categorical.categories.tolist()
+    ranked = sorted_values(categories, natural)
+    if order:
+        present = set(categories)
+        custom = [v for v in dict.fromkeys(order) if v in present]
+        custom_set = set(custom)
+        ranked = custom + [v for v in ranked if v not in custom_set]
+
+    rank_of = {v: i for i, v in enumerate(ranked)}
+    # Último elemento = rank dos valores em falta (code -1 indexa o fim do array)
+    category_rank = np.array([rank_of[c] for c in categories] + [len(categories)], dtype=np.int64)
+    return category_rank[categorical.codes]
+
+
+def sort_positions(
+    columns: Dict[str, Sequence[Any]],
+    sort_cols: List[str],
+    orders: Dict[str, Sequence[Any]] = None
+):
+    """
+    Row positions that sort the given columns (stable, first criterion first).
+
+    Args:
+        columns: Dict column -> values (all of the same length)
+        sort_cols: Sort criteria in priority order (missing columns are skipped)
+        orders: Optional dict column -> custom value order
+
+    Returns:
+        numpy array of row positions, or None if there is nothing to sort by
+    """
+    orders = orders or {}
+    keys = [
+        rank_codes(columns[col], orders.get(col), col in NATURAL_SORT_COLUMNS)
+        for col in sort_cols if col and col in columns
+    ]
+    if not keys:
+        return None
+    # np.lexsort usa a última chave como principal
+    return np.lexsort(keys[::-1])
+
+
+def sort_dataframe(df, sort_cols: List[str], orders: Dict[str, Sequence[Any]] = None):
+    """
+    Sort a DataFrame with the shared engine.
+
+    Args:
+        df: DataFrame to sort
+        sort_cols: Sort criteria in priority order
+        orders: Optional dict column -> custom value order
+
+    Returns:
+        Sorted DataFrame (df itself if there is nothing to sort by)
+    """
+    positions = sort_positions({col: df[col] for col in sort_cols if col in df.columns}, sort_cols, orders)
+    if positions is None:
+        return df
+    return df.iloc[positions]
+
+
+def sort_records(
+    records: List[Dict[str, Any]],
+    sort_cols: List[str],
+    orders: Dict[str, Sequence[Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Sort a list of row dictionaries (e.g. desenhos) with the shared engine.
+
+    Args:
+        records: Row dictionaries
+        sort_cols: Sort criteria in priority order
+        orders: Optional dict column -> custom value order
+
+    Returns:
+        New sorted list
+    """
+    if not records:
+        return list(records)
+    columns = {col: [r.get(col) for r in records] for col in sort_cols if col}
+    positions = sort_positions(columns, sort_cols, orders)
+    if positions is None:
+        return list(records)
+    return [records[i] for i in positions]
@@ -0,0 +1,200 @@
+"""
+SQL tracing - slow-query log with automatic EXPLAIN QUERY PLAN capture.
+
+db.get_connection() returns a TracingConnection when a latency threshold is
+set (argument, or JSJ_SQL_TRACE_MS environment variable). Every statement
+slower than the threshold is appended to a JSON-lines log together with its
+query plan; full table scans and temporary B-trees (unindexed ORDER BY /
+GROUP BY) are flagged. summarize_slow_queries() builds the worst-offenders
+report used by `python -m cli slow-queries`.
+"""
+import json
+import re
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+
+SLOW_QUERY_LOG = "data/slow_queries.jsonl"
+
+# Statements for which EXPLAIN QUERY PLAN makes sense
+_EXPLAINABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+
+def normalize_sql(sql: str) -> str:
+    """Collapse whitespace and IN (?, ?, ...) lists so equal statements group together."""
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    return re.sub(r'IN \((\?\s*,\s*)*\?\)', 'IN (?...)', sql, flags=re.IGNORECASE)
+
+
+def explain_query_plan(conn: sqlite3.Connection, sql: str, parameters=()) -> List[str]:
+    """
+    Return the EXPLAIN QUERY PLAN detail lines of a statement (empty if not explainable).
+    """
+    if not sql.lstrip().upper().startswith(_EXPLAINABLE):
+        return []
+    try:
+        cursor = sqlite3.Cursor(conn)
+        sqlite3.Cursor.execute(cursor, f"EXPLAIN QUERY PLAN {sql}", parameters)
+        return [row[3] for row in sqlite3.Cursor.fetchall(cursor)]
+    except sqlite3.Error:
+        return []
+
+
+def analyse_plan(plan: List[str]) -> Dict[str, Any]:
+    """
+    Flag full table scans and temporary B-trees in a query plan.
+
+    Returns:
+        Dict with full_scan (list of scanned tables) and temp_btree (bool)
+    """
+    full_scan = []
+    for detail in plan:
+        # "SCAN desenhos" is a full scan; "SCAN desenhos USING INDEX ..." walks an index
+        match = re.match(r'SCAN (?:TABLE )?(\w+)(.*)', detail)
+        if match and 'USING' not in match.group(2):
+            full_scan.append(match.group(1))
+    return {
+        'full_scan': full_scan,
+        'temp_btree': any('TEMP B-TREE' in detail for detail in plan),
+    }
+
+
+class TracingCursor(sqlite3.Cursor):
+    """Cursor that times execute/executemany (+ fetchall) and logs slow statements."""
+
+    _pending = None
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        result = super().execute(sql, parameters)
+        self._observe(sql, parameters, (time.perf_counter() - start) * 1000.0)
+        return result
+
+    def executemany(self, sql, seq_of_parameters):
+        seq_of_parameters = list(seq_of_parameters)
+        start = time.perf_counter()
+        result = super().executemany(sql, seq_of_parameters)
+        elapsed_ms = (time.perf_counter() - start) * 1000.0
+        self._observe(sql, seq_of_parameters[0] if seq_of_parameters else (), elapsed_ms, len(seq_of_parameters))
+        return result
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = super().fetchall()
+        if self._pending:
+            sql, parameters, elapsed_ms, logged = self._pending
+            total_ms = elapsed_ms + (time.perf_counter() - start) * 1000.0
+            self._pending = None
+            if not logged and total_ms >= self.connection.trace_threshold_ms:
+                self.connection.log_slow_query(sql, parameters, total_ms, rows=len(rows))
+        return rows
+
+    def _observe(self, sql, parameters, elapsed_ms, batch=1):
+        logged = elapsed_ms >= self.connection.trace_threshold_ms
+        if logged:
+            self.connection.log_slow_query(sql, parameters, elapsed_ms, batch=batch)
+        # SELECT rows are produced lazily; fetchall() may still push it over the threshold
+        self._pending = (sql, parameters, elapsed_ms, logged)
+
+
+class TracingConnection(sqlite3.Connection):
+    """sqlite3 connection whose cursors log statements slower than trace_threshold_ms."""
+
+    trace_threshold_ms = 50.0
+    trace_log_path = SLOW_QUERY_LOG
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def log_slow_query(self, sql: str, parameters, elapsed_ms: float, rows: int = None, batch: int = 1):
+        """Capture the plan of a slow statement and append it to the slow-query log."""
+        plan = explain_query_plan(self, sql, parameters)
+        entry = {
+            'ts': datetime.now().isoformat(),
+            'ms': round(elapsed_ms, 3),
+            'sql': normalize_sql(sql),
+            'plan': plan,
+            **analyse_plan(plan),
+        }
+        if rows is not None:
+            entry['rows'] = rows
+        if batch > 1:
+            entry['batch'] = batch
+
+        log_path = Path(self.trace_log_path)
+        log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+
+def connect_traced(db_path: str, threshold_ms: float, log_path: Optional[str] = None, **kwargs) -> TracingConnection:
+    """
+    Open a TracingConnection.
+
+    Args:
+        db_path: SQLite database path
+        threshold_ms: Log statements at or above this latency
+        log_path: JSON-lines log file (default data/slow_queries.jsonl)
+    """
+    conn = sqlite3.connect(db_path, factory=TracingConnection, **kwargs)
+    conn.trace_threshold_ms = threshold_ms
+    if log_path:
+        conn.trace_log_path = log_path
+    return conn
+
+
+def load_slow_queries(log_path: str = SLOW_QUERY_LOG) -> List[Dict[str, Any]]:
+    """Read all entries of a slow-query log (missing file -> empty list)."""
+    path = Path(log_path)
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+    return entries
+
+
+def summarize_slow_queries(log_path: str = SLOW_QUERY_LOG, top: int = 20) -> List[Dict[str, Any]]:
+    """
+    Group slow-query log entries by statement, worst total time first.
+
+    Returns:
+        List of dicts: sql, count, total_ms, avg_ms, max_ms, full_scan, temp_btree, plan
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+
+    for entry in load_slow_queries(log_path):
+        group = groups.get(entry['sql'])
+        if group is None:
+            group = groups[entry['sql']] = {
+                'sql': entry['sql'],
+                'count': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+                'full_scan': set(),
+                'temp_btree': False,
+                'plan': entry['plan'],
+            }
+        group['count'] += 1
+        group['total_ms'] += entry['ms']
+        group['max_ms'] = max(group['max_ms'], entry['ms'])
+        group['full_scan'].update(entry.get('full_scan', []))
+        group['temp_btree'] = group['temp_btree'] or entry.get('temp_btree', False)
+
+    report = sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)[:top]
+    for group in report:
+        group['avg_ms'] = group['total_ms'] / group['count']
+        group['full_scan'] = sorted(group['full_scan'])
+    return report
@@ -0,0 +1,253 @@
+"""
+Telemetry - structured progress events from importers, LPP build and exports.
+
+Code reports what it does through the module functions; where the events go
+is chosen by the caller with session(*sinks):
+    phase(name, total)   context manager: phase_start, then phase_end with
+                         elapsed_ms and the counters added inside it
+    progress(done, msg)  progress within the current phase (fraction done/total)
+    count(name, n)       add to a counter of the current phase
+    detail(msg)          per-row / per-anchor line, only emitted when verbose
+    info(msg), warning(msg)
+Sinks: NullSink, ConsoleSink (default: warnings and one summary per phase),
+JsonlSink (one JSON object per event), ProgressSink (callback(phase, fraction,
+message), used by jobs.py) and StreamlitSink (an st.progress bar).
+
+Sessions are per thread, like perf.start_run(): a job on a worker thread
+reports to its own sinks. Without a session, events go to the default sinks
+(console, plus a JSON-lines log when JSJ_TELEMETRY_LOG is set).
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+
+# Log JSON-lines por defeito (vazio = sem log)
+TELEMETRY_LOG = os.environ.get('JSJ_TELEMETRY_LOG') or None
+
+# Linhas por desenho / âncora na consola
+VERBOSE = False
+
+_state = threading.local()
+
+
+class Sink:
+    """Receives every event dict (event, phase, fraction, message, counters, ...)."""
+
+    def emit(self, event: Dict[str, Any]):
+        raise NotImplementedError
+
+
+class NullSink(Sink):
+    """Discards everything."""
+
+    def emit(self, event: Dict[str, Any]):
+        pass
+
+
+class ConsoleSink(Sink):
+    """Prints warnings, info and a summary line per phase; progress and details only when verbose."""
+
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+
+    def emit(self, event: Dict[str, Any]):
+        kind = event['event']
+        if kind == 'warning':
+            print(f"Aviso: {event['message']}")
+        elif kind in ('info', 'detail'):
+            print(event['message'])
+        elif kind == 'phase_end':
+            counters = ", ".join(f"{name}={value}" for name, value in event['counters'].items())
+            status = "" if event['ok'] else " [interrompida]"
+            print(f"{event['phase']}: {counters or 'ok'} ({event['elapsed_ms']:.0f} ms){status}")
+        elif kind == 'progress' and self.verbose and event.get('message'):
+            print(f"  [{event['phase']}] {event['message']}")
+
+
+class JsonlSink(Sink):
+    """Appends every event as one JSON line (same format family as the slow-query log)."""
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+
+    def emit(self, event: Dict[str, Any]):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False) + '\n')
+
+
+class ProgressSink(Sink):
+    """
+    Forwards phase starts and progress to callback(phase, fraction, message).
+
+    Exceptions raised by the callback propagate to the reporting code
+    (jobs.py cancels a job that way).
+    """
+
+    def __init__(self, callback: Callable[..., None]):
+        self.callback = callback
+
+    def emit(self, event: Dict[str, Any]):
+        if event['event'] in ('phase_start', 'progress'):
+            self.callback(event['phase'], event.get('fraction') or 0.0, event.get('message'))
+
+
+class StreamlitSink(ProgressSink):
+    """Drives an st.progress() bar from the script thread."""
+
+    def __init__(self, bar):
+        def update(phase, fraction, message=None):
+            bar.progress(min(max(fraction, 0.0), 1.0), text=f"{phase} {message or ''}".strip())
+        super().__init__(update)
+
+
+class _Session:
+    def __init__(self, sinks: List[Sink], verbose: bool):
+        self.sinks = sinks
+        self.verbose = verbose
+        self.phases: List[Dict[str, Any]] = []
+        self.counters: Dict[str, int] = {}
+
+
+def default_sinks(verbose: bool = None) -> List[Sink]:
+    """Console sink, plus a JsonlSink when TELEMETRY_LOG is set."""
+    sinks: List[Sink] = [ConsoleSink(VERBOSE if verbose is None else verbose)]
+    if TELEMETRY_LOG:
+        sinks.append(JsonlSink(TELEMETRY_LOG))
+    return sinks
+
+
+def configure(verbose: bool = None, log_path: Optional[str] = None):
+    """
+    Change the defaults used outside of session() (CLI --verbose / --telemetry-log).
+
+    Args:
+        verbose: Emit per-row / per-anchor details
+        log_path: JSON-lines log for every event
+    """
+    global VERBOSE, TELEMETRY_LOG
+    if verbose is not None:
+        VERBOSE = verbose
+    if log_path is not None:
+        TELEMETRY_LOG = log_path
+    _state.default = None
+
+
+def _current() -> _Session:
+    session = getattr(_state, 'session', None)
+    if session is not None:
+        return session
+    default = getattr(_state, 'default', None)
+    if default is None:
+        default = _state.default = _Session(default_sinks(), VERBOSE)
+    return default
+
+
+@contextmanager
+def session(*sinks: Sink, verbose: bool = False):
+    """
+    Send this thread's events to `sinks` inside the block.
+
+    Example:
+        with telemetry.session(StreamlitSink(st.progress(0.0))):
+            export_all_dwgs(conn, "output")
+
+    Args:
+        sinks: Event sinks (none = discard everything)
+        verbose: Emit detail() events
+    """
+    previous = getattr(_state, 'session', None)
+    _state.session = _Session(list(sinks), verbose)
+    try:
+        yield _state.session
+    finally:
+        _state.session = previous
+
+
+def is_verbose() -> bool:
+    """True if detail() events are emitted (guard for costly detail messages)."""
+    return _current().verbose
+
+
+def _emit(current: _Session, kind: str, **fields):
+    event = {'event': kind, 'ts': datetime.now().isoformat(), **fields}
+    for sink in current.sinks:
+        sink.emit(event)
+
+
+@contextmanager
+def phase(name: str, total: Optional[int] = None, message: str = None):
+    """
+    Report a phase: phase_start now, phase_end (elapsed_ms, counters, ok) on exit.
+
+    Args:
+        name: Phase name shown to the user (e.g. 'importar', 'âncoras')
+        total: Number of steps, for progress(done) fractions
+        message: Optional text (e.g. file name)
+
+    Yields:
+        The phase state; state['counters'] holds what count() added so far
+    """
+    current = _current()
+    state = {'name': name, 'total': total, 'counters': {}}
+    current.phases.append(state)
+    started = time.perf_counter()
+    ok = False
+    try:
+        _emit(current, 'phase_start', phase=name, total=total, fraction=0.0, message=message)
+        yield state
+        ok = True
+    finally:
+        current.phases.pop()
+        _emit(
+            current, 'phase_end', phase=name, total=total, ok=ok,
+            elapsed_ms=round((time.perf_counter() - started) * 1000.0, 3), counters=state['counters']
+        )
+
+
+def progress(done: int, message: str = None):
+    """
+    Report progress in the current phase.
+
+    Args:
+        done: Steps completed (fraction = done / total of the phase)
+        message: Optional text (e.g. the item about to be processed)
+    """
+    current = _current()
+    if not current.phases:
+        return
+    state = current.phases[-1]
+    fraction = done / state['total'] if state['total'] else None
+    _emit(current, 'progress', phase=state['name'], done=done, fraction=fraction, message=message)
+
+
+def count(name: str, n: int = 1):
+    """Add n to counter `name` of the current phase (reported in its phase_end)."""
+    current = _current()
+    counters = current.phases[-1]['counters'] if current.phases else current.counters
+    counters[name] = counters.get(name, 0) + n
+
+
+def detail(message: str):
+    """Per-row / per-anchor line; dropped unless the session is verbose."""
+    current = _current()
+    if current.verbose:
+        _emit(current, 'detail', phase=current.phases[-1]['name'] if current.phases else None, message=message)
+
+
+def info(message: str):
+    """Noteworthy result (e.g. output file written)."""
+    current = _current()
+    _emit(current, 'info', phase=current.phases[-1]['name'] if current.phases else None, message=message)
+
+
+def warning(message: str):
+    """Problem the run survived (skipped file, missing columns, ...)."""
+    current = _current()
+    _emit(current, 'warning', phase=current.phases[-1]['name'] if current.phases else None, message=message)
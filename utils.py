@@ -1,10 +1,81 @@
 """
-Utility functions for normalizing TIPO and ELEMENTO values to database keys.
+Utility functions for normalizing TIPO and ELEMENTO values to database keys,
+plus small shared helpers (lazy imports, atomic file writes).
 """
+import importlib.util
+import os
 import re
-from unidecode import unidecode
+import sys
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
 
 
+def lazy_import(name: str):
+    """
+    Return a module that is only really imported on first attribute access.
+    
+    Used for heavy dependencies (e.g. pandas) that are not needed on every
+    code path of an entry point.
+    
+    Args:
+        name: Module name
+        
+    Returns:
+        Module object (lazy if not imported yet)
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+@contextmanager
+def atomic_write_path(path: str):
+    """
+    Write a file atomically: yields a temporary path in the same folder that
+    replaces `path` only if the block succeeds (readers never see a
+    half-written file; on error the previous file is left untouched).
+    
+    Example:
+        with atomic_write_path("output/LPP.xlsx") as tmp_path:
+            wb.save(tmp_path)
+    
+    Args:
+        path: Final file path (parent folders are created)
+        
+    Yields:
+        Temporary file path to write to
+    """
+    target = Path(path)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    # Created by the writer itself, so it gets the usual permissions (mkstemp would make it 0600)
+    tmp_path = str(target.with_name(f".{target.name}.{uuid.uuid4().hex}.tmp"))
+    try:
+        yield tmp_path
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _remove_accents(text: str) -> str:
+    """Transliterate to ASCII; unidecode (and its tables) only loads for non-ASCII text."""
+    if text.isascii():
+        return text
+    from unidecode import unidecode
+    return unidecode(text)
+
+
+@lru_cache(maxsize=4096)
 def normalize_tipo_display_to_key(tipo: str) -> str:
     """
     Normalize TIPO display value to database key.
@@ -24,7 +95,7 @@ def normalize_tipo_display_to_key(tipo: str) -> str:
         return ""
     
     # Remove accents
-    normalized = unidecode(tipo)
+    normalized = _remove_accents(tipo)
     
     # Uppercase
     normalized = normalized.upper()
@@ -38,6 +109,7 @@ def normalize_tipo_display_to_key(tipo: str) -> str:
     return normalized
 
 
+@lru_cache(maxsize=4096)
 def normalize_elemento_to_key(elemento: str) -> str:
     """
     Normalize ELEMENTO value to database key.
@@ -60,7 +132,7 @@ def normalize_elemento_to_key(elemento: str) -> str:
     normalized = elemento.strip()
     
     # Remove accents
-    normalized = unidecode(normalized)
+    normalized = _remove_accents(normalized)
     
     # Uppercase
     normalized = normalized.upper()
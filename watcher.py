@@ -0,0 +1,289 @@
+"""
+Folder watcher - auto-imports new or changed LISP exports from data/csv_in/ and data/json_in/.
+
+Files are debounced (only imported once their size/mtime stop changing) and
+imported through csv_importer / json_importer. Each import is recorded in the
+ficheiros_importados table with its latency from file arrival to DB commit.
+
+Uses watchdog (inotify) to wake up early when it is installed, and falls back
+to pure polling otherwise.
+
+Usage:
+    python watcher.py [--interval 2] [--settle 3] [--once]
+"""
+import argparse
+import hashlib
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Any, Optional
+
+from db import get_connection, criar_tabelas, get_imported_file, prewarm_historico_snapshots, record_imported_file
+from csv_importer import import_single_csv
+from json_importer import import_single_json
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # watchdog is optional, polling works without it
+    Observer = None
+    FileSystemEventHandler = object
+
+
+# Pasta -> padrão de ficheiros a importar
+WATCH_DIRS = {
+    'data/csv_in': '*.csv',
+    'data/json_in': '*.*json*',
+}
+
+# Falhas seguidas antes de desistir de um ficheiro até o seu mtime/tamanho mudar
+IMPORT_MAX_ATTEMPTS = 5
+# Espera entre tentativas: settle * 2^(falhas - 1), no máximo isto
+IMPORT_RETRY_MAX_DELAY_S = 300.0
+
+IMPORTERS = {
+    '.csv': import_single_csv,
+    '.json': import_single_json,
+    '.ndjson': import_single_json,
+    '.jsonl': import_single_json,
+}
+
+
+def file_hash(path: Path) -> str:
+    """Return SHA-1 of file contents."""
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class _WakeHandler(FileSystemEventHandler):
+    """watchdog handler that just wakes up the polling loop."""
+
+    def __init__(self, wake_event: threading.Event):
+        super().__init__()
+        self.wake_event = wake_event
+
+    def on_any_event(self, event):
+        self.wake_event.set()
+
+
+class FolderWatcher:
+    """
+    Polls watched folders and imports files once they are stable.
+
+    A file is considered stable when its size and mtime did not change
+    for `settle` seconds, so partially written exports are never read.
+    """
+
+    def __init__(self, watch_dirs: Dict[str, str] = None, interval: float = 2.0, settle: float = 3.0):
+        self.watch_dirs = watch_dirs or WATCH_DIRS
+        self.interval = interval
+        self.settle = settle
+        # path -> {'arrived_at', 'mtime', 'size', 'stable_since'} (+ 'attempts', 'retry_at' after a failure)
+        self.pending: Dict[str, Dict[str, float]] = {}
+        # path -> (mtime, size) of files already imported (or unchanged) in this session,
+        # or given up on after IMPORT_MAX_ATTEMPTS failures; a new mtime/size imports again
+        self.known: Dict[str, tuple] = {}
+        # Files already in the folders at start-up arrive with the first scan, not at their mtime
+        self.scanned = False
+        self.wake_event = threading.Event()
+
+    def scan(self) -> List[str]:
+        """
+        Scan watched folders and return paths that are stable and ready to import.
+        """
+        now = time.time()
+        seen = set()
+        ready = []
+
+        for folder, pattern in self.watch_dirs.items():
+            folder_path = Path(folder)
+            folder_path.mkdir(parents=True, exist_ok=True)
+
+            for file_path in folder_path.glob(pattern):
+                if file_path.suffix.lower() not in IMPORTERS:
+                    continue
+                try:
+                    stat = file_path.stat()
+                except FileNotFoundError:
+                    continue
+
+                path = str(file_path)
+                seen.add(path)
+                if self.known.get(path) == (stat.st_mtime, stat.st_size):
+                    continue
+                state = self.pending.get(path)
+
+                if state is None or state['mtime'] != stat.st_mtime or state['size'] != stat.st_size:
+                    # New or still being written - (re)start debounce
+                    self.pending[path] = {
+                        'arrived_at': state['arrived_at'] if state else (min(now, stat.st_mtime) if self.scanned else now),
+                        'mtime': stat.st_mtime,
+                        'size': stat.st_size,
+                        'stable_since': now,
+                    }
+                elif now - state['stable_since'] >= self.settle and now >= state.get('retry_at', 0):
+                    ready.append(path)
+
+        # Forget files that disappeared
+        for path in list(self.pending):
+            if path not in seen:
+                del self.pending[path]
+        for path in list(self.known):
+            if path not in seen:
+                del self.known[path]
+
+        self.scanned = True
+        return ready
+
+    def import_file(self, path: str, conn) -> Optional[Dict[str, Any]]:
+        """
+        Import one stable file if it is new, changed or failed last time.
+
+        A failed import is retried with exponential backoff (settle, 2x, 4x...
+        up to IMPORT_RETRY_MAX_DELAY_S). After IMPORT_MAX_ATTEMPTS failures the
+        file is left alone until its mtime or size changes; a restart gives it
+        another round since the error is recorded.
+
+        Returns:
+            Import record dict, or None if the file was unchanged
+        """
+        state = self.pending.pop(path)
+        file_path = Path(path)
+        previous = get_imported_file(conn, path)
+
+        unchanged = previous and previous['mtime'] == state['mtime'] and previous['size'] == state['size']
+        if unchanged and not previous['error']:
+            self.known[path] = (state['mtime'], state['size'])
+            return None
+
+        content_hash = file_hash(file_path)
+        if previous and previous['content_hash'] == content_hash and not previous['error']:
+            # Touched but not changed - just refresh the record
+            record_imported_file(
+                conn, path, state['mtime'], state['size'], content_hash,
+                previous['desenhos_imported'], state['arrived_at'], time.time()
+            )
+            self.known[path] = (state['mtime'], state['size'])
+            return None
+
+        importer = IMPORTERS[file_path.suffix.lower()]
+        error = None
+        desenhos_imported = 0
+
+        try:
+            stats = importer(path, conn)
+            desenhos_imported = stats['desenhos_imported']
+        except Exception as e:
+            error = str(e)
+
+        committed_at = time.time()
+        record_imported_file(
+            conn, path, state['mtime'], state['size'], content_hash,
+            desenhos_imported, state['arrived_at'], committed_at, error
+        )
+        attempts = state.get('attempts', 0) + 1
+        if error is None or attempts >= IMPORT_MAX_ATTEMPTS:
+            self.known[path] = (state['mtime'], state['size'])
+        else:
+            # Latency still counted from its arrival
+            delay = min(self.settle * 2 ** (attempts - 1), IMPORT_RETRY_MAX_DELAY_S)
+            self.pending[path] = {**state, 'attempts': attempts, 'retry_at': committed_at + delay}
+
+        return {
+            'path': path,
+            'desenhos_imported': desenhos_imported,
+            'latency_ms': (committed_at - state['arrived_at']) * 1000.0,
+            'error': error,
+        }
+
+    def poll_once(self) -> List[Dict[str, Any]]:
+        """
+        Run one scan and import every stable, new or changed file.
+
+        Returns:
+            List of import records for files actually imported
+        """
+        ready = self.scan()
+        if not ready:
+            return []
+
+        results = []
+        conn = get_connection()
+        try:
+            criar_tabelas(conn)
+            for path in ready:
+                result = self.import_file(path, conn)
+                if result:
+                    results.append(result)
+            if results:
+                prewarm_historico_snapshots(conn)
+        finally:
+            conn.close()
+
+        return results
+
+    def run(self, stop_event: threading.Event = None):
+        """
+        Watch folders until stop_event is set (or forever).
+        """
+        stop_event = stop_event or threading.Event()
+        observer = None
+
+        if Observer is not None:
+            observer = Observer()
+            handler = _WakeHandler(self.wake_event)
+            for folder in self.watch_dirs:
+                Path(folder).mkdir(parents=True, exist_ok=True)
+                observer.schedule(handler, folder, recursive=False)
+            observer.start()
+
+        print(f"A vigiar: {', '.join(self.watch_dirs)} ({'inotify' if observer else 'polling'})")
+
+        try:
+            while not stop_event.is_set():
+                for result in self.poll_once():
+                    if result['error']:
+                        print(f"Erro ao importar {result['path']}: {result['error']}")
+                    else:
+                        print(
+                            f"Importado {result['path']}: {result['desenhos_imported']} desenhos "
+                            f"({result['latency_ms']:.0f} ms)"
+                        )
+                # Pending files need another scan after `settle`; otherwise wait for an event
+                timeout = min(self.interval, self.settle) if self.pending else self.interval
+                self.wake_event.wait(timeout)
+                self.wake_event.clear()
+        finally:
+            if observer:
+                observer.stop()
+                observer.join()
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description="Importa automaticamente CSV/JSON exportados do AutoCAD.")
+    parser.add_argument('--interval', type=float, default=2.0, help="Intervalo de polling em segundos")
+    parser.add_argument('--settle', type=float, default=3.0, help="Segundos sem alterações antes de importar")
+    parser.add_argument('--once', action='store_true', help="Importa o que estiver estável e termina")
+    args = parser.parse_args(argv)
+
+    watcher = FolderWatcher(interval=args.interval, settle=args.settle)
+
+    if args.once:
+        # First scan only registers files; a second one after `settle` imports them
+        watcher.scan()
+        time.sleep(args.settle)
+        for result in watcher.poll_once():
+            print(result)
+        return
+
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()